@@ -0,0 +1,89 @@
+"""Connections to the gateway of forked workers, direct and brokered.
+
+Forks `workers` processes, as a pre-fork server does, each sending
+`calls` requests to the local stub gateway with its own client or through
+one `ConnectionBroker`. Reports calls/sec and the number of connections
+the gateway accepted.
+
+    $ python benchmarks/bench_broker.py [workers] [calls] [latency] \
+          [connections]
+"""
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ferbuy import http_client
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.broker import BrokerClient, ConnectionBroker
+from ferbuy.resources import Resource
+from ferbuy.tests.stub_gateway import StubGateway
+
+
+class CountingGateway(StubGateway):
+
+    connections = 0
+
+    def process_request(self, request, client_address):
+        with self._lock:
+            self.connections += 1
+        StubGateway.process_request(self, request, client_address)
+
+
+def worker(api_base, broker_path, calls):
+    if broker_path:
+        client = BrokerClient(broker_path)
+    else:
+        client = http_client.new_client()
+    requestor = APIRequestor(site_id=1000, secret='secret',
+                             api_base=api_base, client=client)
+    post_data = Resource._post_data(requestor, 10001, 'DHL:1234')
+    for _ in range(calls):
+        requestor.request('post', '/MarkOrderShipped', post_data)
+
+
+def run(server, broker_path, workers, calls):
+    server.connections = 0
+    processes = [multiprocessing.Process(
+        target=worker, args=(server.api_base, broker_path, calls))
+        for _ in range(workers)]
+    started = time.time()
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+    return workers * calls / (time.time() - started), server.connections
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    calls = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    latency = float(sys.argv[3]) if len(sys.argv) > 3 else 0.005
+    connections = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+
+    server = CountingGateway(secret='secret', latency=latency).start()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'broker.sock')
+    # Only the forking thread runs in the workers, the broker and the
+    # gateway keep serving from this process
+    broker = ConnectionBroker(path, connections=connections,
+                              api_bases=[server.api_base]).start()
+    try:
+        for name, broker_path in (('direct', None), ('broker', path)):
+            rate, accepted = run(server, broker_path, workers, calls)
+            print("{0:<7} {1:>3} workers {2:9.0f} calls/sec  "
+                  "{3:4} gateway connections".format(
+                      name, workers, rate, accepted))
+    finally:
+        broker.stop()
+        server.stop()
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+"""Gateway payloads signed per second.
+
+Compares constructing a `Gateway` per order row with
+`GatewayBuilder.build`, in process and spread over a process pool.
+
+    $ python benchmarks/bench_build_gateway.py [rows] [processes]
+"""
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ferbuy
+
+
+def rows(count):
+    for index in range(count):
+        yield {
+            'reference': 'ORDER-{0}'.format(index),
+            'currency': 'EUR',
+            'amount': 1000 + index,
+            'return_url_ok': 'http://www.your-site.com/success/',
+            'return_url_cancel': 'http://www.your-site.com/failed/',
+            'first_name': 'John',
+            'last_name': 'Doe',
+            'email': 'demo@email.com',
+        }
+
+
+def measure(name, count, func):
+    started = time.time()
+    func()
+    seconds = time.time() - started
+    print("{0:<30} {1:>10.0f} payloads/sec".format(name, count / seconds))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    processes = (int(sys.argv[2]) if len(sys.argv) > 2
+                 else multiprocessing.cpu_count())
+
+    ferbuy.site_id = 1000
+    ferbuy.secret = 'secret'
+    builder = ferbuy.GatewayBuilder()
+
+    def gateways():
+        for row in rows(count):
+            ferbuy.Gateway(dict(row))
+
+    def build():
+        for _ in builder.build(rows(count)):
+            pass
+
+    def build_pool():
+        for _ in builder.build(rows(count), processes=processes):
+            pass
+
+    measure('Gateway', count, gateways)
+    measure('GatewayBuilder.build', count, build)
+    measure('GatewayBuilder.build ({0} proc)'.format(processes), count,
+            build_pool)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Per-call cost of building the request headers in APIRequestor.
+
+Compares the headers built from scratch on every call, as done before
+they were cached, with the cached static headers.
+
+    $ python benchmarks/bench_headers.py
+"""
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ferbuy import utils
+from ferbuy import version
+from ferbuy.api_requestor import APIRequestor
+
+NUMBER = 2000
+
+
+def uncached_headers(method, supplied_headers):
+    add_info = {
+        'bindings_version': version.VERSION,
+        'lang': 'Python',
+        'lang_version': platform.python_version(),
+        'platform': platform.platform()
+    }
+
+    headers = {
+        'X-FerBuy-Client-User-Agent': utils.json.dumps(add_info),
+        'User-Agent': 'FerBuy/v1 PythonBinding/{0}'.format(version.VERSION),
+    }
+
+    if method == 'post':
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+    if supplied_headers is not None:
+        for key, value in supplied_headers.items():
+            headers[key] = value
+
+    return headers
+
+
+def main():
+    requestor = APIRequestor(site_id=1000, secret='secret', client=object())
+    supplied = {'X-Request-Id': 'abc'}
+
+    before = min(timeit.repeat(
+        lambda: uncached_headers('post', supplied),
+        number=NUMBER, repeat=3)) / NUMBER
+    after = min(timeit.repeat(
+        lambda: requestor._request_headers('post', supplied),
+        number=NUMBER, repeat=3)) / NUMBER
+
+    print("uncached: {0:9.2f} us/call".format(before * 1e6))
+    print("cached:   {0:9.2f} us/call".format(after * 1e6))
+    print("speedup:  {0:9.1f}x".format(before / after))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Outbox enqueue latency and drain throughput.
+
+Queues calls into a fresh outbox and drains them against the local stub
+gateway.
+
+    $ python benchmarks/bench_outbox.py [calls] [max_in_flight]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ferbuy
+from ferbuy.outbox import Outbox
+from ferbuy.tests.stub_gateway import StubGateway
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    max_in_flight = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    server = StubGateway(secret='secret').start()
+    directory = tempfile.mkdtemp()
+    ferbuy.site_id = 1000
+    ferbuy.secret = 'secret'
+    ferbuy.api_base = server.api_base
+    outbox = Outbox(os.path.join(directory, 'outbox.db'),
+                    max_in_flight=max_in_flight)
+    try:
+        started = time.time()
+        for index in range(count):
+            outbox.shipped(index, 'DHL', 'TRACK{0}'.format(index))
+        queued = time.time() - started
+
+        started = time.time()
+        outbox.drain()
+        drained = time.time() - started
+    finally:
+        outbox.close()
+        server.stop()
+        shutil.rmtree(directory)
+
+    print("enqueue: {0:9.1f} us/call".format(queued / count * 1e6))
+    print("drain:   {0:9.0f} calls/sec".format(count / drained))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Gateway form renders per second.
+
+Compares the `render` property, which concatenates the hidden inputs on
+every access, with the escaped and cached `render_fields` and
+`render_form`, for a page rendering the same gateway repeatedly and for
+data changing between renders.
+
+    $ python benchmarks/bench_render.py
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ferbuy
+
+NUMBER = 5000
+
+
+def gateway():
+    return ferbuy.Gateway({
+        'reference': 'ORDER-12345',
+        'currency': 'EUR',
+        'amount': 10000,
+        'return_url_ok': 'http://www.your-site.com/success/',
+        'return_url_cancel': 'http://www.your-site.com/failed/',
+        'first_name': 'John',
+        'last_name': 'Doe',
+        'address': 'Business Center',
+        'postal_code': 'SLM000',
+        'city': 'Landville',
+        'country_iso': 'US',
+        'email': 'demo@email.com',
+    }, site_id=1000, secret='secret')
+
+
+def main():
+    page = gateway()
+
+    def changed(render):
+        def run():
+            page.data['amount'] += 1
+            render()
+        return run
+
+    cases = [
+        ('render', lambda: page.render),
+        ('render_fields', page.render_fields),
+        ('render_form', page.render_form),
+        ('render (data changed)', changed(lambda: page.render)),
+        ('render_fields (data changed)', changed(page.render_fields)),
+        ('render_form (data changed)', changed(page.render_form)),
+    ]
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=NUMBER, repeat=3))
+        print("{0:<30} {1:>10.0f} renders/sec".format(
+            name, NUMBER / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""APIRequestor throughput against a recording of the local stub gateway.
+
+Records calls against the stub gateway once, then replays them through
+`APIRequestor` without delay and at the recorded latency.
+
+    $ python benchmarks/bench_replay.py [calls] [transactions]
+"""
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.replay import RecordingClient, ReplayClient
+from ferbuy.resources import Resource
+from ferbuy.tests.stub_gateway import StubGateway
+
+
+def call(requestor, transaction_id):
+    post_data = Resource._post_data(requestor, transaction_id, 'DHL:1234')
+    return requestor.request('post', '/MarkOrderShipped', post_data)
+
+
+def run(client, count, transactions, api_base):
+    requestor = APIRequestor(site_id=1000, secret='secret',
+                             api_base=api_base, client=client)
+    started = time.time()
+    for index in range(count):
+        call(requestor, index % transactions)
+    return count / (time.time() - started)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    transactions = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    server = StubGateway(secret='secret').start()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'calls.jsonl')
+    try:
+        recorder = RecordingClient(path)
+        recorded = run(recorder, transactions, transactions, server.api_base)
+        recorder.close()
+
+        replayed = run(ReplayClient(path, speed=0), count, transactions,
+                       server.api_base)
+        realtime = run(ReplayClient(path), transactions, transactions,
+                       server.api_base)
+    finally:
+        server.stop()
+        shutil.rmtree(directory)
+
+    print("stub gateway:     {0:9.0f} calls/sec".format(recorded))
+    print("replay, speed 0:  {0:9.0f} calls/sec".format(replayed))
+    print("replay, speed 1:  {0:9.0f} calls/sec".format(realtime))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Offline signing throughput of `BatchSigner` by number of processes.
+
+Signs gateway payloads and API requests and verifies callbacks in-process
+and with pools of 2, 4, ... processes up to the number of CPUs.
+
+    $ python benchmarks/bench_signing.py [items] [max_processes]
+"""
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ferbuy.signing import BatchSigner
+
+SECRET = 'secret'
+
+
+def rows(count):
+    for index in range(count):
+        yield {
+            'reference': 'ORDER-{0}'.format(index),
+            'currency': 'EUR',
+            'amount': 1000 + index,
+            'first_name': 'John',
+            'last_name': 'Doe',
+        }
+
+
+def requests(count):
+    for index in range(count):
+        yield {'transaction_id': 10000 + index, 'command': 'DHL:1234',
+               'output_type': 'json'}
+
+
+def callbacks(count):
+    for index in range(count):
+        post_data = {
+            'reference': 'ORDER-{0}'.format(index),
+            'transaction_id': str(10000 + index),
+            'status': '200',
+            'currency': 'EUR',
+            'amount': '1000',
+        }
+        signature = '&'.join(['test'] + [
+            post_data[field] for field in ('reference', 'transaction_id',
+                                           'status', 'currency', 'amount')
+        ] + [SECRET])
+        post_data['checksum'] = hashlib.sha1(
+            signature.encode('utf-8')).hexdigest()
+        yield post_data
+
+
+def measure(signer, method, items):
+    started = time.time()
+    count = 0
+    for _ in getattr(signer, method)(items):
+        count += 1
+    return count / (time.time() - started)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    max_processes = (int(sys.argv[2]) if len(sys.argv) > 2
+                     else multiprocessing.cpu_count())
+
+    counts = [1]
+    while counts[-1] * 2 <= max_processes:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != max_processes:
+        counts.append(max_processes)
+
+    print("{0:>9} {1:>14} {2:>14} {3:>14}".format(
+        'processes', 'payloads/sec', 'requests/sec', 'callbacks/sec'))
+    for processes in counts:
+        with BatchSigner(site_id=1000, secret=SECRET, env='test',
+                         processes=processes, min_batch=0) as signer:
+            # The pool is started outside of the measurements
+            list(signer.sign(rows(processes)))
+            print("{0:>9} {1:>14.0f} {2:>14.0f} {3:>14.0f}".format(
+                processes, measure(signer, 'sign', rows(count)),
+                measure(signer, 'sign_requests', requests(count)),
+                # Generating signed callbacks costs as much as verifying
+                measure(signer, 'verify_callbacks',
+                        list(callbacks(count)))))
+
+
+if __name__ == '__main__':
+    main()
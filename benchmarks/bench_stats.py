@@ -0,0 +1,75 @@
+"""Overhead of the request statistics kept by APIRequestor.
+
+Times `StatsCollector.record` on its own and a full `APIRequestor.request`
+against an in-memory client with and without the collector.
+
+    $ python benchmarks/bench_stats.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.hooks import RequestContext
+from ferbuy.http_client import HTTPClient, HTTPResponse
+from ferbuy.stats import StatsCollector
+
+RESPONSE = HTTPResponse(
+    b'{"api":{"response":{"message":"ok","code":200}}}', 200,
+    timings={'connect': 0.0, 'wait': 0.004, 'transfer': 0.0001})
+
+
+class MemoryClient(HTTPClient):
+
+    def request(self, method, url, headers, data=None):
+        return RESPONSE
+
+
+class NoStats(StatsCollector):
+
+    def record(self, context):
+        pass
+
+
+def per_call(func, iterations):
+    started = time.time()
+    for _ in range(iterations):
+        func()
+    return (time.time() - started) / iterations * 1e6
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+
+    collector = StatsCollector()
+    context = RequestContext('post', '/MarkOrderShipped')
+    context.status_code = 200
+    context.timings = dict(RESPONSE.timings)
+    # Calls slower than the slowest ones kept cost more, they are rare
+    context.started -= 60
+    slow = per_call(lambda: collector.record(context), collector.slowest)
+    context.started += 60
+    record = per_call(lambda: collector.record(context), iterations)
+
+    requestor = APIRequestor(site_id=1000, secret='secret',
+                             client=MemoryClient())
+    data = {'transaction_id': 10001, 'command': 'DHL:1234'}
+
+    def request():
+        requestor.request('post', '/MarkOrderShipped', data)
+
+    requestor.stats_collector = NoStats()
+    without = per_call(request, iterations // 4)
+    requestor.stats_collector = StatsCollector()
+    with_stats = per_call(request, iterations // 4)
+
+    print("record slow call:      {0:6.2f} us/call".format(slow))
+    print("record:                {0:6.2f} us/call".format(record))
+    print("request without stats: {0:6.2f} us/call".format(without))
+    print("request with stats:    {0:6.2f} us/call".format(with_stats))
+
+
+if __name__ == '__main__':
+    main()
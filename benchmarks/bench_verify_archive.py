@@ -0,0 +1,97 @@
+"""Archived callbacks re-verified per second.
+
+Writes an archive of signed callbacks as CSV and JSON lines, then
+compares `Gateway.verify_callback` on every row of a `csv.DictReader`
+with `ArchiveVerifier`, which verifies columns of a chunk of rows.
+
+    $ python benchmarks/bench_verify_archive.py [rows] [chunksize]
+"""
+import csv
+import hashlib
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ferbuy
+from ferbuy.archive import ArchiveVerifier, _open
+
+FIELDS = ('site_id', 'reference', 'transaction_id', 'status', 'currency',
+          'amount', 'checksum')
+
+
+def callback(index):
+    post_data = {
+        'site_id': '1000',
+        'reference': 'ORDER-{0}'.format(index),
+        'transaction_id': str(100000 + index),
+        'status': '200',
+        'currency': 'EUR',
+        'amount': str(1000 + index % 5000),
+    }
+    signature = '&'.join(['test'] + [
+        post_data[field] for field in FIELDS[1:-1]] + ['secret'])
+    post_data['checksum'] = hashlib.sha1(
+        signature.encode('utf-8')).hexdigest()
+    return post_data
+
+
+def write(directory, rows):
+    csv_path = os.path.join(directory, 'callbacks.csv')
+    jsonl_path = os.path.join(directory, 'callbacks.jsonl')
+    with io.open(csv_path, 'w', encoding='utf-8') as csv_file:
+        with io.open(jsonl_path, 'w', encoding='utf-8') as jsonl_file:
+            csv_file.write(u','.join(FIELDS) + u'\n')
+            for index in range(rows):
+                post_data = callback(index)
+                csv_file.write(u','.join(
+                    post_data[field] for field in FIELDS) + u'\n')
+                jsonl_file.write(u'{0}\n'.format(json.dumps(post_data)))
+    return csv_path, jsonl_path
+
+
+def measure(name, rows, func):
+    started = time.time()
+    invalid = func()
+    seconds = time.time() - started
+    assert invalid == 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print("{0:<32} {1:>10.0f} rows/sec  peak RSS {2} kB".format(
+        name, rows / seconds, rss))
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+    chunksize = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+
+    ferbuy.env = 'test'
+    ferbuy.secret = 'secret'
+    verifier = ArchiveVerifier(secret='secret', chunksize=chunksize)
+
+    directory = tempfile.mkdtemp()
+    try:
+        csv_path, jsonl_path = write(directory, rows)
+
+        def per_row():
+            with _open(csv_path) as fileobj:
+                return sum(1 for post_data in csv.DictReader(fileobj)
+                           if not ferbuy.Gateway.verify_callback(post_data))
+
+        def archive(path):
+            return lambda: len(list(verifier.verify_file(path)))
+
+        measure('Gateway.verify_callback (CSV)', rows, per_row)
+        measure('ArchiveVerifier (CSV)', rows, archive(csv_path))
+        measure('ArchiveVerifier (JSON lines)', rows, archive(jsonl_path))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Callbacks verified per second.
+
+Compares `Gateway.verify_callback` with a `CallbackVerifier` holding the
+secrets of several sites, verifying one callback at a time and in
+batches with `verify_many`.
+
+    $ python benchmarks/bench_verify_callback.py
+"""
+import hashlib
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ferbuy
+from ferbuy.gateway import CallbackVerifier
+
+NUMBER = 10000
+SITES = 10
+
+
+def callback(index):
+    site_id = 1000 + index % SITES
+    post_data = {
+        'site_id': str(site_id),
+        'reference': 'ORDER-{0}'.format(index),
+        'transaction_id': str(100000 + index),
+        'status': '200',
+        'currency': 'EUR',
+        'amount': str(index * 10),
+    }
+    signature = '&'.join([
+        'live', post_data['reference'], post_data['transaction_id'],
+        post_data['status'], post_data['currency'], post_data['amount'],
+        'secret {0}'.format(site_id)])
+    post_data['checksum'] = hashlib.sha1(
+        signature.encode('utf-8')).hexdigest()
+    return post_data
+
+
+def main():
+    callbacks = [callback(index) for index in range(NUMBER)]
+    verifier = CallbackVerifier(
+        secrets=dict((1000 + site, 'secret {0}'.format(1000 + site))
+                     for site in range(SITES)), env='live')
+
+    def verify_callback():
+        for post_data in callbacks:
+            ferbuy.secret = 'secret {0}'.format(post_data['site_id'])
+            ferbuy.Gateway.verify_callback(post_data)
+
+    def verify():
+        for post_data in callbacks:
+            verifier.verify(post_data)
+
+    def verify_many():
+        verifier.verify_many(callbacks)
+
+    ferbuy.env = 'live'
+    assert all(verifier.verify_many(callbacks))
+
+    for name, func in [('Gateway.verify_callback', verify_callback),
+                       ('CallbackVerifier.verify', verify),
+                       ('CallbackVerifier.verify_many', verify_many)]:
+        seconds = min(timeit.repeat(func, number=1, repeat=5))
+        print("{0:<30} {1:>10.0f} callbacks/sec".format(
+            name, NUMBER / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,243 @@
+"""Throughput benchmark of the HTTP clients against a local stub gateway.
+
+Every combination of HTTP client and concurrency level is measured in a
+fresh interpreter, so CPU time and peak RSS belong to that run only. The
+stub gateway runs in this process and answers with the FerBuy JSON
+envelopes after the configured latency.
+
+    $ python benchmarks/run.py --requests 1000 --concurrency 1,8,32 \\
+          --latency 0.005 --output results.json
+
+Pass the output of an earlier run as `--baseline` to fail when calls/sec
+drop or p99 latency grows by more than `--tolerance`.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import ferbuy
+from ferbuy import http_client
+from ferbuy import version
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.tests.stub_gateway import StubGateway
+
+SITE_ID = 1000
+SECRET = 'benchmark secret'
+
+
+def urllib_client():
+    if sys.version_info >= (3, 0):
+        return http_client.Urllib3Client()
+    return http_client.Urllib2Client()
+
+
+CLIENTS = {
+    'requests': http_client.RequestsClient,
+    'urllib': urllib_client,
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+def measure(client_name, concurrency, requests, api_base, warmup):
+    """Run one benchmark in this process and return its result."""
+    ferbuy.site_id = SITE_ID
+    ferbuy.secret = SECRET
+    ferbuy.api_base = api_base
+    APIRequestor.register(APIRequestor(
+        site_id=SITE_ID, secret=SECRET, api_base=api_base,
+        client=CLIENTS[client_name]()))
+
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def call(index):
+        started = time.time()
+        try:
+            ferbuy.Order.shipped(index, 'DHL', 'TRACK{0}'.format(index))
+        except ferbuy.errors.FerbuyError:
+            with lock:
+                errors[0] += 1
+        latencies.append(time.time() - started)
+
+    for index in range(warmup):
+        try:
+            ferbuy.Order.shipped(index, 'DHL', 'WARMUP')
+        except ferbuy.errors.FerbuyError:
+            pass
+    del latencies[:]
+
+    cpu_started = cpu_time()
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(requests)))
+    elapsed = time.time() - started
+    cpu = cpu_time() - cpu_started
+
+    return {
+        'client': client_name,
+        'concurrency': concurrency,
+        'calls': requests,
+        'errors': errors[0],
+        'seconds': elapsed,
+        'calls_per_sec': requests / elapsed,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'cpu_ms_per_call': cpu / requests * 1000,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def run_worker(client_name, concurrency, args, api_base):
+    command = [
+        sys.executable, os.path.abspath(__file__), '--worker',
+        '--clients', client_name, '--concurrency', str(concurrency),
+        '--requests', str(args.requests), '--warmup', str(args.warmup),
+        '--api-base', api_base,
+    ]
+    output = subprocess.check_output(command)
+    return json.loads(output.decode('utf-8'))
+
+
+def compare(results, baseline, tolerance):
+    """Return descriptions of the results worse than the baseline."""
+    previous = dict(((r['client'], r['concurrency']), r)
+                    for r in baseline['results'])
+    regressions = []
+    for result in results:
+        before = previous.get((result['client'], result['concurrency']))
+        if before is None:
+            continue
+        slowest = before['calls_per_sec'] * (1 - tolerance)
+        if result['calls_per_sec'] < slowest:
+            regressions.append(
+                '{0}/{1}: {2:.0f} calls/sec, was {3:.0f}'.format(
+                    result['client'], result['concurrency'],
+                    result['calls_per_sec'], before['calls_per_sec']))
+        if result['p99_ms'] > before['p99_ms'] * (1 + tolerance):
+            regressions.append('{0}/{1}: p99 {2:.2f}ms, was {3:.2f}ms'.format(
+                result['client'], result['concurrency'],
+                result['p99_ms'], before['p99_ms']))
+    return regressions
+
+
+def print_table(results):
+    print("{0:<10} {1:>5} {2:>10} {3:>9} {4:>9} {5:>9} {6:>10} {7:>7}".format(
+        'client', 'conc', 'calls/sec', 'p50 ms', 'p99 ms', 'cpu ms',
+        'rss kB', 'errors'))
+    for r in results:
+        print("{0:<10} {1:>5} {2:>10.0f} {3:>9.2f} {4:>9.2f} {5:>9.3f} "
+              "{6:>10} {7:>7}".format(
+                  r['client'], r['concurrency'], r['calls_per_sec'],
+                  r['p50_ms'], r['p99_ms'], r['cpu_ms_per_call'],
+                  r['peak_rss_kb'], r['errors']))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--clients', default=','.join(sorted(CLIENTS)),
+                        help='comma separated HTTP clients to measure')
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='comma separated numbers of worker threads')
+    parser.add_argument('--requests', type=int, default=500,
+                        help='calls per run')
+    parser.add_argument('--warmup', type=int, default=20,
+                        help='calls made before measuring')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds the stub delays each response')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='share of calls the stub fails')
+    parser.add_argument('--response-size', type=int, default=0,
+                        help='minimum length of the response message')
+    parser.add_argument('--output', help='write the results as JSON')
+    parser.add_argument('--baseline', help='JSON output of an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed relative regression (default 0.2)')
+    parser.add_argument('--worker', action='store_true',
+                        help=argparse.SUPPRESS)
+    parser.add_argument('--api-base', help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    clients = args.clients.split(',')
+    levels = [int(level) for level in args.concurrency.split(',')]
+
+    if args.worker:
+        result = measure(clients[0], levels[0], args.requests,
+                         args.api_base, args.warmup)
+        sys.stdout.write(json.dumps(result))
+        return 0
+
+    server = StubGateway(latency=args.latency, error_rate=args.error_rate,
+                         response_size=args.response_size,
+                         secret=SECRET).start()
+    try:
+        results = [run_worker(client, level, args, server.api_base)
+                   for client in clients for level in levels]
+    finally:
+        server.stop()
+
+    print_table(results)
+
+    report = {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'ferbuy': version.VERSION,
+        },
+        'settings': {
+            'requests': args.requests,
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'response_size': args.response_size,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION {0}".format(regression))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,5 @@
 # FerBuy Python binding
+import sys
 
 site_id = None
 secret = None
@@ -7,6 +8,71 @@ env = 'live'
 gateway_base = 'https://gateway.ferbuy.com'
 api_base = 'https://gateway.ferbuy.com/api'
 
-# Resources
-from resources import Order, Transaction
-from gateway import Gateway
+# Retries, a ferbuy.retry.RetryPolicy used by all requestors
+retry_policy = None
+
+# Client-side rate limiting, a ferbuy.ratelimit.RateLimiter
+rate_limiter = None
+
+# Merging of identical concurrent requests, a
+# ferbuy.singleflight.SingleFlight used by all requestors
+single_flight = None
+
+# Hooks called for every request, see ferbuy.hooks.RequestHook
+request_hooks = []
+
+# Responses larger than this many bytes are rejected with a
+# ferbuy.errors.ResponseTooLargeError, None reads bodies of any size
+max_body_size = 1024 * 1024
+
+# Bytes of a response body kept in errors and in log lines
+max_logged_body_size = 2048
+
+# Unix socket of a ferbuy.broker.ConnectionBroker, clients created by
+# new_client() send their requests through it when set
+broker_path = None
+
+# Log the request statistics of every requestor this often, in seconds
+stats_dump_interval = None
+
+# Batch calls
+max_in_flight = 10
+item_timeout = None
+
+# Resources, imported on first access where the interpreter supports
+# module __getattr__ (PEP 562), so `import ferbuy` stays cheap and the
+# HTTP stack is only loaded by processes making API calls. Python < 3.7
+# imports them with the package; their thread and process pools are
+# still only imported when used.
+_lazy = {
+    'Order': 'ferbuy.resources',
+    'Transaction': 'ferbuy.resources',
+    'Gateway': 'ferbuy.gateway',
+    'GatewayBuilder': 'ferbuy.gateway',
+    'CallbackVerifier': 'ferbuy.gateway',
+    'BatchSigner': 'ferbuy.signing',
+}
+
+if sys.version_info >= (3, 7):
+    import importlib
+
+    def __getattr__(name):
+        if name in _lazy:
+            value = getattr(importlib.import_module(_lazy[name]), name)
+        else:
+            try:
+                value = importlib.import_module('ferbuy.' + name)
+            except ImportError as e:
+                if e.name != 'ferbuy.' + name:
+                    raise
+                raise AttributeError(
+                    "module 'ferbuy' has no attribute {0!r}".format(name))
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(list(globals()) + list(_lazy))
+else:
+    from ferbuy.resources import Order, Transaction
+    from ferbuy.gateway import Gateway, GatewayBuilder, CallbackVerifier
+    from ferbuy.signing import BatchSigner
@@ -0,0 +1,400 @@
+"""Asyncio support for the FerBuy API binding.
+
+This module requires Python 3.5+ and is not imported by the `ferbuy`
+package itself. The HTTP transport uses aiohttp when it is installed and
+falls back to running the blocking HTTP client in a thread pool.
+"""
+import asyncio
+import textwrap
+import threading
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+
+import ferbuy
+from ferbuy import errors
+from ferbuy import utils
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.callbacks import CallbackEndpoint
+from ferbuy.hooks import RequestContext, emit
+from ferbuy.http_client import CHUNK_SIZE, ResponseBody, new_client
+from ferbuy.resources import Resource, Order, Transaction
+from ferbuy.retry import RetryState
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+_lock = threading.Lock()
+_clients = {}
+
+
+def new_async_client(*args, **kwargs):
+    if aiohttp:
+        client = AiohttpClient
+    else:
+        client = ExecutorClient
+    return client(*args, **kwargs)
+
+
+def shared_async_client(api_base):
+    """Return the asynchronous HTTP client for `api_base`."""
+    with _lock:
+        client = _clients.get(api_base)
+        if client is None:
+            client = _clients[api_base] = new_async_client()
+    return client
+
+
+class AsyncHTTPClient(object):
+
+    # Maximum response body in bytes, `ferbuy.max_body_size` when None
+    max_body_size = None
+
+    async def request(self, method, url, headers, data=None):
+        raise NotImplementedError('AsyncHTTPClient subclasses must '
+                                  'implement "request" method')
+
+    def _body_limit(self):
+        if self.max_body_size is not None:
+            return self.max_body_size
+        return ferbuy.max_body_size
+
+    async def close(self):
+        pass
+
+
+class AiohttpClient(AsyncHTTPClient):
+    """Asynchronous HTTP client backed by `aiohttp`.
+
+    One `aiohttp.ClientSession`, and with it one connection pool, is kept
+    per event loop, so the client can be shared between loops running in
+    different threads.
+
+    Args:
+        connect_timeout (float): Seconds to wait for a connection.
+        read_timeout (float): Seconds to wait for the server to respond.
+        pool_maxsize (int): Maximum open connections per event loop.
+        keep_alive (bool): Reuse connections between requests.
+        max_body_size (int): Reject responses larger than this many bytes,
+            `ferbuy.max_body_size` by default.
+    """
+
+    name = 'aiohttp'
+
+    def __init__(self, connect_timeout=10, read_timeout=80,
+                 pool_maxsize=100, keep_alive=True, max_body_size=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.max_body_size = max_body_size
+
+        self._sessions = weakref.WeakKeyDictionary()
+
+    @property
+    def session(self):
+        loop = asyncio.get_event_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_maxsize, force_close=not self.keep_alive)
+            timeout = aiohttp.ClientTimeout(
+                connect=self.connect_timeout, sock_read=self.read_timeout)
+            session = aiohttp.ClientSession(
+                connector=connector, timeout=timeout)
+            self._sessions[loop] = session
+        return session
+
+    async def close(self):
+        session = self._sessions.pop(asyncio.get_event_loop(), None)
+        if session is not None:
+            await session.close()
+
+    async def request(self, method, url, headers, data=None):
+        try:
+            async with self.session.request(
+                    method, url, headers=headers, data=data) as result:
+                status_code = result.status
+                content = await self._read(result)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.handle_error(e)
+        return content, status_code
+
+    async def _read(self, result):
+        try:
+            body = ResponseBody(result.status, self._body_limit(),
+                                result.headers.get('Content-Length'))
+            async for chunk in result.content.iter_chunked(CHUNK_SIZE):
+                body.append(chunk)
+        except errors.ResponseTooLargeError:
+            # Drop the connection instead of reading the rest of the body
+            result.close()
+            raise
+        return body.content
+
+    def handle_error(self, e):
+        msg = ("Unexpected error communicating with FerBuy. "
+               "If this problem persists, let us know at "
+               "support@ferbuy.com.")
+        err = "{0}: {1}".format(e.__class__.__name__, e)
+        msg = textwrap.fill(msg + "\n\n(Network error: {0})".format(err))
+        raise errors.APIConnectionError(msg)
+
+
+class ExecutorClient(AsyncHTTPClient):
+    """Run a blocking `HTTPClient` in a thread pool.
+
+    Used when aiohttp is not installed. Requests still share the blocking
+    client's connection pool.
+
+    Args:
+        client (HTTPClient): Blocking client, defaults to `new_client()`.
+        max_workers (int): Number of threads serving requests.
+    """
+
+    name = 'executor'
+
+    def __init__(self, client=None, max_workers=10):
+        self.client = client or new_client()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    async def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def request(self, method, url, headers, data=None):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, self.client.request, method, url, headers, data)
+
+
+class AsyncAPIRequestor(APIRequestor):
+
+    def __init__(self, site_id=None, secret=None, api_base=None, client=None,
+                 retry_policy=None, rate_limiter=None, hooks=None):
+        api_base = api_base or ferbuy.api_base
+        super(AsyncAPIRequestor, self).__init__(
+            site_id, secret, api_base,
+            client or shared_async_client(api_base), retry_policy,
+            rate_limiter, hooks)
+
+    async def request(self, method, url, data=None, headers=None,
+                      idempotent=True):
+        context = RequestContext(method.lower(), url, RetryState())
+        hooks = self._hooks()
+        emit(hooks, 'before_request', context)
+        try:
+            response, status_code = await self.api_call(
+                context.method, url, data, headers, idempotent,
+                context.retry_state, context)
+            result = self._process_timed(context, response, status_code)
+        except errors.FerbuyError as e:
+            e.retry_state = context.retry_state
+            context.error = e
+            emit(hooks, 'on_error', context, e)
+            raise
+        result._retry_state = context.retry_state
+        emit(hooks, 'after_response', context)
+        return result
+
+    async def api_call(self, method, url, data, supplied_headers,
+                       idempotent=True, retry_state=None, context=None):
+        abs_url, headers, post_data = self._prepare_request(
+            method, url, data, supplied_headers)
+
+        state = retry_state or RetryState()
+        if context is None:
+            context = RequestContext(method, url, state)
+        hooks = self._hooks()
+        policy = self._retry_policy()
+
+        def on_retry(state, delay):
+            emit(hooks, 'on_retry', context, delay)
+
+        # Same decisions as RetryPolicy.call, waiting without blocking
+        while True:
+            state.attempts += 1
+            limiter = self._rate_limiter()
+            if limiter is not None:
+                wait = limiter.reserve()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+            self._start_attempt(context, post_data)
+            try:
+                response = await self.client.request(
+                    method, abs_url, headers, post_data)
+            except errors.APIConnectionError as e:
+                delay = policy.after_attempt(state, error=e,
+                                             idempotent=idempotent,
+                                             on_retry=on_retry)
+                if delay is None:
+                    raise
+            else:
+                self._record_response(context, response)
+                delay = policy.after_attempt(state, response=response,
+                                             idempotent=idempotent,
+                                             on_retry=on_retry)
+                if delay is None:
+                    break
+            await asyncio.sleep(delay)
+
+        response, status_code = response
+        self._log_response(abs_url, response, status_code)
+
+        return response, status_code
+
+
+class AsyncOrder(Resource):
+
+    @staticmethod
+    async def shipped(transaction_id, courier, tracking_number,
+                      site_id=None, secret=None, api_base=None):
+        """Awaitable version of `Order.shipped`."""
+        requestor = AsyncAPIRequestor.for_site(site_id, secret, api_base)
+
+        post_data = Resource._post_data(
+            requestor, transaction_id,
+            Order._shipped_command(courier, tracking_number))
+
+        return await requestor.request('post', '/MarkOrderShipped', post_data)
+
+    @staticmethod
+    async def delivered(transaction_id, date, site_id=None, secret=None,
+                        api_base=None):
+        """Awaitable version of `Order.delivered`."""
+        command = Order._delivered_command(date)
+
+        requestor = AsyncAPIRequestor.for_site(site_id, secret, api_base)
+
+        post_data = Resource._post_data(requestor, transaction_id, command)
+
+        return await requestor.request('post', '/ConfirmDelivery', post_data)
+
+
+class AsyncTransaction(Resource):
+
+    @staticmethod
+    async def refund(transaction_id, amount, currency, site_id=None,
+                     secret=None, api_base=None):
+        """Awaitable version of `Transaction.refund`."""
+        requestor = AsyncAPIRequestor.for_site(site_id, secret, api_base)
+
+        post_data = Resource._post_data(
+            requestor, transaction_id,
+            Transaction._refund_command(amount, currency))
+
+        return await requestor.request(
+            'post', '/RefundTransaction', post_data, idempotent=False)
+
+
+class AsyncCallbackApp(CallbackEndpoint):
+    """ASGI application receiving FerBuy callbacks.
+
+    The asynchronous counterpart of `ferbuy.callbacks.CallbackApp`: the
+    handler is a coroutine function served by `workers` tasks on the
+    application's event loop.
+
+    Args:
+        handler (callable): Coroutine function called with the POST data
+            of every verified callback.
+        verifier (CallbackVerifier): Verifies callbacks of several sites,
+            by default they are verified with the module settings.
+        workers (int): Number of worker tasks.
+        queue_size (int): Callbacks which may wait for a worker, further
+            callbacks are answered with 503 so FerBuy delivers them again.
+        dedup_size (int): Callbacks remembered for deduplication.
+        dedup_ttl (float): Seconds a callback is remembered.
+        max_body_size (int): Larger callbacks are rejected with 413, None
+            accepts bodies of any size.
+    """
+
+    def __init__(self, handler, verifier=None, workers=4, queue_size=1000,
+                 dedup_size=10000, dedup_ttl=3600, max_body_size=64 * 1024):
+        super().__init__(verifier, dedup_size, dedup_ttl, max_body_size)
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue = None
+        self._tasks = []
+
+    def _start(self):
+        # The queue and the workers belong to the loop serving the app
+        if self.queue is None:
+            self.queue = asyncio.Queue(self.queue_size)
+            self._tasks = [asyncio.ensure_future(self._work())
+                           for _ in range(self.workers)]
+
+    async def _work(self):
+        while True:
+            post_data = await self.queue.get()
+            try:
+                await self.handler(post_data)
+            except Exception:
+                utils.logger.exception(
+                    "Callback handler failed for transaction {0}".format(
+                        post_data.get('transaction_id')))
+            finally:
+                self.queue.task_done()
+
+    def submit(self, post_data):
+        self._start()
+        try:
+            self.queue.put_nowait(post_data)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def join(self):
+        """Wait until every queued callback was handled."""
+        if self.queue is not None:
+            await self.queue.join()
+
+    async def close(self):
+        """Stop the workers after the queued callbacks were handled."""
+        await self.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.queue = None
+        self._tasks = []
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                self._start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self._lifespan(receive, send)
+
+        if scope['method'] not in ('POST', 'PUT'):
+            status, body = 405, b'Method not allowed'
+        else:
+            chunks = []
+            size = 0
+            more_body = True
+            while more_body and not self.too_large(size):
+                message = await receive()
+                chunks.append(message.get('body', b''))
+                size += len(chunks[-1])
+                more_body = message.get('more_body', False)
+            # Bodies over the limit are answered with 413 by `process`
+            status, body = self.process(b''.join(chunks))
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'text/plain'),
+                (b'content-length', str(len(body)).encode('ascii')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
@@ -1,30 +1,160 @@
 import ferbuy
-import hashlib
+import logging
 import platform
-import urllib
+import threading
+import time
 
 from ferbuy import errors
 from ferbuy import utils
 from ferbuy import version
+from ferbuy.gateway import RequestSigner
+from ferbuy.hooks import RequestContext, emit
 from ferbuy.http_client import new_client
-from ferbuy.utils import Singleton
+from ferbuy.retry import NO_RETRY, RetryState
+from ferbuy.stats import StatsCollector
+
+try:
+    from urllib import urlencode
+except ImportError:
+    from urllib.parse import urlencode
+
+try:
+    from collections.abc import ItemsView, ValuesView
+except ImportError:
+    from collections import ItemsView, ValuesView
+
+_lock = threading.RLock()
+_requestors = {}
+_clients = {}
+
+
+def shared_client(api_base):
+    """Return the HTTP client, and its connection pool, for `api_base`."""
+    client = _clients.get(api_base)
+    if client is None:
+        with _lock:
+            client = _clients.get(api_base)
+            if client is None:
+                client = _clients[api_base] = new_client()
+    return client
+
+
+_headers = {}
+
+
+def _static_headers(method):
+    """Return the headers sent with every request using `method`.
+
+    They are computed once, `platform.platform()` in particular is slow.
+    """
+    headers = _headers.get(method)
+    if headers is None:
+        add_info = {
+            'bindings_version': version.VERSION,
+            'lang': 'Python',
+            'lang_version': platform.python_version(),
+            'platform': platform.platform()
+        }
+
+        headers = {
+            'X-FerBuy-Client-User-Agent': utils.json.dumps(add_info),
+            'User-Agent': 'FerBuy/v1 PythonBinding/{0}'.format(
+                version.VERSION),
+        }
+
+        if method == 'post':
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        _headers[method] = headers
+    return headers
 
 
 class FerbuyObject(dict):
+    """Dictionary with attribute access to the values of an API response.
+
+    Nested dictionaries, also inside lists, are only wrapped in a
+    FerbuyObject when they are accessed, by any accessor. The wrapped value
+    replaces the raw one, so the response data is kept once. Dictionaries
+    and lists passed in are copied rather than changed.
+    """
+
+    __slots__ = ('_retry_state',)
 
     def __init__(self, d=None, **kwargs):
-        if d is None:
-            d = {}
+        super(FerbuyObject, self).__init__(d or {}, **kwargs)
+        object.__setattr__(self, '_retry_state', None)
+
+    @property
+    def retry_state(self):
+        """RetryState of the request which returned this object."""
+        return self._retry_state
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def _wrap_item(self, item):
+        if isinstance(item, dict) and not isinstance(item, FerbuyObject):
+            return self.__class__(item)
+        return item
+
+    def _wrap(self, value):
+        if isinstance(value, dict):
+            return self._wrap_item(value)
+        if isinstance(value, (list, tuple)):
+            wrapped = [self._wrap_item(item) for item in value]
+            if isinstance(value, tuple) or any(
+                    new is not old for new, old in zip(wrapped, value)):
+                return wrapped
+        return value
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        wrapped = self._wrap(value)
+        if wrapped is not value:
+            dict.__setitem__(self, key, wrapped)
+        return wrapped
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+    def items(self):
+        return [(k, self[k]) for k in self]
+
+    def values(self):
+        return [self[k] for k in self]
+
+    def iteritems(self):
+        return ((k, self[k]) for k in self)
+
+    def itervalues(self):
+        return (self[k] for k in self)
 
-        if kwargs:
-            d.update(**kwargs)
+    def viewitems(self):
+        return ItemsView(self)
 
-        for k, v in d.items():
-            setattr(self, k, v)
+    def viewvalues(self):
+        return ValuesView(self)
 
-        for k in self.__class__.__dict__.keys():
-            if not (k.startswith('__') and k.endswith('__')):
-                setattr(self, k, getattr(self, k))
+    def pop(self, key, *default):
+        if key in self:
+            value = self[key]
+            dict.__delitem__(self, key)
+            return value
+        return dict.pop(self, key, *default)
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        return key, self._wrap(value)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            dict.__setitem__(self, key, default)
+        return self[key]
+
+    def copy(self):
+        return self.__class__(self)
 
     def __getattr__(self, name):
         try:
@@ -33,19 +163,17 @@ class FerbuyObject(dict):
             raise AttributeError(*e.args)
 
     def __setattr__(self, name, value):
-        if isinstance(value, (list, tuple)):
-            value = [self.__class__(x)
-                     if isinstance(x, dict) else x for x in value]
+        if name in FerbuyObject.__slots__:
+            object.__setattr__(self, name, value)
         else:
-            value = self.__class__(value) if isinstance(value, dict) else value
-
-        super(FerbuyObject, self).__setattr__(name, value)
-        self[name] = value
+            self[name] = value
 
 
-class APIRequestor(Singleton):
+class APIRequestor(object):
 
-    def __init__(self, site_id=None, secret=None, api_base=None, client=None):
+    def __init__(self, site_id=None, secret=None, api_base=None, client=None,
+                 retry_policy=None, rate_limiter=None, hooks=None,
+                 single_flight=None):
 
         if site_id:
             self.site_id = site_id
@@ -62,66 +190,206 @@ class APIRequestor(Singleton):
         else:
             self.api_base = ferbuy.api_base
 
-        self.__client = client or new_client()
+        self.__client = client or shared_client(self.api_base)
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.hooks = list(hooks or [])
+        self.single_flight = single_flight
+        self.stats_collector = StatsCollector()
+        self._signer = None
+
+    @classmethod
+    def for_site(cls, site_id=None, secret=None, api_base=None):
+        """Return the requestor registered for a site and API endpoint.
+
+        Requestors are created on first use and kept per
+        (site_id, api_base), so many merchant sites can be served from one
+        process at the same time. All requestors for an endpoint share one
+        HTTP client. Missing arguments fall back to the module settings,
+        except `secret`: without it the registered requestor is returned
+        as it is, whichever secret it was created with. A requestor is only
+        replaced when a different secret is passed.
+
+        Args:
+            site_id (int): Site ID assigned by FerBuy.
+            secret (str): Shared secret for checksum calculation.
+            api_base (str): FerBuy's API url.
+
+        Returns:
+            APIRequestor: Requestor for the given credentials.
+        """
+        site_id = site_id or ferbuy.site_id
+        api_base = api_base or ferbuy.api_base
+
+        key = (cls, site_id, api_base)
+        requestor = _requestors.get(key)
+        if requestor is None or (secret and requestor.secret != secret):
+            with _lock:
+                requestor = _requestors.get(key)
+                if requestor is None or (secret and
+                                         requestor.secret != secret):
+                    previous = requestor
+                    requestor = cls(site_id, secret or ferbuy.secret,
+                                    api_base,
+                                    previous.client if previous else None)
+                    if previous is not None:
+                        requestor.retry_policy = previous.retry_policy
+                        requestor.rate_limiter = previous.rate_limiter
+                        requestor.hooks = previous.hooks
+                        requestor.single_flight = previous.single_flight
+                        requestor.stats_collector = previous.stats_collector
+                    _requestors[key] = requestor
+        return requestor
+
+    @classmethod
+    def register(cls, requestor):
+        """Make `requestor` the one returned by `for_site` for its site."""
+        with _lock:
+            key = (cls, requestor.site_id, requestor.api_base)
+            _requestors[key] = requestor
 
     @property
     def client(self):
         return self.__client
 
     def sign(self, transaction_id, command, output_type, **kwargs):
-        signature = "&".join([
-            str(self.site_id), str(transaction_id),
-            command, output_type, str(self.secret)
-        ])
-        hash = hashlib.sha1(signature)
-        return hash.hexdigest()
-
-    def request(self, method, url, data=None, headers=None):
-        response, status_code = self.api_call(
-            method.lower(), url, data, headers)
-        result = self.process_response(response, status_code)
+        signer = self._signer
+        if (signer is None or signer.site_id != self.site_id or
+                signer.secret != self.secret):
+            signer = self._signer = RequestSigner(self.site_id, self.secret)
+        return signer.checksum(transaction_id, command, output_type)
+
+    def request(self, method, url, data=None, headers=None,
+                idempotent=True):
+        flight = self._single_flight()
+        if flight is None or not data:
+            return self._request(method, url, data, headers, idempotent)
+
+        # The post data is signed, so equal data means the same operation
+        # for the same site
+        key = (method.lower(), self.api_base, url,
+               tuple(sorted((k, str(v)) for k, v in data.items())))
+        return flight.do(key, self._request, method, url, data, headers,
+                         idempotent)
+
+    def _request(self, method, url, data, headers, idempotent):
+        context = RequestContext(method.lower(), url, RetryState())
+        hooks = self._hooks()
+        emit(hooks, 'before_request', context)
+        try:
+            response, status_code = self.api_call(
+                context.method, url, data, headers, idempotent,
+                context.retry_state, context)
+            result = self._process_timed(context, response, status_code)
+        except errors.FerbuyError as e:
+            e.retry_state = context.retry_state
+            context.error = e
+            emit(hooks, 'on_error', context, e)
+            raise
+        result._retry_state = context.retry_state
+        emit(hooks, 'after_response', context)
         return result
 
-    def api_call(self, method, url, data, supplied_headers):
+    def api_call(self, method, url, data, supplied_headers, idempotent=True,
+                 retry_state=None, context=None):
+        abs_url, headers, post_data = self._prepare_request(
+            method, url, data, supplied_headers)
+
+        if context is None:
+            context = RequestContext(method, url, retry_state)
+        hooks = self._hooks()
+
+        def send():
+            limiter = self._rate_limiter()
+            if limiter is not None:
+                limiter.acquire()
+            self._start_attempt(context, post_data)
+            response = self.client.request(method, abs_url, headers, post_data)
+            self._record_response(context, response)
+            return response
+
+        def on_retry(state, delay):
+            emit(hooks, 'on_retry', context, delay)
+
+        response, status_code = self._retry_policy().call(
+            send, retry_state, idempotent, on_retry=on_retry)
+
+        self._log_response(abs_url, response, status_code)
+
+        return response, status_code
+
+    def _hooks(self):
+        return self.hooks + ferbuy.request_hooks + [self.stats_collector]
+
+    def stats(self):
+        """Return latency statistics of the requests made so far.
+
+        See `ferbuy.stats.StatsCollector.stats`.
+        """
+        return self.stats_collector.stats()
+
+    def _start_attempt(self, context, post_data):
+        context.attempt += 1
+        context.bytes_sent = len(post_data or '')
+        context.timings = {}
+
+    def _record_response(self, context, response):
+        context.status_code = response[1]
+        context.bytes_received = len(response[0] or '')
+        context.timings.update(getattr(response, 'timings', None) or {})
+
+    def _process_timed(self, context, response, status_code):
+        started = time.time()
+        try:
+            return self.process_response(response, status_code)
+        finally:
+            context.timings['parse'] = time.time() - started
+
+    def _retry_policy(self):
+        return self.retry_policy or ferbuy.retry_policy or NO_RETRY
+
+    def _rate_limiter(self):
+        return self.rate_limiter or ferbuy.rate_limiter
+
+    def _single_flight(self):
+        return self.single_flight or ferbuy.single_flight
+
+    def _prepare_request(self, method, url, data, supplied_headers):
         abs_url = '{0}{1}'.format(self.api_base, url)
 
         if method in ('get', 'delete'):
             post_data = None
         elif method in ('post', 'put'):
-            post_data = urllib.urlencode(data)
+            post_data = urlencode(data)
         else:
             raise errors.APIConnectionError(
                 "Unrecognized HTTP method {0}. This may indicate a bug in the "
                 "FerBuy Python library.".format(method))
 
-        add_info = {
-            'bindings_version': version.VERSION,
-            'lang': 'Python',
-            'lang_version': platform.python_version(),
-            'platform': platform.platform()
-        }
+        headers = self._request_headers(method, supplied_headers)
 
-        headers = {
-            'X-FerBuy-Client-User-Agent': utils.json.dumps(add_info),
-            'User-Agent': 'FerBuy/v1 PythonBinding/{0}'.format(version.VERSION),
-        }
+        return abs_url, headers, post_data
 
-        if method == 'post':
-            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+    def _request_headers(self, method, supplied_headers):
+        headers = dict(_static_headers(method))
 
         if supplied_headers is not None:
             for key, value in supplied_headers.items():
                 headers[key] = value
 
-        response, status_code = self.client.request(
-            method, abs_url, headers, post_data)
+        return headers
 
+    def _log_response(self, abs_url, response, status_code):
+        if not utils.logger.isEnabledFor(logging.INFO):
+            return
+        size = ferbuy.max_logged_body_size
+        if size is not None and response and len(response) > size:
+            response = "{0}... ({1} bytes)".format(
+                response[:size], len(response))
         utils.logger.info(
             "Calling API resource at {0} returned (status code, response) of "
             "({1}, {2})".format(abs_url, status_code, response))
 
-        return response, status_code
-
     def process_response(self, response, status_code):
         if not(200 <= status_code <= 300):
             self.handle_error(response, status_code)
@@ -142,7 +410,7 @@ class APIRequestor(Singleton):
     def handle_error(self, response, status_code):
         if status_code in (400, 401):
             raise errors.InvalidRequestError(
-                "Invalid request error", response, status_code)
+                "Invalid request error", None, response, status_code)
         else:
             raise errors.APIError(
                 "API request error", response, status_code)
@@ -0,0 +1,179 @@
+"""Re-verify archived callbacks, e.g. for an audit.
+
+Archives are read as CSV with a header row or as JSON lines, optionally
+gzipped, a chunk of rows at a time so memory use does not grow with the
+archive. Every chunk is turned into one list per field and verified with
+`CallbackVerifier.reason_columns`, which follows the same signature rules
+as `Gateway.verify_callback`.
+"""
+import csv
+import gzip
+import io
+import itertools
+import json
+import sys
+from collections import namedtuple
+
+from ferbuy.gateway import CALLBACK_FIELDS, CallbackVerifier
+
+# Columns read from the archives, anything else is skipped
+FIELDS = CALLBACK_FIELDS + ('checksum', 'site_id')
+
+# Reason of a JSON line that cannot be parsed
+UNREADABLE = 'unreadable row'
+
+Mismatch = namedtuple('Mismatch', ['offset', 'reason', 'reference',
+                                   'transaction_id'])
+
+
+def _open(path):
+    opener = gzip.open if path.endswith('.gz') else io.open
+    if sys.version_info[0] < 3:
+        # The csv module of Python 2 reads bytes
+        return opener(path, 'rb')
+    return opener(path, 'rt', encoding='utf-8', newline='')
+
+
+def _csv_chunks(fileobj, chunksize):
+    reader = csv.reader(fileobj)
+    header = next(reader, None)
+    if header is None:
+        return
+    indexes = [(field, header.index(field) if field in header else None)
+               for field in FIELDS]
+    while True:
+        rows = list(itertools.islice(reader, chunksize))
+        if not rows:
+            return
+        columns = {}
+        for field, index in indexes:
+            if index is None:
+                if field != 'site_id':
+                    columns[field] = [None] * len(rows)
+                continue
+            # Short rows are missing their last fields
+            columns[field] = [row[index] if index < len(row) else None
+                              for row in rows]
+        yield columns, len(rows), ()
+
+
+def _jsonl_chunks(fileobj, chunksize):
+    while True:
+        lines = list(itertools.islice(fileobj, chunksize))
+        if not lines:
+            return
+        columns = dict((field, []) for field in FIELDS)
+        unreadable = []
+        for offset, line in enumerate(lines):
+            try:
+                row = json.loads(line)
+                get = row.get
+            except (ValueError, AttributeError):
+                unreadable.append(offset)
+                get = {}.get
+            for field in FIELDS:
+                columns[field].append(get(field))
+        yield columns, len(lines), unreadable
+
+
+class ArchiveVerifier(object):
+    """Verify the checksums of archived callbacks.
+
+    Args:
+        secrets (dict): Shared secret per site ID.
+        secret (str): Secret of callbacks without a known site ID.
+            Defaults to `ferbuy.secret` when no `secrets` are given.
+        env (str): Environment the callbacks were signed for, `ferbuy.env`
+            by default.
+        chunksize (int): Rows read and verified at once.
+
+    Attributes:
+        rows (int): Rows verified by the last `verify_*` call so far.
+    """
+
+    def __init__(self, secrets=None, secret=None, env=None, chunksize=10000):
+        self.verifier = CallbackVerifier(secrets, secret, env)
+        self.chunksize = chunksize
+        self.rows = 0
+
+    def verify_file(self, path, format=None):
+        """Verify an archive file, `.gz` files are decompressed.
+
+        Args:
+            path (str): Path of the archive.
+            format (str): 'csv' or 'jsonl', by default taken from the
+                file extension.
+
+        Returns:
+            iterator: Mismatch for every invalid callback.
+
+        Raises:
+            ValueError: If the format is unknown.
+        """
+        if format is None:
+            name = path[:-3] if path.endswith('.gz') else path
+            format = name.rsplit('.', 1)[-1].lower()
+            if format == 'json':
+                format = 'jsonl'
+        if format not in ('csv', 'jsonl'):
+            raise ValueError("unknown archive format {0!r}".format(format))
+        return self._verify_path(path, format)
+
+    def _verify_path(self, path, format):
+        with _open(path) as fileobj:
+            verify = (self.verify_csv if format == 'csv' else
+                      self.verify_jsonl)
+            for mismatch in verify(fileobj):
+                yield mismatch
+
+    def verify_csv(self, fileobj):
+        """Verify CSV callbacks, the first row names the columns.
+
+        Returns:
+            iterator: Mismatch for every invalid callback, the offset is
+                the row number after the header, starting at 0.
+        """
+        return self._verify(_csv_chunks(fileobj, self.chunksize))
+
+    def verify_jsonl(self, fileobj):
+        """Verify callbacks stored as one JSON object per line.
+
+        Returns:
+            iterator: Mismatch for every invalid callback, the offset is
+                the line number, starting at 0.
+        """
+        return self._verify(_jsonl_chunks(fileobj, self.chunksize))
+
+    def verify_columns(self, columns, offset=0):
+        """Verify callbacks given as a list of values per field.
+
+        Args:
+            columns (dict): Values per field, see
+                `CallbackVerifier.reason_columns`.
+            offset (int): Offset of the first row.
+
+        Returns:
+            list: Mismatch for every invalid callback.
+        """
+        return self._mismatches(
+            columns, self.verifier.reason_columns(columns), offset)
+
+    def _verify(self, chunks):
+        self.rows = 0
+        for columns, size, unreadable in chunks:
+            reasons = self.verifier.reason_columns(columns)
+            for index in unreadable:
+                reasons[index] = UNREADABLE
+            for mismatch in self._mismatches(columns, reasons, self.rows):
+                yield mismatch
+            self.rows += size
+
+    @staticmethod
+    def _mismatches(columns, reasons, offset):
+        references = columns.get('reference')
+        transaction_ids = columns.get('transaction_id')
+        return [Mismatch(offset + index, reason,
+                         references[index] if references else None,
+                         transaction_ids[index] if transaction_ids else None)
+                for index, reason in enumerate(reasons)
+                if reason is not None]
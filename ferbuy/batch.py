@@ -0,0 +1,136 @@
+import time
+
+import ferbuy
+from ferbuy import errors
+
+
+class BatchResult(object):
+    """Outcome of one item of a batch call.
+
+    Attributes:
+        index (int): Position of the item in the input.
+        item: The input record.
+        result (FerbuyObject): Response object, None when the call failed.
+        error (Exception): Exception raised by the call, None on success.
+    """
+
+    __slots__ = ('index', 'item', 'result', 'error')
+
+    def __init__(self, index, item, result=None, error=None):
+        self.index = index
+        self.item = item
+        self.result = result
+        self.error = error
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def __repr__(self):
+        return '<BatchResult #{0} {1}>'.format(
+            self.index, 'ok' if self.ok else repr(self.error))
+
+
+def _call(func, item, started):
+    started.append(time.time())
+    if isinstance(item, dict):
+        return func(**item)
+    elif isinstance(item, (list, tuple)):
+        return func(*item)
+    return func(item)
+
+
+def run_batch(func, records, max_in_flight=None, timeout=None, ordered=True):
+    """Call `func` for every record using a bounded pool of workers.
+
+    Records are read lazily from the iterable, so it may be a generator
+    over a very large input. A failing item never aborts the batch, its
+    exception is returned in the item's `BatchResult` instead.
+
+    Args:
+        func (callable): Function to call, e.g. `Order.shipped`.
+        records (iterable): Keyword dicts or positional tuples for `func`.
+        max_in_flight (int): Maximum number of concurrent calls.
+            Defaults to `ferbuy.max_in_flight`.
+        timeout (float): Seconds a single call may run before its result
+            is given up on. Defaults to `ferbuy.item_timeout`.
+        ordered (bool): Yield results in input order rather than as each
+            call finishes.
+
+    Yields:
+        BatchResult: One result per input record.
+    """
+    # Imported here, `import ferbuy` loads this module on Python < 3.7
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    if max_in_flight is None:
+        max_in_flight = ferbuy.max_in_flight
+    if timeout is None:
+        timeout = ferbuy.item_timeout
+
+    records = enumerate(records)
+    exhausted = False
+    next_index = 0
+    pending = {}
+    finished = {}
+
+    executor = ThreadPoolExecutor(max_workers=max_in_flight)
+    try:
+        while True:
+            # Results kept back for ordering count against the window too,
+            # so a slow item at the head cannot make the buffer grow
+            # without bound.
+            while (not exhausted and len(pending) < max_in_flight and
+                    len(pending) + len(finished) < 4 * max_in_flight):
+                try:
+                    index, item = next(records)
+                except StopIteration:
+                    exhausted = True
+                    break
+                started = []
+                future = executor.submit(_call, func, item, started)
+                pending[future] = (index, item, started)
+
+            if not pending and not finished:
+                break
+
+            wait_for = None
+            if timeout is not None:
+                starts = [s[0] for _, _, s in pending.values() if s]
+                if starts:
+                    wait_for = max(0, min(starts) + timeout - time.time())
+
+            done, _ = wait(list(pending), timeout=wait_for,
+                           return_when=FIRST_COMPLETED)
+
+            completed = []
+            for future in done:
+                index, item, _ = pending.pop(future)
+                try:
+                    result = BatchResult(index, item, result=future.result())
+                except Exception as e:
+                    result = BatchResult(index, item, error=e)
+                completed.append(result)
+
+            if timeout is not None:
+                now = time.time()
+                for future, (index, item, started) in list(pending.items()):
+                    if started and now - started[0] >= timeout:
+                        del pending[future]
+                        completed.append(BatchResult(
+                            index, item, error=errors.APIConnectionError(
+                                "Request did not complete within "
+                                "{0} seconds".format(timeout))))
+
+            if not ordered:
+                for result in completed:
+                    yield result
+                continue
+
+            for result in completed:
+                finished[result.index] = result
+            while next_index in finished:
+                yield finished.pop(next_index)
+                next_index += 1
+    finally:
+        executor.shutdown(wait=False)
@@ -0,0 +1,415 @@
+"""Connection broker shared by the worker processes of a host.
+
+Under a pre-fork server like gunicorn or uWSGI every worker process keeps
+its own connections to FerBuy, so the number of sockets grows with the
+number of workers and every new worker pays for its own TLS handshakes.
+A `ConnectionBroker` is a single process per host keeping a small pool of
+keep-alive connections. Workers send their requests to it over a Unix
+socket with `BrokerClient`, which `new_client()` returns when
+`ferbuy.broker_path` is set.
+
+    $ python -m ferbuy.broker /run/ferbuy.sock --connections 4
+
+Requests and responses are framed as a length-prefixed JSON header
+followed by a length-prefixed body, with 4-byte big-endian lengths.
+
+The broker only sends requests to the FerBuy API, see `api_bases`, and
+its socket is only accessible to its owner unless `mode` says otherwise.
+"""
+import argparse
+import json
+import os
+import select
+import socket
+import struct
+import sys
+import threading
+
+import ferbuy
+from ferbuy import errors, http_client, utils
+from ferbuy.http_client import (CHUNK_SIZE, HTTPClient, HTTPResponse,
+                                _fill, _fork_aware)
+
+try:
+    from socketserver import (BaseRequestHandler, ThreadingMixIn,
+                              UnixStreamServer)
+except ImportError:
+    from SocketServer import (BaseRequestHandler, ThreadingMixIn,
+                              UnixStreamServer)
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+_LENGTH = struct.Struct('>I')
+# Frame headers hold a method, URL and HTTP headers
+MAX_HEADER_SIZE = 64 * 1024
+# Request bodies are small form posts
+MAX_REQUEST_SIZE = 1024 * 1024
+
+
+def _send(sock, header, body=b''):
+    header = json.dumps(header).encode('utf-8')
+    sock.sendall(b''.join([_LENGTH.pack(len(header)), header,
+                           _LENGTH.pack(len(body)), body]))
+
+
+def _recv_exactly(sock, size):
+    parts = []
+    while size:
+        chunk = sock.recv(min(size, CHUNK_SIZE))
+        if not chunk:
+            raise EOFError("Connection closed by the other side")
+        parts.append(chunk)
+        size -= len(chunk)
+    return b''.join(parts)
+
+
+def _recv_length(sock):
+    return _LENGTH.unpack(_recv_exactly(sock, _LENGTH.size))[0]
+
+
+def _recv(sock, limit=None):
+    """Return the header and body of the next frame on `sock`.
+
+    Raises:
+        ValueError: If the header is larger than `MAX_HEADER_SIZE` or not
+            valid JSON.
+        ResponseTooLargeError: If the body is larger than `limit`, the
+            body is left unread.
+    """
+    size = _recv_length(sock)
+    if size > MAX_HEADER_SIZE:
+        raise ValueError("Frame header of {0} bytes exceeds the limit of "
+                         "{1} bytes".format(size, MAX_HEADER_SIZE))
+    header = json.loads(_recv_exactly(sock, size).decode('utf-8'))
+    size = _recv_length(sock)
+    if limit is not None and size > limit:
+        raise errors.ResponseTooLargeError(
+            "Response body exceeds the limit of {0} bytes".format(limit),
+            None, header.get('status'))
+    return header, _recv_exactly(sock, size)
+
+
+def _direct_client(connections):
+    # Not new_client(), which returns a BrokerClient with broker_path set
+    if http_client._load_requests():
+        return http_client.RequestsClient(pool_maxsize=connections)
+    elif sys.version_info >= (3, 0):
+        return http_client.Urllib3Client()
+    return http_client.Urllib2Client()
+
+
+class _Handler(BaseRequestHandler):
+
+    def setup(self):
+        with self.server.lock:
+            self.server.connections.add(self.request)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self.request)
+
+    def handle(self):
+        # A worker keeps its connection and sends one request at a time
+        while True:
+            try:
+                request = _recv(self.request, MAX_REQUEST_SIZE)
+            except (EOFError, socket.error, ValueError,
+                    errors.ResponseTooLargeError):
+                # The rest of an oversized frame is not read, drop the
+                # connection of the worker
+                return
+            try:
+                _send(self.request, *self.server.broker.forward(*request))
+            except socket.error:
+                return
+
+
+class _Server(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+    # Connecting to a Unix socket with a full backlog fails at once, all
+    # workers of a host may connect at the same time
+    request_queue_size = 128
+
+    def __init__(self, path, handler):
+        UnixStreamServer.__init__(self, path, handler)
+        self.lock = threading.Lock()
+        self.connections = set()
+
+    def close_connections(self):
+        with self.lock:
+            connections = list(self.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+class ConnectionBroker(object):
+    """Send the requests of the `BrokerClient`s of a host to FerBuy.
+
+    Args:
+        path (str): Path of the Unix socket, a stale socket file is
+            replaced. Workers must be allowed to write to it.
+        client (HTTPClient): Client doing the requests. By default a
+            `RequestsClient` keeping `connections` connections per host,
+            never a `BrokerClient`.
+        connections (int): Requests sent to FerBuy at once, further
+            requests wait for one of them to finish.
+        api_bases (list): Base URLs requests may be sent to,
+            `ferbuy.api_base` by default. Requests for other URLs are
+            refused.
+        mode (int): Permissions of the socket file, read and write for
+            its owner only by default. Use e.g. `0o660` for workers
+            running as another user of the same group.
+    """
+
+    def __init__(self, path, client=None, connections=4, api_bases=None,
+                 mode=0o600):
+        self.path = path
+        self.client = client or _direct_client(connections)
+        self.api_bases = api_bases
+        self.mode = mode
+        self._slots = threading.BoundedSemaphore(connections)
+        self._server = None
+
+    def allowed(self, url):
+        """Return whether requests for `url` may be sent."""
+        try:
+            scheme, netloc, path = urlsplit(url)[:3]
+        except (TypeError, AttributeError, ValueError):
+            return False
+        for base in self.api_bases or [ferbuy.api_base]:
+            base = urlsplit(base)
+            prefix = base.path.rstrip('/') + '/'
+            if ((scheme, netloc) == (base.scheme, base.netloc) and
+                    (path + '/').startswith(prefix)):
+                return True
+        return False
+
+    def forward(self, header, body):
+        """Do the request of a worker, return the response frame."""
+        if not self.allowed(header.get('url')):
+            utils.logger.warning(
+                "FerBuy connection broker refused a request for "
+                "{0!r}".format(header.get('url')))
+            return {'error': 'APIConnectionError',
+                    'message': "The connection broker only sends requests "
+                               "to the FerBuy API"}, b''
+        try:
+            with self._slots:
+                response = self.client.request(
+                    header['method'], header['url'], header['headers'],
+                    body if header['data'] else None)
+        except errors.FerbuyError as e:
+            return {'error': e.__class__.__name__, 'message': str(e),
+                    'status': e.http_status}, b''
+        except Exception as e:
+            message = "{0}: {1}".format(e.__class__.__name__, e)
+            return {'error': 'APIConnectionError', 'message': message}, b''
+
+        content, status_code = response
+        if not isinstance(content, bytes):
+            content = content.encode('utf-8')
+        return {
+            'status': status_code,
+            'headers': dict(getattr(response, 'headers', None) or {}),
+            'timings': getattr(response, 'timings', None) or {},
+        }, content
+
+    def bind(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        # Nobody else may connect between creating the socket and chmod
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.path, _Handler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, self.mode)
+        self._server.broker = self
+        return self
+
+    def serve_forever(self):
+        if self._server is None:
+            self.bind()
+        try:
+            self._server.serve_forever(poll_interval=0.05)
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        """Serve in a background thread and return the broker."""
+        self.bind()
+        thread = threading.Thread(target=self._server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        server, self._server = self._server, None
+        if server is None:
+            return
+        server.shutdown()
+        server.server_close()
+        server.close_connections()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def _closed(sock):
+    # An idle connection closed by the other side reads as EOF
+    try:
+        readable = select.select([sock], [], [], 0)[0]
+        return bool(readable) and not sock.recv(1, socket.MSG_PEEK)
+    except (socket.error, ValueError):
+        return True
+
+
+class BrokerClient(HTTPClient):
+    """HTTP client sending its requests through a `ConnectionBroker`.
+
+    Every thread keeps its own connection to the broker, opened on first
+    use. A process forked after the client was used opens new ones, and a
+    connection closed by the broker, e.g. when it was restarted, is
+    replaced before the request is sent.
+
+    Args:
+        path (str): Unix socket of the broker.
+        timeout (float): Seconds to wait for the broker, longer than the
+            connect and read timeouts of the broker's client.
+        fallback (HTTPClient): Client doing the requests while the broker
+            cannot be reached, by default they fail.
+        max_body_size (int): Reject responses larger than this many bytes,
+            `ferbuy.max_body_size` by default.
+    """
+
+    name = 'broker'
+
+    def __init__(self, path, timeout=95, fallback=None, max_body_size=None):
+        self.path = path
+        self.timeout = timeout
+        self.fallback = fallback
+        self.max_body_size = max_body_size
+        self._after_fork()
+        _fork_aware.add(self)
+
+    def _after_fork(self):
+        # Connections to the broker are not shared with the parent
+        self._local = threading.local()
+
+    def _connection(self):
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None and self._local.pid == os.getpid():
+            if not _closed(sock):
+                return sock
+            # The broker was restarted since the last request
+            self._discard()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.path)
+        except socket.error:
+            sock.close()
+            raise
+        self._local.sock = sock
+        self._local.pid = os.getpid()
+        return sock
+
+    def _discard(self):
+        sock, self._local.sock = getattr(self._local, 'sock', None), None
+        if sock is not None:
+            sock.close()
+
+    def close(self):
+        self._discard()
+
+    def request(self, method, url, headers, data=None):
+        if data is not None and not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        frame = ({'method': method, 'url': url,
+                  'headers': dict(headers or {}), 'data': data is not None},
+                 data or b'')
+
+        for attempt in (1, 2):
+            try:
+                sock = self._connection()
+            except socket.error as e:
+                return self._fall_back(e, method, url, headers, data)
+            try:
+                _send(sock, *frame)
+                break
+            except socket.error as e:
+                # The broker went away before the request was read, it is
+                # sent once more on a new connection
+                self._discard()
+                if attempt == 2:
+                    return self._fall_back(e, method, url, headers, data)
+
+        try:
+            header, content = _recv(sock, self._body_limit())
+        except errors.ResponseTooLargeError:
+            # The rest of the frame is not read, the connection is unusable
+            self._discard()
+            raise
+        except (EOFError, socket.error, ValueError) as e:
+            self._discard()
+            self.handle_error(e)
+
+        if 'error' in header:
+            if header['error'] == 'ResponseTooLargeError':
+                raise errors.ResponseTooLargeError(
+                    header['message'], None, header.get('status'))
+            raise errors.APIConnectionError(header['message'])
+        return HTTPResponse(content, header['status'], header['headers'],
+                            header['timings'])
+
+    def _fall_back(self, e, method, url, headers, data):
+        if self.fallback is None:
+            self.handle_error(e)
+        utils.logger.warning(
+            "FerBuy connection broker at {0} unavailable ({1}), "
+            "sending the request directly".format(self.path, e))
+        return self.fallback.request(method, url, headers, data)
+
+    def handle_error(self, e):
+        msg = ("Unexpected error communicating with the FerBuy connection "
+               "broker at {0}. Check that it is running.".format(self.path))
+        err = "{0}: {1}".format(e.__class__.__name__, e)
+        msg = _fill(msg + "\n\n(Broker error: {0})".format(err))
+        raise errors.APIConnectionError(msg)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Share connections to FerBuy between the processes "
+                    "of a host.")
+    parser.add_argument('path', help="Unix socket to listen on")
+    parser.add_argument('--connections', type=int, default=4,
+                        help="requests sent to FerBuy at once")
+    parser.add_argument('--api-base', action='append', dest='api_bases',
+                        help="base URL requests may be sent to, "
+                             "ferbuy.api_base by default, repeatable")
+    parser.add_argument('--mode', type=lambda value: int(value, 8),
+                        default=0o600,
+                        help="octal permissions of the socket, 600 by "
+                             "default")
+    args = parser.parse_args()
+
+    broker = ConnectionBroker(args.path, connections=args.connections,
+                              api_bases=args.api_bases, mode=args.mode)
+    try:
+        broker.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(args.path):
+            os.unlink(args.path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+import threading
+
+from ferbuy import utils
+from ferbuy.gateway import Gateway
+
+try:
+    import queue
+    from urllib.parse import parse_qsl
+except ImportError:
+    import Queue as queue
+    from urlparse import parse_qsl
+
+
+STATUS_LINES = {
+    200: '200 OK',
+    400: '400 Bad Request',
+    405: '405 Method Not Allowed',
+    413: '413 Payload Too Large',
+    503: '503 Service Unavailable',
+}
+
+
+class CallbackDispatcher(object):
+    """Worker threads running the callback handler.
+
+    Args:
+        handler (callable): Called with the POST data of every callback.
+        workers (int): Number of worker threads.
+        queue_size (int): Callbacks which may wait for a worker.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=1000):
+        self.handler = handler
+        self.queue = queue.Queue(queue_size)
+        self.workers = []
+        for _ in range(workers):
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def _work(self):
+        while True:
+            post_data = self.queue.get()
+            try:
+                if post_data is None:
+                    return
+                self.handler(post_data)
+            except Exception:
+                utils.logger.exception(
+                    "Callback handler failed for transaction {0}".format(
+                        post_data.get('transaction_id')))
+            finally:
+                self.queue.task_done()
+
+    def submit(self, post_data):
+        """Queue a callback, return False if the queue is full."""
+        try:
+            self.queue.put_nowait(post_data)
+        except queue.Full:
+            return False
+        return True
+
+    def join(self):
+        """Block until every queued callback was handled."""
+        self.queue.join()
+
+    def close(self):
+        """Stop the workers after the queued callbacks were handled."""
+        for _ in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+
+class CallbackEndpoint(object):
+    """Verification and deduplication shared by the callback apps.
+
+    Callbacks are verified like `Gateway.verify_callback`, or with
+    `verifier` (a `CallbackVerifier`) when given. A verified callback is
+    acknowledged right away with `transaction_id.status` and queued for the
+    handler. Redelivered callbacks with a `(transaction_id, status)` seen
+    within `dedup_ttl` seconds are acknowledged without being queued again.
+    Bodies larger than `max_body_size` bytes are answered with 413 before
+    they are read.
+    """
+
+    def __init__(self, verifier=None, dedup_size=10000, dedup_ttl=3600,
+                 max_body_size=64 * 1024):
+        self.verifier = verifier
+        self.seen = utils.TTLCache(dedup_size, dedup_ttl)
+        self.max_body_size = max_body_size
+
+    def too_large(self, size):
+        return self.max_body_size is not None and size > self.max_body_size
+
+    def verify(self, post_data):
+        try:
+            if self.verifier is not None:
+                return self.verifier.verify(post_data)
+            return Gateway.verify_callback(post_data)
+        except KeyError:
+            return False
+
+    def submit(self, post_data):
+        raise NotImplementedError('CallbackEndpoint subclasses must '
+                                  'implement "submit" method')
+
+    def process(self, body):
+        """Handle the body of a callback request.
+
+        Returns:
+            tuple: HTTP status code and response body.
+        """
+        if self.too_large(len(body)):
+            return 413, b'Callback too large'
+        try:
+            if not isinstance(body, str):
+                body = body.decode('utf-8')
+            post_data = dict(parse_qsl(body, keep_blank_values=True))
+        except ValueError:
+            # UnicodeDecodeError is a ValueError too
+            utils.logger.warning("Unable to parse callback body")
+            return 400, b'Invalid callback'
+
+        if not self.verify(post_data):
+            utils.logger.warning("Unable to verify callback for "
+                                 "transaction {0}".format(
+                                     post_data.get('transaction_id')))
+            return 400, b'Invalid callback'
+
+        key = (post_data['transaction_id'], post_data['status'])
+        ack = '{0}.{1}'.format(*key).encode('utf-8')
+        if not self.seen.add(key):
+            return 200, ack
+
+        if not self.submit(post_data):
+            # Let FerBuy's redelivery be handled
+            self.seen.pop(key)
+            return 503, b'Too many callbacks'
+        return 200, ack
+
+
+class CallbackApp(CallbackEndpoint):
+    """WSGI application receiving FerBuy callbacks.
+
+    Args:
+        handler (callable): Called in a worker thread with the POST data
+            of every verified callback.
+        verifier (CallbackVerifier): Verifies callbacks of several sites,
+            by default they are verified with the module settings.
+        workers (int): Number of worker threads.
+        queue_size (int): Callbacks which may wait for a worker, further
+            callbacks are answered with 503 so FerBuy delivers them again.
+        dedup_size (int): Callbacks remembered for deduplication.
+        dedup_ttl (float): Seconds a callback is remembered.
+        max_body_size (int): Larger callbacks are rejected with 413, None
+            accepts bodies of any size.
+    """
+
+    def __init__(self, handler, verifier=None, workers=4, queue_size=1000,
+                 dedup_size=10000, dedup_ttl=3600, max_body_size=64 * 1024):
+        super(CallbackApp, self).__init__(verifier, dedup_size, dedup_ttl,
+                                          max_body_size)
+        self.dispatcher = CallbackDispatcher(handler, workers, queue_size)
+
+    def submit(self, post_data):
+        return self.dispatcher.submit(post_data)
+
+    def close(self):
+        self.dispatcher.close()
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') not in ('POST', 'PUT'):
+            status, body = 405, b'Method not allowed'
+        else:
+            try:
+                length = int(environ.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            if self.too_large(length):
+                status, body = 413, b'Callback too large'
+            else:
+                status, body = self.process(
+                    environ['wsgi.input'].read(length))
+
+        start_response(STATUS_LINES[status], [
+            ('Content-Type', 'text/plain'),
+            ('Content-Length', str(len(body))),
+        ])
+        return [body]
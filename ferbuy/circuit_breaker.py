@@ -0,0 +1,155 @@
+import collections
+import threading
+import time
+
+from ferbuy import errors
+from ferbuy import utils
+from ferbuy.http_client import HTTPClient, new_client
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreakerClient(HTTPClient):
+    """HTTP client which stops calling FerBuy while it is failing.
+
+    The breaker wraps another `HTTPClient` and watches the outcome of the
+    last `window` calls. Errors, e.g. failing to connect or a response too
+    large to read, and 5xx responses count as failures, calls taking
+    longer than `slow_call_duration` as slow. When either rate reaches its
+    threshold the circuit opens and calls fail immediately with
+    `CircuitOpenError`. After `reset_timeout` seconds the
+    circuit is half-open and lets `probe_calls` requests through; if they
+    all succeed it closes again, otherwise it reopens.
+
+    Args:
+        client (HTTPClient): Client doing the requests, `new_client()` by
+            default.
+        failure_rate (float): Share of failed calls which opens the circuit.
+        slow_call_duration (float): Seconds after which a call is slow.
+        slow_call_rate (float): Share of slow calls which opens the circuit.
+        window (int): Number of recent calls the rates are computed over.
+        min_calls (int): Calls needed in the window before it can open.
+        reset_timeout (float): Seconds the circuit stays open.
+        probe_calls (int): Calls let through while half-open.
+    """
+
+    name = 'circuit_breaker'
+
+    def __init__(self, client=None, failure_rate=0.5, slow_call_duration=None,
+                 slow_call_rate=1.0, window=20, min_calls=10,
+                 reset_timeout=30, probe_calls=1, clock=time.time):
+        self.client = client or new_client()
+        self.failure_rate = failure_rate
+        self.slow_call_duration = slow_call_duration
+        self.slow_call_rate = slow_call_rate
+        self.min_calls = min_calls
+        self.reset_timeout = reset_timeout
+        self.probe_calls = probe_calls
+        self.clock = clock
+
+        self.listeners = []
+
+        self._lock = threading.Lock()
+        self._calls = collections.deque(maxlen=window)
+        self._state = CLOSED
+        self._opened_at = None
+        self._probes = 0
+        self._probe_successes = 0
+
+    def add_listener(self, listener):
+        """Call `listener(breaker, old_state, new_state)` on state changes."""
+        self.listeners.append(listener)
+
+    @property
+    def state(self):
+        with self._lock:
+            changed = self._check_reset()
+            state = self._state
+        self._notify(changed)
+        return state
+
+    def _check_reset(self):
+        if (self._state == OPEN and
+                self.clock() - self._opened_at >= self.reset_timeout):
+            return self._transition(HALF_OPEN)
+
+    def _transition(self, state):
+        old, self._state = self._state, state
+        if state == OPEN:
+            self._opened_at = self.clock()
+        elif state == CLOSED:
+            self._calls.clear()
+        self._probes = 0
+        self._probe_successes = 0
+        return (old, state)
+
+    def _notify(self, changed):
+        if not changed:
+            return
+        old, new = changed
+        utils.logger.info(
+            "Circuit breaker changed state from {0} to {1}".format(old, new))
+        for listener in self.listeners:
+            try:
+                listener(self, old, new)
+            except Exception:
+                # A broken listener must not fail the request
+                utils.logger.exception(
+                    "Circuit breaker listener {0!r} failed".format(listener))
+
+    def _before_call(self):
+        with self._lock:
+            changed = self._check_reset()
+            allowed = True
+            if self._state == OPEN:
+                allowed = False
+            elif self._state == HALF_OPEN:
+                if self._probes >= self.probe_calls:
+                    allowed = False
+                else:
+                    self._probes += 1
+        self._notify(changed)
+        if not allowed:
+            raise errors.CircuitOpenError(
+                "FerBuy is failing, requests are suspended for up to "
+                "{0} seconds".format(self.reset_timeout))
+
+    def _record(self, failed, duration):
+        slow = (self.slow_call_duration is not None and
+                duration >= self.slow_call_duration)
+
+        with self._lock:
+            changed = None
+            if self._state == HALF_OPEN:
+                if failed or slow:
+                    changed = self._transition(OPEN)
+                else:
+                    self._probe_successes += 1
+                    if self._probe_successes >= self.probe_calls:
+                        changed = self._transition(CLOSED)
+            elif self._state == CLOSED:
+                self._calls.append((failed, slow))
+                total = len(self._calls)
+                if total >= self.min_calls:
+                    failures = sum(1 for f, _ in self._calls if f)
+                    slows = sum(1 for _, s in self._calls if s)
+                    if (failures >= self.failure_rate * total or
+                            slows >= self.slow_call_rate * total):
+                        changed = self._transition(OPEN)
+        self._notify(changed)
+
+    def request(self, method, url, headers, data=None):
+        self._before_call()
+
+        started = self.clock()
+        failed = True
+        try:
+            response = self.client.request(method, url, headers, data)
+            failed = response[1] >= 500
+            return response
+        finally:
+            # Every outcome is recorded, a probe raising any error gives
+            # its slot back by reopening the circuit
+            self._record(failed, self.clock() - started)
@@ -1,16 +1,42 @@
+import codecs
+
+import ferbuy
+
+
+def _head(http_body, size):
+    """Return the first `size` bytes of a body decoded as utf-8.
+
+    A character cut in half by the truncation is dropped, invalid bytes
+    still raise.
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    return decoder.decode(http_body[:size], final=len(http_body) <= size)
+
+
 # Exceptions
 class FerbuyError(Exception):
 
+    # RetryState of the request which failed, set by APIRequestor
+    retry_state = None
+
     def __init__(self, message=None, http_body=None, http_status=None,
                  json_body=None):
         super(FerbuyError, self).__init__(message)
 
+        # Only the start of the body is kept, error pages can be large
+        self.http_body_size = len(http_body) if http_body else 0
+        size = ferbuy.max_logged_body_size
+        if size is None:
+            size = self.http_body_size
+
         if http_body and hasattr(http_body, 'decode'):
             try:
-                http_body = http_body.decode('utf-8')
+                http_body = _head(http_body, size)
             except:
                 http_body = ('<Could not decode body as utf-8. '
                              'Please report to support@ferbuy.com>')
+        elif http_body:
+            http_body = http_body[:size]
 
         self.http_body = http_body
         self.http_status = http_status
@@ -21,10 +47,18 @@ class APIError(FerbuyError):
     pass
 
 
+class ResponseTooLargeError(APIError):
+    pass
+
+
 class APIConnectionError(FerbuyError):
     pass
 
 
+class CircuitOpenError(APIConnectionError):
+    pass
+
+
 class InvalidRequestError(FerbuyError):
 
     def __init__(self, message, param, http_body=None,
@@ -1,5 +1,97 @@
 import ferbuy
 import hashlib
+import itertools
+
+from collections import namedtuple
+
+from ferbuy import utils
+
+try:
+    from html import escape
+except ImportError:
+    from cgi import escape
+
+# Payment fields signed by the merchant, in signature order
+GATEWAY_FIELDS = ('reference', 'currency', 'amount', 'first_name',
+                  'last_name')
+
+# Callback fields signed by FerBuy, in signature order
+CALLBACK_FIELDS = ('reference', 'transaction_id', 'status', 'currency',
+                   'amount')
+
+
+def _bytes(value):
+    if not isinstance(value, (bytes, type(u''))):
+        value = str(value)
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+
+def _payment_signature(data):
+    """Return the signed payment fields of `data` joined by '&'."""
+    try:
+        return "&".join([str(data[field]) for field in GATEWAY_FIELDS])
+    except KeyError as e:
+        raise KeyError("Missing required key {0}".format(e))
+
+
+def _callback_values(post_data):
+    return [_bytes(post_data[field]) for field in CALLBACK_FIELDS]
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return type(u'')(value)
+
+
+def _escape(value):
+    value = _text(value)
+    # Most values need no escaping, skip the replacements for them
+    if ('&' in value or '<' in value or '>' in value or '"' in value or
+            "'" in value):
+        value = escape(value, True)
+    return value
+
+
+def _require_credentials(site_id, secret):
+    # Signing with a missing secret would hash the string 'None'
+    if site_id is None or secret is None:
+        raise ValueError("Signing needs a site_id and a secret, pass them "
+                         "or set ferbuy.site_id and ferbuy.secret")
+
+
+def _checksum_equal(checksum, given):
+    return utils.compare_digest(_bytes(checksum), _bytes(given))
+
+
+SignedPayload = namedtuple('SignedPayload', ['data', 'checksum', 'url'])
+
+
+class RequestSigner(object):
+    """Compute the checksum of API requests for one site.
+
+    The checksum is the SHA-1 of
+    `site_id&transaction_id&command&output_type&secret`. The hash of
+    `site_id&` is computed once, so a request costs one hash update.
+
+    Args:
+        site_id (int): Site ID assigned by FerBuy.
+        secret (str): Shared secret of the site.
+    """
+
+    def __init__(self, site_id, secret):
+        self.site_id = site_id
+        self.secret = secret
+        self._prefix = hashlib.sha1(_bytes(site_id) + b'&')
+        self._suffix = b'&' + _bytes(secret)
+
+    def checksum(self, transaction_id, command, output_type):
+        hash = self._prefix.copy()
+        hash.update(b'&'.join([_bytes(transaction_id), _bytes(command),
+                               _bytes(output_type)]) + self._suffix)
+        return hash.hexdigest()
 
 
 class Gateway(object):
@@ -40,23 +132,17 @@ class Gateway(object):
             post_data['checksum'] = self.checksum(post_data)
 
         self.data = post_data
+        self._rendered = None
 
     def checksum(self, data):
-        try:
-            signature = "&".join([
-                self.env,
-                str(self.site_id),
-                str(data['reference']),
-                str(data['currency']),
-                str(data['amount']),
-                str(data['first_name']),
-                str(data['last_name']),
-                self.secret
-            ])
-            hash = hashlib.sha1(signature)
-            return hash.hexdigest()
-        except KeyError as e:
-            raise KeyError("Missing required key {0}".format(e))
+        signature = "&".join([
+            self.env,
+            str(self.site_id),
+            _payment_signature(data),
+            self.secret
+        ])
+        hash = hashlib.sha1(_bytes(signature))
+        return hash.hexdigest()
 
     @property
     def url(self):
@@ -70,6 +156,50 @@ class Gateway(object):
                 key, value)
         return fields
 
+    def _render(self):
+        # Rendered again only when the data or the url changed
+        key = (list(self.data.items()), self.url)
+        if self._rendered is None or self._rendered[0] != key:
+            fields = u''.join([
+                u'<input type="hidden" name="{0}" value="{1}">'.format(
+                    _escape(name), _escape(value))
+                for name, value in key[0]])
+            self._rendered = (key, fields, {})
+        return self._rendered
+
+    def render_fields(self):
+        """Return the HTML escaped hidden inputs of the form data.
+
+        Unlike `render`, the values are escaped and the result is cached
+        until `data` changes.
+        """
+        return self._render()[1]
+
+    def render_form(self, form_id='ferbuy-gateway', submit_label='Continue'):
+        """Return the form posting the data to the gateway.
+
+        The form is submitted by a script as soon as it is loaded, browsers
+        without scripting show a submit button instead.
+
+        Args:
+            form_id (str): Value of the form's id attribute.
+            submit_label (str): Label of the fallback submit button.
+
+        Returns:
+            bytes: UTF-8 encoded HTML, cached until `data` changes.
+        """
+        (_, url), fields, forms = self._render()
+        form = forms.get((form_id, submit_label))
+        if form is None:
+            form = forms[form_id, submit_label] = (
+                u'<form method="post" action="{0}" id="{1}">{2}'
+                u'<noscript><input type="submit" value="{3}"></noscript>'
+                u'</form><script>document.getElementById("{1}").submit();'
+                u'</script>').format(
+                    _escape(url), _escape(form_id), fields,
+                    _escape(submit_label)).encode('utf-8')
+        return form
+
     @staticmethod
     def verify_callback(post_data):
         """Verify FerBuy's callback checksum.
@@ -84,17 +214,283 @@ class Gateway(object):
             KeyError when required key is missing
         """
         try:
-            signature = "&".join([
-                ferbuy.env,
-                str(post_data['reference']),
-                str(post_data['transaction_id']),
-                str(post_data['status']),
-                str(post_data['currency']),
-                str(post_data['amount']),
-                ferbuy.secret
-            ])
+            signature = b"&".join(
+                [_bytes(ferbuy.env)] + _callback_values(post_data) +
+                [_bytes(ferbuy.secret)])
 
             hash = hashlib.sha1(signature)
-            return post_data['checksum'] == hash.hexdigest()
+            return _checksum_equal(hash.hexdigest(), post_data['checksum'])
         except KeyError as e:
             raise KeyError("Missing required key {0}".format(e))
+
+
+class CallbackVerifier(object):
+    """Verify callback checksums of one or more sites.
+
+    The verifier keeps the secrets per site and the hash state of the
+    signature prefix, which is the same for every callback, so a callback
+    costs one hash update and a constant-time comparison.
+
+    Args:
+        secrets (dict): Shared secret per site ID.
+        secret (str): Secret of callbacks without a known site ID.
+            Defaults to `ferbuy.secret` when no `secrets` are given.
+        env (str): Environment the callbacks are signed for, `ferbuy.env`
+            by default.
+    """
+
+    # Reasons returned by `reason`
+    UNKNOWN_SITE = 'unknown site'
+    INVALID_CHECKSUM = 'invalid checksum'
+
+    def __init__(self, secrets=None, secret=None, env=None):
+        self.env = env or ferbuy.env
+        if secret is None and not secrets:
+            secret = ferbuy.secret
+        self.secret = secret
+        self.secrets = {}
+        for site_id, site_secret in (secrets or {}).items():
+            self.add_site(site_id, site_secret)
+        self._prefix = hashlib.sha1(_bytes(self.env) + b'&')
+
+    def add_site(self, site_id, secret):
+        self.secrets[str(site_id)] = _bytes(secret)
+
+    def _secret(self, post_data, site_id):
+        if site_id is None:
+            site_id = post_data.get('site_id')
+        if site_id is not None and str(site_id) in self.secrets:
+            return self.secrets[str(site_id)]
+        if self.secret is None:
+            return None
+        return _bytes(self.secret)
+
+    def checksum(self, post_data, site_id=None):
+        """Return the checksum FerBuy signs the callback with.
+
+        Raises:
+            KeyError when required key is missing or the site is unknown
+        """
+        values = _callback_values(post_data)
+        secret = self._secret(post_data, site_id)
+        if secret is None:
+            raise KeyError("No secret for site {0}".format(
+                site_id or post_data.get('site_id')))
+        return self._checksum(values, secret)
+
+    def _checksum(self, values, secret):
+        hash = self._prefix.copy()
+        hash.update(b'&'.join(values + [secret]))
+        return hash.hexdigest()
+
+    def verify(self, post_data, site_id=None):
+        """Verify FerBuy's callback checksum.
+
+        Args:
+            post_data (dict): Dictionary containing values from POST request.
+            site_id (int): Site the callback is for, by default the
+                `site_id` field of the callback.
+
+        Returns:
+            boolean: True if checksum if correct, otherwise False.
+
+        Raises:
+            KeyError when required key is missing or the site is unknown
+        """
+        for field in CALLBACK_FIELDS + ('checksum',):
+            if field not in post_data:
+                raise KeyError("Missing required key '{0}'".format(field))
+        return _checksum_equal(self.checksum(post_data, site_id),
+                               post_data['checksum'])
+
+    def reason(self, post_data, site_id=None):
+        """Return why a callback is invalid, None if it is valid.
+
+        A field which is None, e.g. null in a JSON archive, is reported as
+        missing, like a field which is not there.
+        """
+        for field in CALLBACK_FIELDS + ('checksum',):
+            if post_data.get(field) is None:
+                return 'missing {0}'.format(field)
+        try:
+            checksum = self.checksum(post_data, site_id)
+        except KeyError:
+            return self.UNKNOWN_SITE
+        if not _checksum_equal(checksum, post_data['checksum']):
+            return self.INVALID_CHECKSUM
+        return None
+
+    def verify_many(self, callbacks, site_id=None, reasons=False):
+        """Verify a batch of callbacks.
+
+        Args:
+            callbacks (iterable): POST data of the callbacks.
+            site_id (int): Site of all callbacks, by default the `site_id`
+                field of each callback.
+            reasons (bool): Return the reason of every invalid callback
+                instead of booleans.
+
+        Returns:
+            list: True or False per callback, or with `reasons` None for a
+                valid callback and the reason it failed otherwise.
+        """
+        reason = self.reason
+        results = [reason(post_data, site_id) for post_data in callbacks]
+        if reasons:
+            return results
+        return [result is None for result in results]
+
+    def reason_columns(self, columns, site_id=None):
+        """Return why callbacks given as columns are invalid.
+
+        Like `reason` for every row of a columnar table, without building
+        a dict per callback. A missing column or a None value is reported
+        as a missing field.
+
+        Args:
+            columns (dict): Sequence of values per field, the callback
+                fields, `checksum` and optionally `site_id`, all of the
+                same length.
+            site_id (int): Site of all callbacks, by default the `site_id`
+                column.
+
+        Returns:
+            list: None for every valid callback and the reason it failed
+                otherwise.
+        """
+        fields = CALLBACK_FIELDS + ('checksum',)
+        size = len(next(iter(columns.values()))) if columns else 0
+        missing = [None] * size
+        values = [columns.get(field, missing) for field in fields]
+
+        site_ids = columns.get('site_id')
+        if site_id is not None or site_ids is None:
+            secrets = itertools.repeat(self._secret({}, site_id), size)
+        else:
+            # Archives hold few sites, look each one up once
+            known = {}
+            secrets = []
+            for row_site_id in site_ids:
+                if row_site_id not in known:
+                    known[row_site_id] = self._secret({}, row_site_id)
+                secrets.append(known[row_site_id])
+
+        results = []
+        for row, secret in zip(zip(*values), secrets):
+            if None in row:
+                results.append('missing {0}'.format(fields[row.index(None)]))
+            elif secret is None:
+                results.append(self.UNKNOWN_SITE)
+            else:
+                try:
+                    # Joining the text before encoding it once is the same
+                    # signature, much faster for rows of str values
+                    signed = [_bytes('&'.join(row[:-1]))]
+                except (TypeError, UnicodeError):
+                    signed = [_bytes(value) for value in row[:-1]]
+                if _checksum_equal(self._checksum(signed, secret), row[-1]):
+                    results.append(None)
+                else:
+                    results.append(self.INVALID_CHECKSUM)
+        return results
+
+
+def _columns_to_rows(table):
+    columns = list(table.keys())
+    for values in zip(*[table[column] for column in columns]):
+        yield dict(zip(columns, values))
+
+
+def _chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class GatewayBuilder(object):
+    """Sign many gateway payloads, e.g. to pre-generate payment links.
+
+    The settings are read once and the hash state of the signature prefix
+    `env&site_id&` is computed once, so a payload costs one hash update.
+    Unlike `Gateway`, the rows passed in are not modified.
+
+    Args:
+        site_id (int): Site ID assigned by FerBuy.
+        secret (str): Shared secret for checksum verification.
+        gateway_base (str): FerBuy's gateway url.
+        env (str): Environment, `ferbuy.env` by default.
+
+    Raises:
+        ValueError: Neither the arguments nor the module settings give a
+            site ID and a secret.
+    """
+
+    def __init__(self, site_id=None, secret=None, gateway_base=None,
+                 env=None):
+        self.site_id = site_id or ferbuy.site_id
+        self.secret = secret or ferbuy.secret
+        _require_credentials(self.site_id, self.secret)
+        self.gateway_base = gateway_base or ferbuy.gateway_base
+        self.env = env or ferbuy.env
+        self.url = "{0}/{1}/".format(self.gateway_base, self.env)
+
+        self._prefix = hashlib.sha1(b'&'.join(
+            [_bytes(self.env), _bytes(self.site_id), b'']))
+        self._suffix = b'&' + _bytes(self.secret)
+
+    @property
+    def settings(self):
+        return {'site_id': self.site_id, 'secret': self.secret,
+                'gateway_base': self.gateway_base, 'env': self.env}
+
+    def checksum(self, data):
+        """Return the checksum of a payload, like `Gateway.checksum`."""
+        hash = self._prefix.copy()
+        hash.update(_bytes(_payment_signature(data)) + self._suffix)
+        return hash.hexdigest()
+
+    def sign(self, row):
+        """Return the signed payload of one order row.
+
+        Returns:
+            SignedPayload: Copy of the row with `site_id` and `checksum`
+                added, the checksum and the gateway url.
+        """
+        data = dict(row)
+        if 'site_id' not in data:
+            data['site_id'] = self.site_id
+        if 'checksum' not in data:
+            data['checksum'] = self.checksum(data)
+        return SignedPayload(data, data['checksum'], self.url)
+
+    def build(self, rows, processes=None, chunksize=1000, min_batch=10000):
+        """Sign order rows, yielding the payloads in the order of the rows.
+
+        Args:
+            rows: Iterable of dicts, or a columnar table mapping each field
+                to a sequence of values (a dict of lists or a DataFrame).
+            processes (int): Sign in a pool of this many processes, worth
+                it for very large batches only, see `BatchSigner`.
+            chunksize (int): Rows sent to a worker process at once.
+            min_batch (int): With `processes`, batches with fewer rows are
+                still signed in-process. 0 always uses the pool.
+
+        Yields:
+            SignedPayload: One per row.
+        """
+        if hasattr(rows, 'keys'):
+            rows = _columns_to_rows(rows)
+
+        if not processes:
+            for row in rows:
+                yield self.sign(row)
+            return
+
+        from ferbuy.signing import BatchSigner
+        with BatchSigner(processes=processes, chunksize=chunksize,
+                         min_batch=min_batch, **self.settings) as signer:
+            for payload in signer.sign(rows):
+                yield payload
@@ -0,0 +1,221 @@
+import threading
+import time
+import weakref
+
+from ferbuy import utils
+
+
+class RequestContext(object):
+    """Information about one API request, passed to every hook.
+
+    Attributes:
+        method (str): HTTP method.
+        endpoint (str): API path, e.g. '/MarkOrderShipped'.
+        attempt (int): Number of the attempt in progress.
+        status_code (int): HTTP status of the last response.
+        bytes_sent (int): Size of the request body.
+        bytes_received (int): Size of the last response body.
+        timings (dict): Seconds spent per phase of the last attempt:
+            'connect' (opening a connection, zero when one was reused),
+            'wait' (until the response headers arrived), 'transfer'
+            (reading the body) and 'parse' (decoding the response).
+        retry_state (RetryState): Attempts made for the request.
+        error (Exception): Error the request failed with.
+        started (float): Timestamp when the request started.
+        data (dict): Storage for hooks, e.g. a tracing span.
+    """
+
+    __slots__ = ('method', 'endpoint', 'attempt', 'status_code',
+                 'bytes_sent', 'bytes_received', 'timings', 'retry_state',
+                 'error', 'started', 'data')
+
+    def __init__(self, method, endpoint, retry_state=None):
+        self.method = method
+        self.endpoint = endpoint
+        self.attempt = 0
+        self.status_code = None
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.timings = {}
+        self.retry_state = retry_state
+        self.error = None
+        self.started = time.time()
+        self.data = {}
+
+    @property
+    def elapsed(self):
+        return time.time() - self.started
+
+
+class RequestHook(object):
+    """Base class for request hooks, every method is optional."""
+
+    def before_request(self, context):
+        pass
+
+    def after_response(self, context):
+        pass
+
+    def on_error(self, context, error):
+        pass
+
+    def on_retry(self, context, delay):
+        pass
+
+
+def emit(hooks, event, *args):
+    for hook in hooks:
+        try:
+            getattr(hook, event)(*args)
+        except Exception:
+            utils.logger.exception(
+                "Request hook {0!r} failed in {1}".format(hook, event))
+
+
+# Metrics of the PrometheusHooks per registry and namespace, a registry
+# refuses a second metric with the same name
+_prometheus_metrics = weakref.WeakKeyDictionary()
+_prometheus_lock = threading.Lock()
+
+
+class PrometheusHook(RequestHook):
+    """Export request metrics with `prometheus_client`.
+
+    Hooks for the same registry and namespace share their metrics, so any
+    number of them can be created, e.g. one per requestor.
+
+    Args:
+        registry: Collector registry, the default registry if omitted.
+        namespace (str): Prefix of the metric names.
+    """
+
+    def __init__(self, registry=None, namespace='ferbuy'):
+        # Imported here, every requestor loads this module
+        try:
+            import prometheus_client
+        except ImportError:
+            raise ImportError(
+                "PrometheusHook requires the prometheus_client library. "
+                "Try to install it via 'pip install prometheus_client'.")
+
+        if registry is None:
+            registry = prometheus_client.REGISTRY
+        with _prometheus_lock:
+            metrics = _prometheus_metrics.setdefault(registry, {})
+            if namespace not in metrics:
+                metrics[namespace] = self._create_metrics(
+                    prometheus_client, registry, namespace)
+        (self.requests, self.errors, self.retries, self.bytes,
+         self.duration) = metrics[namespace]
+
+    @staticmethod
+    def _create_metrics(prometheus_client, registry, namespace):
+        kwargs = {'namespace': namespace, 'registry': registry}
+        requests = prometheus_client.Counter(
+            'requests_total', 'FerBuy API requests',
+            ['endpoint', 'status'], **kwargs)
+        errors = prometheus_client.Counter(
+            'errors_total', 'Failed FerBuy API requests',
+            ['endpoint', 'error'], **kwargs)
+        retries = prometheus_client.Counter(
+            'retries_total', 'Retried FerBuy API requests',
+            ['endpoint'], **kwargs)
+        bytes_ = prometheus_client.Counter(
+            'bytes_total', 'Bytes sent to and received from FerBuy',
+            ['endpoint', 'direction'], **kwargs)
+        duration = prometheus_client.Histogram(
+            'request_duration_seconds', 'Time spent per request phase',
+            ['endpoint', 'phase'], **kwargs)
+        return requests, errors, retries, bytes_, duration
+
+    def _observe(self, context):
+        self.bytes.labels(context.endpoint, 'sent').inc(context.bytes_sent)
+        self.bytes.labels(context.endpoint, 'received').inc(
+            context.bytes_received)
+        for phase, seconds in context.timings.items():
+            self.duration.labels(context.endpoint, phase).observe(seconds)
+        self.duration.labels(context.endpoint, 'total').observe(
+            context.elapsed)
+
+    def after_response(self, context):
+        self.requests.labels(context.endpoint, context.status_code).inc()
+        self._observe(context)
+
+    def on_error(self, context, error):
+        self.requests.labels(context.endpoint, context.status_code).inc()
+        self.errors.labels(context.endpoint, error.__class__.__name__).inc()
+        self._observe(context)
+
+    def on_retry(self, context, delay):
+        self.retries.labels(context.endpoint).inc()
+
+
+class OpenTelemetryHook(RequestHook):
+    """Trace every request as an OpenTelemetry client span.
+
+    Args:
+        tracer: Tracer to create spans with, by default the global tracer
+            provider's tracer for 'ferbuy'.
+    """
+
+    def __init__(self, tracer=None):
+        # Imported here, every requestor loads this module
+        try:
+            from opentelemetry import trace as otel_trace
+        except ImportError:
+            otel_trace = None
+        self._trace = otel_trace
+
+        if tracer is None:
+            if otel_trace is None:
+                raise ImportError(
+                    "OpenTelemetryHook requires the opentelemetry-api "
+                    "library. Try to install it via "
+                    "'pip install opentelemetry-api'.")
+            tracer = otel_trace.get_tracer('ferbuy')
+        self.tracer = tracer
+
+    def before_request(self, context):
+        kwargs = {}
+        if self._trace is not None:
+            kwargs['kind'] = self._trace.SpanKind.CLIENT
+        span = self.tracer.start_span(
+            'FerBuy {0}'.format(context.endpoint), **kwargs)
+        span.set_attribute('http.method', context.method.upper())
+        span.set_attribute('ferbuy.endpoint', context.endpoint)
+        context.data['span'] = span
+
+    def _end(self, context):
+        span = context.data.pop('span', None)
+        if span is None:
+            return None
+        if context.status_code is not None:
+            span.set_attribute('http.status_code', context.status_code)
+        span.set_attribute('http.request_content_length', context.bytes_sent)
+        span.set_attribute('http.response_content_length',
+                           context.bytes_received)
+        span.set_attribute('ferbuy.attempts', context.attempt)
+        for phase, seconds in context.timings.items():
+            span.set_attribute('ferbuy.time.{0}'.format(phase), seconds)
+        return span
+
+    def after_response(self, context):
+        span = self._end(context)
+        if span is not None:
+            span.end()
+
+    def on_error(self, context, error):
+        span = self._end(context)
+        if span is None:
+            return
+        span.record_exception(error)
+        if self._trace is not None:
+            span.set_status(self._trace.Status(
+                self._trace.StatusCode.ERROR, str(error)))
+        span.end()
+
+    def on_retry(self, context, delay):
+        span = context.data.get('span')
+        if span is not None:
+            span.add_event('retry', {'ferbuy.attempt': context.attempt,
+                                     'ferbuy.delay': delay})
@@ -1,6 +1,10 @@
+import os
 import sys
-import textwrap
+import threading
+import time
+import weakref
 
+import ferbuy
 from ferbuy import errors
 
 # Requests is the prefered HTTP library
@@ -11,46 +15,315 @@ try:
 except ImportError:
     import urllib2
 
-try:
-    import requests
-except ImportError:
-    requests = None
+# Requests, and urllib3 with it, are slow to import, they are loaded when
+# the first client is created
+_NOT_LOADED = object()
+requests = _NOT_LOADED
+
+
+def _load_requests():
+    """Import requests on first use, return None if it is missing."""
+    global requests
+    if requests is _NOT_LOADED:
+        try:
+            import requests as module
+        except ImportError:
+            module = None
+        requests = module
+    return requests
+
+
+def _fill(text):
+    # Only needed for error messages, not imported up front
+    import textwrap
+    return textwrap.fill(text)
 
 
 def new_client(*args, **kwargs):
-    if requests:
+    if _load_requests():
         client = RequestsClient
     elif sys.version_info >= (3, 0):
         client = Urllib3Client
     else:
         client = Urllib2Client
-    return client(*args, **kwargs)
+    client = client(*args, **kwargs)
+    if ferbuy.broker_path:
+        # Requests go through the host's broker, directly while it is down
+        from ferbuy.broker import BrokerClient
+        return BrokerClient(ferbuy.broker_path, fallback=client)
+    return client
+
+
+# Clients holding connections, they drop them in a forked child
+_fork_aware = weakref.WeakSet()
+
+
+def _after_fork():
+    for client in list(_fork_aware):
+        client._after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Python 3.7+, older versions notice the fork by the changed PID
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class HTTPResponse(tuple):
+    """`(content, status_code)` pair which also carries response headers.
+
+    It unpacks like the plain tuple returned by `HTTPClient.request`.
+    `timings` holds the seconds spent per phase of the request when the
+    client measures them.
+    """
+
+    def __new__(cls, content, status_code, headers=None, timings=None):
+        response = tuple.__new__(cls, (content, status_code))
+        response.headers = headers if headers is not None else {}
+        response.timings = timings if timings is not None else {}
+        return response
+
+    @property
+    def content(self):
+        return self[0]
+
+    @property
+    def status_code(self):
+        return self[1]
 
 
 class HTTPClient(object):
 
+    # Maximum response body in bytes, `ferbuy.max_body_size` when None
+    max_body_size = None
+
     def request(self, method, url, headers, data=None):
         raise NotImplementedError('HTTPClient subclasses must '
                                   'implement "request" method')
 
+    def _body_limit(self):
+        if self.max_body_size is not None:
+            return self.max_body_size
+        return ferbuy.max_body_size
+
+    def _read_file(self, result, status_code):
+        """Read the body of a file-like response of urllib or urllib2."""
+        try:
+            return read_body(result.read, status_code, self._body_limit(),
+                             result.info().get('Content-Length'))
+        except errors.ResponseTooLargeError:
+            # Drop the connection instead of reading the rest of the body
+            result.close()
+            raise
+
+
+# Bytes read from a response at a time
+CHUNK_SIZE = 16 * 1024
+
+
+class ResponseBody(object):
+    """Collects the chunks of a response body of at most `limit` bytes.
+
+    Bodies announcing a larger Content-Length are rejected before they are
+    read, others as soon as the chunks read exceed the limit, so at most
+    `limit` plus one chunk is held in memory.
+
+    Raises:
+        ResponseTooLargeError: If the body is larger than `limit`.
+    """
+
+    def __init__(self, status_code, limit=None, length=None):
+        self.status_code = status_code
+        self.limit = limit
+        self.size = 0
+        self._parts = []
+        if limit is not None and _content_length(length) > limit:
+            raise self.too_large()
+
+    def append(self, chunk):
+        self._parts.append(chunk)
+        self.size += len(chunk)
+        if self.limit is not None and self.size > self.limit:
+            raise self.too_large()
+
+    def too_large(self):
+        return errors.ResponseTooLargeError(
+            "Response body exceeds the limit of {0} bytes".format(self.limit),
+            self._parts[0] if self._parts else None, self.status_code)
+
+    @property
+    def content(self):
+        if len(self._parts) == 1:
+            return self._parts[0]
+        return b''.join(self._parts)
+
+
+def _content_length(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+def read_body(read, status_code, limit=None, length=None):
+    """Read a body with `read(size)` until it returns nothing."""
+    body = ResponseBody(status_code, limit, length)
+    while True:
+        chunk = read(CHUNK_SIZE)
+        if not chunk:
+            return body.content
+        body.append(chunk)
+
+
+# Seconds the current thread spent opening connections
+_connect_timer = threading.local()
+_pool_classes = {}
+
+
+def _timed_pool_classes():
+    """Return urllib3 pool classes whose connections time `connect()`."""
+    if not _pool_classes:
+        try:
+            from urllib3 import connectionpool
+        except ImportError:
+            return None
+
+        def timed(connection_cls):
+            class TimedConnection(connection_cls):
+                def connect(self):
+                    started = time.time()
+                    try:
+                        return super(TimedConnection, self).connect()
+                    finally:
+                        _connect_timer.elapsed = (
+                            getattr(_connect_timer, 'elapsed', 0.0) +
+                            time.time() - started)
+            return TimedConnection
+
+        for scheme, pool_cls in (
+                ('http', connectionpool.HTTPConnectionPool),
+                ('https', connectionpool.HTTPSConnectionPool)):
+            _pool_classes[scheme] = type(
+                'Timed' + pool_cls.__name__, (pool_cls,),
+                {'ConnectionCls': timed(pool_cls.ConnectionCls)})
+    return _pool_classes
+
 
 class RequestsClient(HTTPClient):
+    """HTTP client backed by a long-lived, pooled `requests.Session`.
+
+    Connections to the gateway are kept alive and reused between calls, so
+    only the first request to a host pays for the TCP and TLS handshake.
+    A single instance is safe to share between threads, and a process
+    forked after it was used opens its own connections.
+
+    Args:
+        connect_timeout (float): Seconds to wait for a connection.
+        read_timeout (float): Seconds to wait for the server to respond.
+        pool_connections (int): Number of host pools to cache.
+        pool_maxsize (int): Maximum connections kept open per host.
+        keep_alive (bool): Reuse connections between requests.
+        max_body_size (int): Reject responses larger than this many bytes,
+            `ferbuy.max_body_size` by default.
+    """
 
     name = 'requests'
 
+    def __init__(self, connect_timeout=10, read_timeout=80,
+                 pool_connections=10, pool_maxsize=10, keep_alive=True,
+                 max_body_size=None):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.max_body_size = max_body_size
+        _load_requests()
+
+        self._after_fork()
+        _fork_aware.add(self)
+
+    def _after_fork(self):
+        # The sockets of a session created before a fork are shared with
+        # the parent, the child starts over with its own pool. The lock
+        # may have been held by another thread of the parent.
+        self._session = None
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    @property
+    def timeout(self):
+        return (self.connect_timeout, self.read_timeout)
+
+    @property
+    def session(self):
+        if self._pid != os.getpid():
+            self._after_fork()
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._build_session()
+        return self._session
+
+    def _build_session(self):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=self.pool_connections,
+            pool_maxsize=self.pool_maxsize)
+        pool_classes = _timed_pool_classes()
+        if pool_classes:
+            adapter.poolmanager.pool_classes_by_scheme = pool_classes
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        if not self.keep_alive:
+            session.headers['Connection'] = 'close'
+        return session
+
+    def close(self):
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
     def request(self, method, url, headers, data=None):
+        _connect_timer.elapsed = 0.0
+        started = time.time()
         try:
-            result = requests.request(
-                method, url, headers=headers, data=data, timeout=80)
+            result = self.session.request(
+                method, url, headers=headers, data=data, timeout=self.timeout,
+                stream=True)
 
-            content = result.content
+            content = self._read(result)
             status_code = result.status_code
         except requests.exceptions.HTTPError as e:
             content = result.content
             status_code = result.status_code
+        except errors.FerbuyError:
+            raise
         except Exception as e:
             self.handle_error(e)
-        return content, status_code
+
+        # `elapsed` runs until the response headers were parsed
+        total = time.time() - started
+        headers_received = result.elapsed.total_seconds()
+        connect = _connect_timer.elapsed
+        timings = {
+            'connect': connect,
+            'wait': max(headers_received - connect, 0),
+            'transfer': max(total - headers_received, 0),
+        }
+        return HTTPResponse(content, status_code, result.headers, timings)
+
+    def _read(self, result):
+        try:
+            body = ResponseBody(result.status_code, self._body_limit(),
+                                result.headers.get('Content-Length'))
+            for chunk in result.iter_content(CHUNK_SIZE):
+                body.append(chunk)
+        except errors.ResponseTooLargeError:
+            # Drop the connection instead of reading the rest of the body
+            result.close()
+            raise
+        return body.content
 
     def handle_error(self, e):
         if isinstance(e, requests.exceptions.RequestException):
@@ -63,7 +336,7 @@ class RequestsClient(HTTPClient):
                    "issue locally. If this problem persists, let us know at "
                    "support@ferbuy.com.")
         err = "{0}: {1}".format(e.__class__.__name__, e)
-        msg = textwrap.fill(msg + "\n\n(Network error: {0})".format(err))
+        msg = _fill(msg + "\n\n(Network error: {0})".format(err))
         raise errors.APIConnectionError(msg)
 
 
@@ -71,17 +344,20 @@ class Urllib2Client(HTTPClient):
 
     name = 'urllib2'
 
+    def __init__(self, max_body_size=None):
+        self.max_body_size = max_body_size
+
     def request(self, method, url, headers, data=None):
         req = urllib2.Request(url, data, headers)
         req.get_method = lambda: method.upper()
 
         try:
             result = urllib2.urlopen(req)
-            content = result.read()
             status_code = result.code
+            content = self._read_file(result, status_code)
         except urllib2.HTTPError as e:
-            content = result.read()
-            status_code = result.code
+            status_code = e.code
+            content = self._read_file(e, status_code)
         except (ValueError, urllib2.URLError) as e:
             self.handle_error(e)
         return content, status_code
@@ -91,7 +367,7 @@ class Urllib2Client(HTTPClient):
                "If this problem persists, let us know at "
                "support@ferbuy.com.")
         err = "{0}: {1}".format(e.__class__.__name__, e)
-        msg = textwrap.fill(msg + "\n\n(Network error: {0})".format(err))
+        msg = _fill(msg + "\n\n(Network error: {0})".format(err))
         raise errors.APIConnectionError(msg)
 
 
@@ -99,18 +375,23 @@ class Urllib3Client(HTTPClient):
 
     name = 'urllib.request'
 
+    def __init__(self, max_body_size=None):
+        self.max_body_size = max_body_size
+
     def request(self, method, url, headers, data=None):
 
+        if data and not isinstance(data, bytes):
+            data = data.encode('utf-8')
         req = urllib.request.Request(url, data, headers)
         req.get_method = lambda: method.upper()
 
         try:
             result = urllib.request.urlopen(req)
-            content = result.read()
-            status_code = result.code
-        except urllib.error.URLError as e:
-            content = result.read()
             status_code = result.code
+            content = self._read_file(result, status_code)
+        except urllib.error.HTTPError as e:
+            status_code = e.code
+            content = self._read_file(e, status_code)
         except (ValueError, urllib.request.URLError) as e:
             self.handle_error(e)
         return content, status_code
@@ -120,5 +401,5 @@ class Urllib3Client(HTTPClient):
                "If this problem persists, let us know at "
                "support@ferbuy.com.")
         err = "{0}: {1}".format(e.__class__.__name__, e)
-        msg = textwrap.fill(msg + "\n\n(Network error: {0})".format(err))
+        msg = _fill(msg + "\n\n(Network error: {0})".format(err))
         raise errors.APIConnectionError(msg)
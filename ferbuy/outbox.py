@@ -0,0 +1,354 @@
+import contextlib
+import hashlib
+import sqlite3
+import threading
+import time
+
+import ferbuy
+from ferbuy import errors
+from ferbuy import utils
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.batch import run_batch
+from ferbuy.resources import Order, Resource, Transaction
+from ferbuy.retry import RetryPolicy
+
+# Entry states
+PENDING = 'pending'
+IN_FLIGHT = 'in_flight'
+DONE = 'done'
+FAILED = 'failed'
+# Outcome unknown, e.g. a refund interrupted by a crash, needs a human
+PARKED = 'parked'
+
+# Operation: (API endpoint, idempotent)
+OPERATIONS = {
+    'shipped': ('/MarkOrderShipped', True),
+    'delivered': ('/ConfirmDelivery', True),
+    'refund': ('/RefundTransaction', False),
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ferbuy_outbox (
+    key TEXT PRIMARY KEY,
+    operation TEXT NOT NULL,
+    site_id INTEGER,
+    api_base TEXT,
+    transaction_id TEXT NOT NULL,
+    command TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    lease REAL,
+    next_attempt REAL
+);
+CREATE INDEX IF NOT EXISTS ferbuy_outbox_state
+    ON ferbuy_outbox (state, created);
+"""
+
+COLUMNS = ('key', 'operation', 'site_id', 'api_base', 'transaction_id',
+           'command', 'state', 'attempts', 'result', 'error', 'created',
+           'updated', 'lease', 'next_attempt')
+
+
+def idempotency_key(operation, transaction_id, command, site_id=None):
+    """Return the key identifying an API call.
+
+    The command contains the courier and tracking number, the delivery
+    date or the refund amount and currency, so queueing the same call
+    twice yields the same key.
+    """
+    key = '&'.join([operation, str(site_id or ''), str(transaction_id),
+                    command])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class Outbox(object):
+    """Durable queue of API calls kept in a SQLite database.
+
+    Calls are stored before they are sent, so they survive a crash of the
+    process, and every call is recorded under an idempotency key, so
+    queueing it again does not send it twice. `drain` or a background
+    drainer started with `start` sends the pending calls.
+
+    Several processes may share the database: an entry is claimed by one
+    of them and stays in flight until its lease expires. Entries still in
+    flight after that were interrupted by a crash and are recovered when
+    an outbox is opened and before every drain. Shipping and delivery
+    calls are sent again; refunds may have reached FerBuy already and are
+    parked for a human to check, see `requeue`.
+
+    Args:
+        path (str): SQLite database file, created if missing.
+        secrets (dict): Shared secret per site ID, sites which are not
+            listed use `ferbuy.secret`. Secrets are not stored.
+        max_in_flight (int): Calls sent concurrently by the drainer,
+            `ferbuy.max_in_flight` by default.
+        max_attempts (int): Attempts before a call is marked failed.
+        retry_policy (RetryPolicy): Backoff between the attempts of a call,
+            see `RetryPolicy.backoff_delay`.
+        poll_interval (float): Seconds the background drainer sleeps when
+            no calls are pending.
+        lease (float): Seconds a claimed entry belongs to the process
+            sending it, longer than a call takes with its retries.
+    """
+
+    def __init__(self, path, secrets=None, max_in_flight=None,
+                 max_attempts=5, poll_interval=1.0, lease=300.0,
+                 retry_policy=None):
+        self.path = path
+        self.secrets = dict((str(site_id), secret)
+                            for site_id, secret in (secrets or {}).items())
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.retry_policy = retry_policy or RetryPolicy(backoff=1.0,
+                                                        max_backoff=300)
+
+        self._lock = threading.Lock()
+        # Transactions are begun explicitly, see `_transaction`
+        self._db = sqlite3.connect(path, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._stopped = threading.Event()
+        self._drainer = None
+        self.recover()
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._db.close()
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock before anything is read, so
+        # other processes cannot claim the same entries in between
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._db.execute(sql, params).rowcount
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        return [dict(zip(COLUMNS, row)) for row in rows]
+
+    def recover(self):
+        """Requeue or park the entries whose lease expired in flight."""
+        now = time.time()
+        with self._transaction() as db:
+            for operation, (_, idempotent) in OPERATIONS.items():
+                db.execute(
+                    'UPDATE ferbuy_outbox SET state = ?, lease = NULL, '
+                    'updated = ? WHERE state = ? AND operation = ? '
+                    'AND lease < ?',
+                    (PENDING if idempotent else PARKED, now, IN_FLIGHT,
+                     operation, now))
+
+    def put(self, operation, transaction_id, command, site_id=None,
+            api_base=None):
+        """Queue an API call and return its idempotency key.
+
+        Queueing a call with a key already in the outbox has no effect.
+        """
+        if operation not in OPERATIONS:
+            raise ValueError("Unknown operation {0!r}".format(operation))
+        site_id = site_id or ferbuy.site_id
+        key = idempotency_key(operation, transaction_id, command, site_id)
+        now = time.time()
+        self._execute(
+            'INSERT OR IGNORE INTO ferbuy_outbox (key, operation, site_id, '
+            'api_base, transaction_id, command, state, created, updated) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, operation, site_id, api_base, str(transaction_id),
+             command, PENDING, now, now))
+        return key
+
+    def shipped(self, transaction_id, courier, tracking_number, site_id=None,
+                api_base=None):
+        """Queue `Order.shipped`, return the idempotency key."""
+        return self.put('shipped', transaction_id,
+                        Order._shipped_command(courier, tracking_number),
+                        site_id, api_base)
+
+    def delivered(self, transaction_id, date, site_id=None, api_base=None):
+        """Queue `Order.delivered`, return the idempotency key."""
+        return self.put('delivered', transaction_id,
+                        Order._delivered_command(date), site_id, api_base)
+
+    def refund(self, transaction_id, amount, currency, site_id=None,
+               api_base=None):
+        """Queue `Transaction.refund`, return the idempotency key."""
+        return self.put('refund', transaction_id,
+                        Transaction._refund_command(amount, currency),
+                        site_id, api_base)
+
+    def get(self, key):
+        """Return the entry of an idempotency key as a dict, or None."""
+        rows = self._query('SELECT * FROM ferbuy_outbox WHERE key = ?',
+                           (key,))
+        return rows[0] if rows else None
+
+    def entries(self, state=None):
+        if state is None:
+            return self._query('SELECT * FROM ferbuy_outbox ORDER BY created')
+        return self._query('SELECT * FROM ferbuy_outbox WHERE state = ? '
+                           'ORDER BY created', (state,))
+
+    def requeue(self, key):
+        """Send a parked or failed entry again."""
+        return self._execute(
+            'UPDATE ferbuy_outbox SET state = ?, next_attempt = NULL, '
+            'updated = ? WHERE key = ? AND state IN (?, ?)',
+            (PENDING, time.time(), key, PARKED, FAILED)) == 1
+
+    def _claim(self, limit, skip=()):
+        # Entries are marked in flight before they are sent, so a crash
+        # while sending is noticed by `recover`. Only the entries still
+        # pending are claimed, another process may have taken the rest.
+        # Entries waiting for their next attempt and the keys in `skip`
+        # are left alone.
+        now = time.time()
+        entries = []
+        with self._transaction() as db:
+            rows = db.execute(
+                'SELECT * FROM ferbuy_outbox WHERE state = ? AND '
+                '(next_attempt IS NULL OR next_attempt <= ?) '
+                'ORDER BY created LIMIT ?',
+                (PENDING, now, limit + len(skip))).fetchall()
+            for row in rows:
+                entry = dict(zip(COLUMNS, row))
+                if entry['key'] in skip:
+                    continue
+                if len(entries) == limit:
+                    break
+                claimed = db.execute(
+                    'UPDATE ferbuy_outbox SET state = ?, '
+                    'attempts = attempts + 1, lease = ?, updated = ? '
+                    'WHERE key = ? AND state = ?',
+                    (IN_FLIGHT, now + self.lease, now, entry['key'],
+                     PENDING)).rowcount
+                if claimed == 1:
+                    entries.append(entry)
+        return entries
+
+    def _record(self, entry, state, result=None, error=None,
+                next_attempt=None):
+        self._execute(
+            'UPDATE ferbuy_outbox SET state = ?, result = ?, error = ?, '
+            'lease = NULL, next_attempt = ?, updated = ? WHERE key = ?',
+            (state, result, error, next_attempt, time.time(), entry['key']))
+
+    def _state_after_error(self, entry, error):
+        _, idempotent = OPERATIONS[entry['operation']]
+        status = getattr(error, 'http_status', None)
+        unprocessed = status in RetryPolicy.UNPROCESSED_STATUSES
+        transient = (isinstance(error, errors.APIConnectionError) or
+                     unprocessed or (status is not None and status >= 500))
+
+        if not transient:
+            return FAILED
+        if not idempotent and not unprocessed:
+            # The refund may have been made, do not send it again
+            return PARKED
+        if entry['attempts'] + 1 >= self.max_attempts:
+            return FAILED
+        return PENDING
+
+    def _send(self, entry):
+        endpoint, idempotent = OPERATIONS[entry['operation']]
+        requestor = APIRequestor.for_site(
+            entry['site_id'], self.secrets.get(str(entry['site_id'])),
+            entry['api_base'])
+        post_data = Resource._post_data(
+            requestor, entry['transaction_id'], entry['command'])
+        try:
+            result = requestor.request('post', endpoint, post_data,
+                                       idempotent=idempotent)
+        except errors.FerbuyError as e:
+            state = self._state_after_error(entry, e)
+            utils.logger.warning(
+                "Outbox {0} of transaction {1} failed ({2}): {3}".format(
+                    entry['operation'], entry['transaction_id'], state, e))
+            next_attempt = None
+            if state == PENDING:
+                # `attempts` is the count before this attempt was claimed
+                next_attempt = time.time() + self.retry_policy.backoff_delay(
+                    entry['attempts'] + 1)
+            self._record(entry, state, error=str(e),
+                         next_attempt=next_attempt)
+            return state
+        self._record(entry, DONE, result=utils.json.dumps(result))
+        return DONE
+
+    def drain(self, limit=None):
+        """Send pending calls until none are left or `limit` were sent.
+
+        Every entry is sent at most once per drain, calls which failed
+        and are retried wait for their backoff and a later drain.
+
+        Returns:
+            int: Number of entries sent.
+        """
+        max_in_flight = self.max_in_flight or ferbuy.max_in_flight
+        self.recover()
+        sent = 0
+        seen = set()
+        while limit is None or sent < limit:
+            size = 4 * max_in_flight
+            if limit is not None:
+                size = min(size, limit - sent)
+            entries = self._claim(size, seen)
+            if not entries:
+                break
+            seen.update(entry['key'] for entry in entries)
+            # Positional records, dicts would be passed as keywords
+            records = [(entry,) for entry in entries]
+            for item in run_batch(self._send, records, max_in_flight,
+                                  ordered=False):
+                if not item.ok:
+                    entry = item.item[0]
+                    utils.logger.error(
+                        "Outbox failed to send {0}: {1!r}".format(
+                            entry['key'], item.error))
+                    self._record(entry, FAILED, error=repr(item.error))
+            sent += len(entries)
+        return sent
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                sent = self.drain()
+            except Exception:
+                utils.logger.exception("Outbox drainer failed")
+                sent = 0
+            if not sent:
+                self._stopped.wait(self.poll_interval)
+
+    def start(self):
+        """Drain the outbox in a background thread."""
+        if self._drainer is None:
+            self._stopped.clear()
+            self._drainer = threading.Thread(target=self._run)
+            self._drainer.daemon = True
+            self._drainer.start()
+
+    def stop(self):
+        """Stop the background drainer after the calls being sent."""
+        if self._drainer is not None:
+            self._stopped.set()
+            self._drainer.join()
+            self._drainer = None
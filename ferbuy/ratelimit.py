@@ -0,0 +1,129 @@
+import math
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class MemoryBackend(object):
+    """Token bucket state shared by the threads of one process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._state = None
+
+    def _refill(self, state, rate, burst, now):
+        if state is None:
+            return float(burst)
+        tokens, updated = state
+        return min(float(burst), tokens + max(now - updated, 0) * rate)
+
+    def take(self, rate, burst, now, count=1):
+        """Take `count` tokens and return the tokens left.
+
+        The result is negative when the bucket was empty; it then tells how
+        many requests are queued for a token.
+        """
+        with self._lock:
+            tokens = self._refill(self._state, rate, burst, now) - count
+            self._state = (tokens, now)
+        return tokens
+
+    def tokens(self, rate, burst, now):
+        with self._lock:
+            return self._refill(self._state, rate, burst, now)
+
+
+class FileBackend(MemoryBackend):
+    """Token bucket state in a file, shared by processes on one host.
+
+    Access to the file is serialized with `fcntl.flock`, so this backend
+    is only available on POSIX systems.
+
+    Args:
+        path (str): File holding the bucket state, created if missing.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise RuntimeError("FileBackend requires the fcntl module")
+        super(FileBackend, self).__init__()
+        self.path = path
+
+    def _update(self, rate, burst, now, count):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            data = os.read(fd, 64).split()
+            state = (float(data[0]), float(data[1])) if data else None
+            tokens = self._refill(state, rate, burst, now) - count
+            if count:
+                os.lseek(fd, 0, os.SEEK_SET)
+                os.ftruncate(fd, 0)
+                state = '{0!r} {1!r}'.format(tokens, now)
+                os.write(fd, state.encode('ascii'))
+            return tokens
+        finally:
+            os.close(fd)
+
+    def take(self, rate, burst, now, count=1):
+        with self._lock:
+            return self._update(rate, burst, now, count)
+
+    def tokens(self, rate, burst, now):
+        with self._lock:
+            return self._update(rate, burst, now, 0)
+
+
+class RateLimiter(object):
+    """Token bucket limiting the rate of requests sent to FerBuy.
+
+    Every request takes a token, tokens are refilled at `rate` per second
+    up to `burst`. Callers which find the bucket empty reserve a token and
+    sleep until it is due, so concurrent workers are paced instead of
+    being rejected by the API.
+
+    Args:
+        rate (float): Requests per second.
+        burst (int): Bucket size, requests which may be sent at once.
+            Defaults to `rate`.
+        backend: Where the bucket state is kept, `MemoryBackend` for one
+            process (default) or `FileBackend` to share the budget between
+            processes.
+    """
+
+    def __init__(self, rate, burst=None, backend=None, clock=time.time,
+                 sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst or max(int(rate), 1)
+        self.backend = backend or MemoryBackend()
+        self.clock = clock
+        self.sleep = sleep
+
+    def reserve(self):
+        """Reserve a token and return seconds to wait before using it."""
+        tokens = self.backend.take(self.rate, self.burst, self.clock())
+        return max(-tokens / self.rate, 0)
+
+    def acquire(self):
+        """Block until a request may be sent, return the seconds waited."""
+        wait = self.reserve()
+        if wait > 0:
+            self.sleep(wait)
+        return wait
+
+    @property
+    def wait_time(self):
+        """Seconds a request made now would have to wait."""
+        tokens = self.backend.tokens(self.rate, self.burst, self.clock())
+        return max((1 - tokens) / self.rate, 0)
+
+    @property
+    def backlog(self):
+        """Number of requests currently waiting for a token."""
+        tokens = self.backend.tokens(self.rate, self.burst, self.clock())
+        return int(math.ceil(max(-tokens - 1e-9, 0)))
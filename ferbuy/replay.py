@@ -0,0 +1,185 @@
+"""Record API calls and replay them without the FerBuy gateway.
+
+`RecordingClient` wraps a real HTTP client and appends every request and
+its response and latency to a JSON lines file. `ReplayClient` serves the
+recorded responses, at the recorded latency or a multiple of it, so order
+services can be load tested and benchmarked offline and repeatably.
+
+Requests are matched by HTTP method, endpoint path and post data. The
+checksum is left out, so recordings still match when the secret differs
+between the recording and the test.
+"""
+import random
+import threading
+import time
+
+from ferbuy import errors
+from ferbuy import utils
+from ferbuy.http_client import HTTPClient, HTTPResponse
+
+try:
+    from urllib.parse import parse_qsl, urlencode, urlsplit
+except ImportError:
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlsplit
+
+# Post data fields which differ between otherwise identical requests
+IGNORED_FIELDS = frozenset(['checksum'])
+
+
+def _text(value):
+    # Bytes on Python 3, Python 2 handles str as text
+    if not isinstance(value, str) and isinstance(value, bytes):
+        return value.decode('utf-8', 'replace')
+    return value
+
+
+def normalize(url, data=None):
+    """Return `(endpoint, data)` identifying a request.
+
+    The endpoint is the path of the URL. The data combines the query
+    string and the post data, without the checksum, sorted and encoded.
+    """
+    parts = urlsplit(url)
+    fields = parse_qsl(parts.query, keep_blank_values=True)
+    if data:
+        fields += parse_qsl(_text(data), keep_blank_values=True)
+    fields = sorted((k, v) for k, v in fields if k not in IGNORED_FIELDS)
+    return parts.path, urlencode(fields)
+
+
+class RecordingClient(HTTPClient):
+    """Send requests with `client` and record them to a JSON lines file.
+
+    Every line holds one call: method, endpoint, normalized data, status,
+    body and the seconds the call took. Connection errors are recorded
+    too and raised again on replay. Safe to share between threads.
+
+    Args:
+        path (str): File the calls are appended to.
+        client (HTTPClient): Client sending the requests, defaults to
+            `new_client()`.
+    """
+
+    name = 'recording'
+
+    def __init__(self, path, client=None):
+        if client is None:
+            from ferbuy.http_client import new_client
+            client = new_client()
+        self.path = path
+        self.client = client
+        self._lock = threading.Lock()
+        self._file = open(path, 'a')
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def request(self, method, url, headers, data=None):
+        endpoint, normalized = normalize(url, data)
+        record = {'method': method.lower(), 'endpoint': endpoint,
+                  'data': normalized}
+        started = time.time()
+        try:
+            response = self.client.request(method, url, headers, data)
+        except errors.APIConnectionError as e:
+            record['elapsed'] = time.time() - started
+            record['error'] = str(e)
+            self._write(record)
+            raise
+        record['elapsed'] = time.time() - started
+        record['status'] = response[1]
+        record['body'] = _text(response[0])
+        self._write(record)
+        return response
+
+    def _write(self, record):
+        line = utils.json.dumps(record, sort_keys=True, separators=(',', ':'))
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+
+
+class ReplayClient(HTTPClient):
+    """Answer requests with the responses of a recording.
+
+    Identical requests recorded several times are answered with their
+    recorded responses in turn. Every response is delayed by its
+    recorded latency divided by `speed`, so the replay follows the
+    latency distribution of the recording.
+
+    Args:
+        path (str): JSON lines file written by `RecordingClient`.
+        speed (float): Replay this many times faster than recorded, 0
+            answers without delay.
+        match (str): 'data' answers only requests recorded with the same
+            data. 'endpoint' answers with a random recorded response of
+            the endpoint when the data was not recorded, for load tests
+            with other transactions than the recording.
+        seed: Seed of the random choices of `match='endpoint'`.
+        sleep (callable): Called with the seconds to wait.
+
+    Raises:
+        APIConnectionError: From `request` for requests missing from the
+            recording.
+    """
+
+    name = 'replay'
+
+    def __init__(self, path, speed=1.0, match='data', seed=None,
+                 sleep=time.sleep):
+        if match not in ('data', 'endpoint'):
+            raise ValueError("Unknown match {0!r}".format(match))
+        self.speed = speed
+        self.match = match
+        self.sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._endpoints = {}
+        self._turns = {}
+
+        with open(path) as lines:
+            for line in lines:
+                if not line.strip():
+                    continue
+                record = utils.json.loads(line)
+                key = (record['method'], record['endpoint'], record['data'])
+                self._calls.setdefault(key, []).append(record)
+                self._endpoints.setdefault(
+                    (record['method'], record['endpoint']), []).append(record)
+
+    def __len__(self):
+        return sum(len(records) for records in self._calls.values())
+
+    def _next(self, key):
+        records = self._calls.get(key)
+        if records is not None:
+            with self._lock:
+                turn = self._turns.get(key, 0)
+                self._turns[key] = turn + 1
+            return records[turn % len(records)]
+        if self.match == 'endpoint':
+            records = self._endpoints.get(key[:2])
+            if records is not None:
+                with self._lock:
+                    return self._random.choice(records)
+        return None
+
+    def request(self, method, url, headers, data=None):
+        endpoint, normalized = normalize(url, data)
+        record = self._next((method.lower(), endpoint, normalized))
+        if record is None:
+            raise errors.APIConnectionError(
+                "No recorded response for {0} {1} with {2!r}".format(
+                    method.upper(), endpoint, normalized))
+
+        delay = record['elapsed'] / self.speed if self.speed else 0
+        if delay > 0:
+            self.sleep(delay)
+
+        if 'error' in record:
+            raise errors.APIConnectionError(record['error'])
+        return HTTPResponse(record['body'].encode('utf-8'), record['status'],
+                            timings={'wait': delay})
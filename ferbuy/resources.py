@@ -1,17 +1,40 @@
 import datetime
 
 from ferbuy.api_requestor import APIRequestor
+from ferbuy.batch import run_batch
 
 
 class Resource(object):
     # only JSON format is supported with the API binding
     output = 'json'
 
+    @staticmethod
+    def _post_data(requestor, transaction_id, command):
+        post_data = {
+            'command': command,
+            'output_type': Resource.output,
+            'site_id': requestor.site_id,
+            'transaction_id': transaction_id,
+        }
+        post_data['checksum'] = requestor.sign(**post_data)
+        return post_data
+
 
 class Order(Resource):
 
     @staticmethod
-    def shipped(transaction_id, courier, tracking_number):
+    def _shipped_command(courier, tracking_number):
+        return '{0}:{1}'.format(courier, tracking_number)
+
+    @staticmethod
+    def _delivered_command(date):
+        if not isinstance(date, datetime.datetime):
+            raise ValueError("expecting `date` to be datetime object")
+        return date.strftime("%Y-%m-%d %H:%I:%S")
+
+    @staticmethod
+    def shipped(transaction_id, courier, tracking_number, site_id=None,
+                secret=None, api_base=None):
         """Mark order as shipped and return a response object.
 
         Mark order as shipped as soon as you have shipped it. Marking an order
@@ -25,25 +48,25 @@ class Order(Resource):
                 It's possible to define your own eg. 'DPD'.
             tracking_number (int|str): Tracking number supported by courier
                 company.
+            site_id (int): Optional site ID overriding `ferbuy.site_id`.
+            secret (str): Optional secret overriding `ferbuy.secret`.
+            api_base (str): Optional API url overriding `ferbuy.api_base`.
 
         Returns:
             FerbuyObject: Response object containing API's request and response.
         """
-        requestor = APIRequestor()
+        requestor = APIRequestor.for_site(site_id, secret, api_base)
 
-        post_data = {
-            'command': '{0}:{1}'.format(courier, tracking_number),
-            'output_type': Resource.output,
-            'site_id': requestor.site_id,
-            'transaction_id': transaction_id,
-        }
-        post_data['checksum'] = requestor.sign(**post_data)
+        post_data = Resource._post_data(
+            requestor, transaction_id,
+            Order._shipped_command(courier, tracking_number))
 
         response = requestor.request('post', '/MarkOrderShipped', post_data)
         return response
 
     @staticmethod
-    def delivered(transaction_id, date):
+    def delivered(transaction_id, date, site_id=None, secret=None,
+                  api_base=None):
         """Mark order as being delivered and return a response object.
 
         For some merchants the `ConfirmDeliver` function is required. If this
@@ -52,6 +75,9 @@ class Order(Resource):
         Args:
             transaction_id (int): Transaction ID with FerBuy.
             date (datetime): Datetime object representing date of delivery.
+            site_id (int): Optional site ID overriding `ferbuy.site_id`.
+            secret (str): Optional secret overriding `ferbuy.secret`.
+            api_base (str): Optional API url overriding `ferbuy.api_base`.
 
         Returns:
             FerbuyObject: Response object containing API's request and response.
@@ -59,27 +85,58 @@ class Order(Resource):
         Raises:
             ValueError: If `date` is not an instance of datetime object.
         """
-        if not isinstance(date, datetime.datetime):
-            raise ValueError("expecting `date` to be datetime object")
+        command = Order._delivered_command(date)
 
-        requestor = APIRequestor()
+        requestor = APIRequestor.for_site(site_id, secret, api_base)
 
-        post_data = {
-            'command': date.strftime("%Y-%m-%d %H:%I:%S"),
-            'output_type': Resource.output,
-            'site_id': requestor.site_id,
-            'transaction_id': transaction_id,
-        }
-        post_data['checksum'] = requestor.sign(**post_data)
+        post_data = Resource._post_data(requestor, transaction_id, command)
 
         response = requestor.request('post', '/ConfirmDelivery', post_data)
         return response
 
+    @staticmethod
+    def shipped_many(records, max_in_flight=None, timeout=None, ordered=True):
+        """Mark many orders as shipped concurrently.
+
+        Args:
+            records (iterable): Dicts with `Order.shipped` arguments.
+            max_in_flight (int): Maximum number of concurrent requests.
+            timeout (float): Per-item timeout in seconds.
+            ordered (bool): Yield results in input order.
+
+        Returns:
+            iterator: `BatchResult` for every record.
+        """
+        return run_batch(Order.shipped, records, max_in_flight, timeout,
+                         ordered)
+
+    @staticmethod
+    def delivered_many(records, max_in_flight=None, timeout=None,
+                       ordered=True):
+        """Mark many orders as delivered concurrently.
+
+        Args:
+            records (iterable): Dicts with `Order.delivered` arguments.
+            max_in_flight (int): Maximum number of concurrent requests.
+            timeout (float): Per-item timeout in seconds.
+            ordered (bool): Yield results in input order.
+
+        Returns:
+            iterator: `BatchResult` for every record.
+        """
+        return run_batch(Order.delivered, records, max_in_flight, timeout,
+                         ordered)
+
 
 class Transaction(Resource):
 
     @staticmethod
-    def refund(transaction_id, amount, currency):
+    def _refund_command(amount, currency):
+        return '{0}{1}'.format(currency, amount)
+
+    @staticmethod
+    def refund(transaction_id, amount, currency, site_id=None, secret=None,
+               api_base=None):
         """Refund a transaction and return a response object.
 
         Sometimes orders are being returned. In case that happens,
@@ -91,19 +148,35 @@ class Transaction(Resource):
                 For example to refund 20.98 EUR the amount needs to be `2098`.
             currency: Currency code following ISO 4217 format.
                 Supported currencies are: USD, EUR, CZK, PLN, SGD.
+            site_id (int): Optional site ID overriding `ferbuy.site_id`.
+            secret (str): Optional secret overriding `ferbuy.secret`.
+            api_base (str): Optional API url overriding `ferbuy.api_base`.
 
         Returns:
             FerbuyObject: Response object containing API's request and response.
         """
-        requestor = APIRequestor()
+        requestor = APIRequestor.for_site(site_id, secret, api_base)
 
-        post_data = {
-            'command': '{0}{1}'.format(currency, amount),
-            'output_type': Resource.output,
-            'site_id': requestor.site_id,
-            'transaction_id': transaction_id,
-        }
-        post_data['checksum'] = requestor.sign(**post_data)
+        post_data = Resource._post_data(
+            requestor, transaction_id,
+            Transaction._refund_command(amount, currency))
 
-        response = requestor.request('post', '/RefundTransaction', post_data)
+        response = requestor.request('post', '/RefundTransaction', post_data,
+                                     idempotent=False)
         return response
+
+    @staticmethod
+    def refund_many(records, max_in_flight=None, timeout=None, ordered=True):
+        """Refund many transactions concurrently.
+
+        Args:
+            records (iterable): Dicts with `Transaction.refund` arguments.
+            max_in_flight (int): Maximum number of concurrent requests.
+            timeout (float): Per-item timeout in seconds.
+            ordered (bool): Yield results in input order.
+
+        Returns:
+            iterator: `BatchResult` for every record.
+        """
+        return run_batch(Transaction.refund, records, max_in_flight, timeout,
+                         ordered)
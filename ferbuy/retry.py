@@ -0,0 +1,203 @@
+import calendar
+import random
+import time
+
+from email.utils import parsedate_tz, mktime_tz
+
+from ferbuy import errors
+from ferbuy import utils
+
+
+class RetryState(object):
+    """Attempts made for a single request.
+
+    Attributes:
+        attempts (int): Number of attempts made, the last one is the one
+            which succeeded or finally failed.
+        history (list): `(attempt, outcome, delay)` for every retried
+            attempt, where outcome is the status code or the exception.
+        started (float): Timestamp of the first attempt.
+        finished (float): Timestamp when the request completed.
+    """
+
+    def __init__(self):
+        self.attempts = 0
+        self.history = []
+        self.started = time.time()
+        self.finished = None
+
+    @property
+    def retries(self):
+        return max(self.attempts - 1, 0)
+
+    @property
+    def delay(self):
+        """Seconds spent waiting between attempts."""
+        return sum(delay for _, _, delay in self.history)
+
+    @property
+    def elapsed(self):
+        """Seconds from the first attempt until the request completed."""
+        return (self.finished or time.time()) - self.started
+
+    def __repr__(self):
+        return '<RetryState attempts={0} elapsed={1:.3f}s>'.format(
+            self.attempts, self.elapsed)
+
+
+class RetryPolicy(object):
+    """Retry failed requests with exponential backoff and jitter.
+
+    Connection errors and responses with one of `retry_statuses` are
+    retried. Requests which are not idempotent, like refunds, are only
+    retried on statuses telling that the request was not processed at all
+    (429 and 503), since a timed out or failed request may still have
+    reached FerBuy.
+
+    Args:
+        max_attempts (int): Attempts per request, including the first one.
+        backoff (float): Base delay in seconds. The n-th retry waits up to
+            `backoff * 2 ** (n - 1)` seconds.
+        max_backoff (float): Upper bound for a single computed delay.
+        jitter (bool): Wait a random time between zero and the computed
+            delay ("full jitter") so clients do not retry in lockstep.
+        deadline (float): Give up when the next attempt would start more
+            than this many seconds after the first one.
+        retry_statuses (iterable): HTTP status codes which are retried.
+        respect_retry_after (bool): Wait at least as long as the server
+            asks for in the `Retry-After` header.
+    """
+
+    RETRY_STATUSES = (429, 502, 503, 504)
+
+    # The server did not act on the request
+    UNPROCESSED_STATUSES = (429, 503)
+
+    def __init__(self, max_attempts=3, backoff=0.5, max_backoff=30,
+                 jitter=True, deadline=None, retry_statuses=RETRY_STATUSES,
+                 respect_retry_after=True):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.deadline = deadline
+        self.retry_statuses = frozenset(retry_statuses)
+        self.respect_retry_after = respect_retry_after
+
+    def backoff_delay(self, attempt):
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+    def retry_after(self, response):
+        headers = getattr(response, 'headers', None) or {}
+        value = headers.get('Retry-After') or headers.get('retry-after')
+        if not value:
+            return None
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            parsed = parsedate_tz(value)
+            if parsed is None:
+                return None
+            return max(mktime_tz(parsed) - calendar.timegm(time.gmtime()), 0)
+
+    def retry_delay(self, state, response=None, error=None, idempotent=True):
+        """Return seconds to wait before the next attempt or None to stop.
+
+        Args:
+            state (RetryState): State of the request, updated in place.
+            response (tuple): `(content, status_code)` of the last attempt.
+            error (APIConnectionError): Error raised by the last attempt.
+            idempotent (bool): Whether the request may be safely repeated.
+        """
+        if state.attempts >= self.max_attempts:
+            return None
+
+        if error is not None:
+            if not idempotent or isinstance(error, errors.CircuitOpenError):
+                return None
+            outcome = error
+            delay = self.backoff_delay(state.attempts)
+        else:
+            outcome = response[1]
+            if outcome not in self.retry_statuses:
+                return None
+            if not idempotent and outcome not in self.UNPROCESSED_STATUSES:
+                return None
+            delay = self.backoff_delay(state.attempts)
+            if self.respect_retry_after:
+                delay = max(delay, self.retry_after(response) or 0)
+
+        if (self.deadline is not None and
+                time.time() + delay - state.started > self.deadline):
+            return None
+
+        state.history.append((state.attempts, outcome, delay))
+        return delay
+
+    def after_attempt(self, state, response=None, error=None,
+                      idempotent=True, on_retry=None):
+        """Decide what follows an attempt, shared by the retry loops.
+
+        Marks the request finished when the policy gives up, otherwise
+        logs the retry and calls `on_retry`.
+
+        Returns:
+            float: Seconds to wait before the next attempt, None to stop.
+        """
+        delay = self.retry_delay(state, response, error, idempotent)
+        if delay is None:
+            state.finished = time.time()
+            return None
+
+        utils.logger.info(
+            "Retrying request in {0:.2f}s after attempt {1} "
+            "failed".format(delay, state.attempts))
+        if on_retry is not None:
+            on_retry(state, delay)
+        return delay
+
+    def call(self, send, state=None, idempotent=True, sleep=time.sleep,
+             on_retry=None):
+        """Call `send` until it succeeds or the policy gives up.
+
+        Args:
+            send (callable): Makes one attempt and returns the
+                `(content, status_code)` of the response.
+            state (RetryState): Filled in with the attempts made.
+            idempotent (bool): Whether the request may be safely repeated.
+            on_retry (callable): Called with the state and the delay before
+                every retry.
+
+        Returns:
+            tuple: Response of the last attempt.
+
+        Raises:
+            APIConnectionError: If the last attempt failed to connect.
+        """
+        if state is None:
+            state = RetryState()
+
+        while True:
+            state.attempts += 1
+            try:
+                response = send()
+            except errors.APIConnectionError as e:
+                delay = self.after_attempt(state, error=e,
+                                           idempotent=idempotent,
+                                           on_retry=on_retry)
+                if delay is None:
+                    raise
+            else:
+                delay = self.after_attempt(state, response=response,
+                                           idempotent=idempotent,
+                                           on_retry=on_retry)
+                if delay is None:
+                    return response
+            sleep(delay)
+
+
+# Used when no policy is configured, makes a single attempt
+NO_RETRY = RetryPolicy(max_attempts=1)
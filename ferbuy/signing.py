@@ -0,0 +1,202 @@
+"""Sign and verify large batches offline, spread over worker processes.
+
+Signing is CPU-bound, so a single Python thread caps the throughput of
+jobs like pre-generating payment links or re-verifying years of archived
+callbacks. `BatchSigner` cuts the input in chunks and signs them in a pool
+of processes. Every worker gets the secrets once, when it starts, and only
+the rows and results are sent per chunk. Results are yielded in input
+order while later chunks are still being signed, and batches too small
+to be worth a pool are signed in-process.
+"""
+import collections
+import itertools
+
+import ferbuy
+from ferbuy.gateway import (CallbackVerifier, GatewayBuilder, RequestSigner,
+                            _chunks, _columns_to_rows, _require_credentials)
+
+
+class _Signer(object):
+    """Signs one item, in a worker process or in-process."""
+
+    def __init__(self, site_id, secret, secrets, env, gateway_base):
+        self.verifier = CallbackVerifier(secrets, secret, env)
+        # Verifying callbacks only needs `secrets`, `BatchSigner` checks
+        # the credentials before anything is signed
+        self.builder = self.request_signer = None
+        if site_id is not None and secret is not None:
+            self.builder = GatewayBuilder(site_id, secret, gateway_base, env)
+            self.request_signer = RequestSigner(site_id, secret)
+
+    def sign(self, row):
+        return self.builder.sign(row)
+
+    def sign_request(self, post_data):
+        return self.request_signer.checksum(post_data['transaction_id'],
+                                            post_data['command'],
+                                            post_data['output_type'])
+
+    def verify(self, post_data, site_id=None):
+        return self.verifier.reason(post_data, site_id) is None
+
+    def reason(self, post_data, site_id=None):
+        return self.verifier.reason(post_data, site_id)
+
+
+# Signer of the current worker process, set by _init_worker
+_worker_signer = None
+
+
+def _init_worker(settings):
+    global _worker_signer
+    _worker_signer = _Signer(**settings)
+
+
+def _run_chunk(method, chunk, args):
+    func = getattr(_worker_signer, method)
+    return [func(item, *args) for item in chunk]
+
+
+class BatchSigner(object):
+    """Sign gateway payloads and API requests and verify callbacks in bulk.
+
+    The pool is started on the first batch large enough to need it and
+    kept for later batches until `close` is called, or the signer is used
+    as a context manager.
+
+    Args:
+        site_id (int): Site ID assigned by FerBuy.
+        secret (str): Shared secret for checksum verification, also used
+            for callbacks of sites without a secret in `secrets`.
+        secrets (dict): Secret per site ID of the callbacks verified.
+        env (str): Environment, `ferbuy.env` by default.
+        gateway_base (str): FerBuy's gateway url.
+        processes (int): Worker processes, the number of CPUs by default.
+            With a single process everything is signed in-process.
+        chunksize (int): Items sent to a worker at once.
+        min_batch (int): Batches with fewer items are signed in-process,
+            they are done before a pool would have started.
+    """
+
+    def __init__(self, site_id=None, secret=None, secrets=None, env=None,
+                 gateway_base=None, processes=None, chunksize=1000,
+                 min_batch=10000):
+        # Resolved here, workers do not see changes of the module settings
+        self.site_id = site_id or ferbuy.site_id
+        self.secret = secret or ferbuy.secret
+        self.secrets = dict(secrets or {})
+        self.env = env or ferbuy.env
+        self.gateway_base = gateway_base or ferbuy.gateway_base
+        self.processes = processes
+        self.chunksize = chunksize
+        self.min_batch = min_batch
+        self._signer = None
+        self._pool = None
+
+    @property
+    def settings(self):
+        return {'site_id': self.site_id, 'secret': self.secret,
+                'secrets': self.secrets, 'env': self.env,
+                'gateway_base': self.gateway_base}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Stop the worker processes."""
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def sign(self, rows):
+        """Sign order rows like `GatewayBuilder.sign`.
+
+        Args:
+            rows: Iterable of dicts, or a columnar table mapping each field
+                to a sequence of values (a dict of lists or a DataFrame).
+
+        Returns:
+            iterator: SignedPayload per row, in the order of the rows.
+
+        Raises:
+            ValueError: The signer has no site ID or no secret.
+        """
+        _require_credentials(self.site_id, self.secret)
+        if hasattr(rows, 'keys'):
+            rows = _columns_to_rows(rows)
+        return self._map('sign', rows)
+
+    def sign_requests(self, records):
+        """Sign API requests like `APIRequestor.sign`.
+
+        Args:
+            records (iterable): Dicts with `transaction_id`, `command` and
+                `output_type` of the requests.
+
+        Returns:
+            iterator: Checksum per record, in the order of the records.
+
+        Raises:
+            ValueError: The signer has no site ID or no secret.
+        """
+        _require_credentials(self.site_id, self.secret)
+        return self._map('sign_request', records)
+
+    def verify_callbacks(self, callbacks, site_id=None, reasons=False):
+        """Verify callbacks like `CallbackVerifier.verify_many`.
+
+        Args:
+            callbacks (iterable): POST data of the callbacks.
+            site_id (int): Site of all callbacks, by default the `site_id`
+                field of each callback.
+            reasons (bool): Yield the reason of every invalid callback
+                instead of booleans.
+
+        Returns:
+            iterator: True or False per callback, or with `reasons` None
+                for a valid callback and the reason it failed otherwise.
+        """
+        return self._map('reason' if reasons else 'verify', callbacks,
+                         (site_id,))
+
+    def _pool_size(self):
+        if self.processes is not None:
+            return self.processes
+        import multiprocessing
+        return multiprocessing.cpu_count()
+
+    def _map(self, method, items, args=()):
+        items = iter(items)
+        processes = self._pool_size()
+        head = []
+        if processes > 1:
+            head = list(itertools.islice(items, self.min_batch))
+        if processes <= 1 or len(head) < self.min_batch:
+            if self._signer is None:
+                self._signer = _Signer(**self.settings)
+            func = getattr(self._signer, method)
+            for item in itertools.chain(head, items):
+                yield func(item, *args)
+            return
+
+        if self._pool is None:
+            import multiprocessing
+            self._pool = multiprocessing.Pool(processes, _init_worker,
+                                              (self.settings,))
+        pool = self._pool
+        # Keep a few chunks per process in flight, not the whole input
+        chunks = _chunks(itertools.chain(head, items), self.chunksize)
+        pending = collections.deque(
+            pool.apply_async(_run_chunk, (method, chunk, args))
+            for chunk in itertools.islice(chunks, processes * 2))
+        while pending:
+            results = pending.popleft().get()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(
+                    pool.apply_async(_run_chunk, (method, chunk, args)))
+            for result in results:
+                yield result
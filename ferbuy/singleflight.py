@@ -0,0 +1,84 @@
+import threading
+
+from ferbuy import utils
+
+_missing = object()
+
+
+class _Call(object):
+
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Share one execution of a function between concurrent identical calls.
+
+    The first caller for a key runs the function, callers arriving with the
+    same key while it runs wait and get its result, or its exception
+    raised again. Results are shared, not copied.
+
+    Args:
+        cache_ttl (float): Keep successful results for this many seconds
+            and return them to later callers with the same key. Off by
+            default, so only calls overlapping in time are merged.
+        cache_size (int): Maximum number of cached results.
+    """
+
+    def __init__(self, cache_ttl=None, cache_size=1024):
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._cache = None
+        if cache_ttl:
+            self._cache = utils.TTLCache(cache_size, cache_ttl)
+
+    def do(self, key, func, *args, **kwargs):
+        """Return `func(*args, **kwargs)`, shared with callers using `key`."""
+        cache = self._cache
+        if cache is not None:
+            result = cache.get(key, _missing)
+            if result is not _missing:
+                return result
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        else:
+            if cache is not None:
+                cache.set(key, call.result)
+            return call.result
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+            if call.waiters:
+                utils.logger.debug(
+                    "Shared one call with {0} waiting callers".format(
+                        call.waiters))
+
+    def forget(self, key):
+        """Drop the cached result of `key`."""
+        if self._cache is not None:
+            self._cache.pop(key)
@@ -0,0 +1,225 @@
+"""Always-on request statistics kept by every `APIRequestor`.
+
+Latencies are counted in fixed-size, log-linear histograms, in the manner
+of HdrHistogram: values below 32 microseconds get a bucket each, above
+that every power of two is split into 32 buckets, so percentiles are
+within about 3% of the recorded values and a histogram never grows.
+"""
+import heapq
+import itertools
+import threading
+import time
+
+import ferbuy
+from ferbuy import utils
+from ferbuy.hooks import RequestHook
+
+SUB_BUCKET_BITS = 5
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+# Latencies are counted up to about 2**27 microseconds, i.e. 134 seconds
+MAX_SHIFT = 27 - SUB_BUCKET_BITS
+BUCKETS = SUB_BUCKETS * (MAX_SHIFT + 2)
+
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def _bucket(micros):
+    if micros < SUB_BUCKETS:
+        return micros if micros > 0 else 0
+    shift = micros.bit_length() - SUB_BUCKET_BITS - 1
+    if shift > MAX_SHIFT:
+        return BUCKETS - 1
+    return SUB_BUCKETS * (shift + 1) + (micros >> shift) - SUB_BUCKETS
+
+
+def _bucket_value(index):
+    """Return the highest microseconds counted in bucket `index`."""
+    if index < SUB_BUCKETS:
+        return index
+    shift, sub_bucket = divmod(index - SUB_BUCKETS, SUB_BUCKETS)
+    return ((sub_bucket + SUB_BUCKETS + 1) << shift) - 1
+
+
+class Histogram(object):
+    """Latency histogram with a fixed number of buckets.
+
+    Not thread-safe, `StatsCollector` records under a lock.
+    """
+
+    __slots__ = ('counts', 'count', 'total', 'min', 'max')
+
+    def __init__(self):
+        self.counts = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def record(self, seconds):
+        self.counts[_bucket(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+        if self.min is None or seconds < self.min:
+            self.min = seconds
+        if self.max is None or seconds > self.max:
+            self.max = seconds
+
+    def percentiles(self, percentiles=PERCENTILES):
+        """Return seconds below which the given percentages of values fall."""
+        results = []
+        targets = [max(self.count * p / 100.0, 1) for p in percentiles]
+        seen = 0
+        bucket = iter(enumerate(self.counts))
+        for target in targets:
+            while seen < target:
+                index, count = next(bucket)
+                seen += count
+            results.append(min(_bucket_value(index) / 1e6, self.max))
+        return results
+
+    def summary(self):
+        """Return count and latencies in milliseconds as a dict."""
+        if not self.count:
+            return {'count': 0}
+        summary = {
+            'count': self.count,
+            'mean_ms': self.total / self.count * 1e3,
+            'min_ms': self.min * 1e3,
+            'max_ms': self.max * 1e3,
+        }
+        for percentile, value in zip(PERCENTILES, self.percentiles()):
+            summary['p{0:g}_ms'.format(percentile)] = value * 1e3
+        return summary
+
+
+def status_class(status_code):
+    """Return '2xx', '4xx', ... or 'error' for calls without a response."""
+    if not status_code:
+        return 'error'
+    return '{0}xx'.format(status_code // 100)
+
+
+class StatsCollector(RequestHook):
+    """Collect latency statistics of the requests of an `APIRequestor`.
+
+    Keeps a histogram of the request latency, retries included, per
+    endpoint and status class, and the slowest calls with their phase
+    timings. The slowest calls are kept per time window, `stats` reports
+    those of the current and the previous window.
+
+    Args:
+        slowest (int): Number of slow calls kept per window.
+        window (float): Seconds after which slow calls are forgotten.
+        dump_interval (float): Log the statistics to the `ferbuy` logger
+            every this many seconds, `ferbuy.stats_dump_interval` by
+            default. The first call after the interval logs them.
+    """
+
+    def __init__(self, slowest=10, window=300, dump_interval=None):
+        self.slowest = slowest
+        self.window = window
+        self.dump_interval = dump_interval
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._slow = []
+        self._previous_slow = []
+        self._sequence = itertools.count()
+        self._window_end = time.time() + window
+        self._next_dump = None
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+            self._slow = []
+            self._previous_slow = []
+
+    def record(self, context):
+        now = time.time()
+        elapsed = now - context.started
+        key = (context.endpoint, status_class(context.status_code))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.record(elapsed)
+
+            if now > self._window_end:
+                self._previous_slow, self._slow = self._slow, []
+                self._window_end = now + self.window
+            slow = self._slow
+            if len(slow) < self.slowest or elapsed > slow[0][0]:
+                call = (elapsed, next(self._sequence), {
+                    'endpoint': context.endpoint,
+                    'status_code': context.status_code,
+                    'attempts': context.attempt,
+                    'started': context.started,
+                    'elapsed_ms': elapsed * 1e3,
+                    'timings_ms': dict((phase, seconds * 1e3) for
+                                       phase, seconds in
+                                       context.timings.items()),
+                    'error': repr(context.error) if context.error else None,
+                })
+                if len(slow) < self.slowest:
+                    heapq.heappush(slow, call)
+                else:
+                    heapq.heapreplace(slow, call)
+
+        self._maybe_dump(now)
+
+    def after_response(self, context):
+        self.record(context)
+
+    def on_error(self, context, error):
+        self.record(context)
+
+    def stats(self):
+        """Return the statistics collected so far.
+
+        Returns:
+            dict: 'endpoints' maps every endpoint to a dict of
+            `Histogram.summary()` per status class, 'slowest' lists the
+            slowest recent calls, slowest first.
+        """
+        with self._lock:
+            histograms = [(key, histogram.summary())
+                          for key, histogram in self._histograms.items()]
+            slow = self._slow + self._previous_slow
+
+        endpoints = {}
+        for (endpoint, status), summary in histograms:
+            endpoints.setdefault(endpoint, {})[status] = summary
+        slowest = [call for _, _, call in
+                   sorted(slow, reverse=True)[:self.slowest]]
+        return {'endpoints': endpoints, 'slowest': slowest}
+
+    def _maybe_dump(self, now):
+        interval = self.dump_interval
+        if interval is None:
+            interval = ferbuy.stats_dump_interval
+        if not interval:
+            return
+        if self._next_dump is None:
+            self._next_dump = now + interval
+        elif now >= self._next_dump:
+            self._next_dump = now + interval
+            self.dump()
+
+    def dump(self):
+        """Log the statistics to the `ferbuy` logger."""
+        stats = self.stats()
+        for endpoint, classes in sorted(stats['endpoints'].items()):
+            for status, summary in sorted(classes.items()):
+                if not summary['count']:
+                    continue
+                utils.logger.info(
+                    "FerBuy {0} {1}: {2} calls, mean {3:.1f}ms, "
+                    "p50 {4:.1f}ms, p99 {5:.1f}ms, max {6:.1f}ms".format(
+                        endpoint, status, summary['count'],
+                        summary['mean_ms'], summary['p50_ms'],
+                        summary['p99_ms'], summary['max_ms']))
+        for call in stats['slowest']:
+            utils.logger.info(
+                "FerBuy slow call {0} ({1}) took {2:.1f}ms: {3}".format(
+                    call['endpoint'], call['status_code'], call['elapsed_ms'],
+                    ', '.join('{0} {1:.1f}ms'.format(phase, ms) for phase, ms
+                              in sorted(call['timings_ms'].items()))))
@@ -0,0 +1,190 @@
+"""Local stand-in for the FerBuy API used by tests and benchmarks.
+
+The stub answers the API endpoints with the same JSON envelopes as the
+gateway: `{"api": {"request": ..., "response": ...}}` on success and
+`{"error": {"errorSubject": ..., "errorDetail": ...}}` on failure.
+
+    $ python -m ferbuy.tests.stub_gateway --port 8080 --latency 0.01
+"""
+import argparse
+import hashlib
+import json
+import random
+import socket
+import sys
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qsl
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qsl
+
+
+MESSAGES = {
+    '/MarkOrderShipped': 'Transaction {0} has been marked as shipped',
+    '/ConfirmDelivery': 'Delivery of transaction {0} confirmed',
+    '/RefundTransaction': 'Refund of transaction {0} successful',
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, body):
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_envelope(self, status, subject, detail):
+        self.send_json(status, {'error': {
+            'errorSubject': subject, 'errorDetail': detail}})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length).decode('utf-8')
+        data = dict(parse_qsl(body))
+        path = self.path[len(server.prefix):]
+
+        server.count(path)
+        if server.latency:
+            time.sleep(server.latency)
+
+        handler = server.routes.get(path)
+        if handler is None:
+            return self.send_error_envelope(
+                404, 'Request error', 'Unknown API function')
+
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send_error_envelope(
+                server.error_status, 'Server error',
+                'The request could not be processed')
+
+        if server.secret is not None and not server.valid(data):
+            return self.send_error_envelope(
+                400, 'Merchant error', 'The checksum is not correct')
+
+        status, response = handler(self, path, data)
+        self.send_json(status, response)
+
+    do_GET = do_POST
+
+    def command_response(self, path, data):
+        message = MESSAGES[path].format(data.get('transaction_id'))
+        if self.server.response_size > len(message):
+            message += ' ' * (self.server.response_size - len(message))
+        return 200, {'api': {
+            'request': {
+                'command': data.get('command'),
+                'site_id': data.get('site_id'),
+                'transaction_id': data.get('transaction_id'),
+            },
+            'response': {'code': 200, 'message': message},
+        }}
+
+
+class StubGateway(ThreadingMixIn, HTTPServer):
+    """Threaded HTTP server speaking the FerBuy API.
+
+    Args:
+        port (int): Port to listen on, a free one by default.
+        latency (float): Seconds every response is delayed.
+        error_rate (float): Share of requests answered with an error.
+        error_status (int): HTTP status of the error responses.
+        response_size (int): Minimum length of the response message.
+        secret (str): Verify request checksums with this secret.
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+    prefix = '/api'
+
+    def __init__(self, port=0, latency=0, error_rate=0, error_status=500,
+                 response_size=0, secret=None, host='127.0.0.1'):
+        HTTPServer.__init__(self, (host, port), StubHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.response_size = response_size
+        self.secret = secret
+        self.requests = {}
+        self.routes = dict((path, StubHandler.command_response)
+                           for path in MESSAGES)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def api_base(self):
+        return 'http://{0}:{1}{2}'.format(
+            self.server_address[0], self.server_address[1], self.prefix)
+
+    def count(self, path):
+        with self._lock:
+            self.requests[path] = self.requests.get(path, 0) + 1
+
+    def valid(self, data):
+        signature = '&'.join([
+            data.get('site_id', ''), data.get('transaction_id', ''),
+            data.get('command', ''), data.get('output_type', ''),
+            self.secret])
+        checksum = hashlib.sha1(signature.encode('utf-8')).hexdigest()
+        return data.get('checksum') == checksum
+
+    def handle_error(self, request, client_address):
+        # Clients drop connections on purpose, e.g. to stop reading a
+        # response larger than they accept
+        if sys is None:
+            # Handler thread outliving the interpreter
+            return
+        error = sys.exc_info()[1]
+        if not isinstance(error, socket.error):
+            HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        # Polling for shutdown every 50ms instead of 500ms keeps stopping
+        # the stub after every test cheap
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        kwargs={'poll_interval': 0.05})
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--response-size', type=int, default=0)
+    args = parser.parse_args()
+
+    server = StubGateway(args.port, args.latency, args.error_rate,
+                         response_size=args.response_size)
+    print('Serving FerBuy stub API at {0}'.format(server.api_base))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+import hashlib
+import sys
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from .test_gateway import callback
+from .utils import FerbuyUnitTestCase
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+if sys.version_info >= (3, 5):
+    import asyncio
+    import ferbuy.retry
+    from ferbuy import aio
+else:
+    aio = None
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+@unittest.skipIf(aio is None, "asyncio support requires Python 3.5+")
+class AsyncAPIRequestorTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(AsyncAPIRequestorTests, self).setUp()
+
+        self.http_client = Mock(aio.AsyncHTTPClient)
+        self.http_client.name = 'mockclient'
+
+        ferbuy.site_id = 1000
+        ferbuy.secret = 'dummy secret'
+
+        self.requestor = aio.AsyncAPIRequestor(client=self.http_client)
+        aio.AsyncAPIRequestor.register(self.requestor)
+
+    def mock_response(self, response, status_code):
+        self.mock_responses([(response, status_code)])
+
+    def mock_responses(self, responses):
+        responses = list(responses)
+
+        def request(*args, **kwargs):
+            future = asyncio.get_event_loop().create_future()
+            future.set_result(responses.pop(0) if len(responses) > 1
+                              else responses[0])
+            return future
+        self.requestor.client.request = Mock(side_effect=request)
+
+    def test_valid_response(self):
+        self.mock_response(
+            '{"api":{"response":{"code":200,'
+            '"message":"Transaction ID 1000 marked as shipped"}}}',
+            200)
+
+        req = run(self.requestor.request('post', '/dummy', {}))
+
+        self.assertEqual(req.response.code, 200)
+        self.assertEqual(req.response.message,
+                         "Transaction ID 1000 marked as shipped")
+
+    def test_server_error(self):
+        self.mock_response('{"api": {}}', 500)
+
+        with self.assertRaises(ferbuy.errors.APIError):
+            run(self.requestor.request('post', '/dummy', {}))
+
+    def test_retry(self):
+        self.requestor.retry_policy = ferbuy.retry.RetryPolicy(backoff=0)
+        self.mock_responses([
+            ('', 503), ('{"api":{"response":{"code":200}}}', 200)])
+
+        req = run(self.requestor.request('post', '/dummy', {}))
+
+        self.assertEqual(req.response.code, 200)
+        self.assertEqual(req.retry_state.attempts, 2)
+
+    def test_signed_request(self):
+        self.mock_response('{"api":{"response":{"code":200}}}', 200)
+
+        run(aio.AsyncOrder.shipped(10001, 'DHL', '1234'))
+
+        method, url, headers, post_data = \
+            self.requestor.client.request.call_args[0]
+        checksum = self.requestor.sign(10001, 'DHL:1234', 'json')
+        self.assertIn(urlencode({'checksum': checksum}), post_data)
+        self.assertIn('command=DHL%3A1234', post_data)
+        self.assertEqual(checksum, hashlib.sha1(
+            b'1000&10001&DHL:1234&json&dummy secret').hexdigest())
+
+    def test_retry_connection_error(self):
+        self.requestor.retry_policy = ferbuy.retry.RetryPolicy(backoff=0)
+        self.requestor.hooks = [Mock()]
+        responses = [ferbuy.errors.APIConnectionError('reset'),
+                     ('{"api":{"response":{"code":200}}}', 200)]
+
+        def request(*args, **kwargs):
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return done(response)
+        self.requestor.client.request = Mock(side_effect=request)
+
+        with patch('ferbuy.utils.logger') as logger:
+            req = run(self.requestor.request('post', '/dummy', {}))
+
+        self.assertEqual(req.retry_state.attempts, 2)
+        self.assertTrue(req.retry_state.finished)
+        self.assertEqual(self.requestor.hooks[0].on_retry.call_count, 1)
+        self.assertTrue(logger.info.called)
+
+    def test_refund(self):
+        self.mock_response("""
+        {"api":{
+          "request":{"command":"EUR100","site_id":1000,"transaction_id":10001},
+          "response":{"message":"Refund successful","code":200}
+        }}
+        """, 200)
+
+        req = run(aio.AsyncTransaction.refund(
+            transaction_id=10001, amount=100, currency='EUR'))
+
+        self.assertEqual(req.request.command, 'EUR100')
+        self.assertEqual(req.response.code, 200)
+
+    def test_executor_client(self):
+        sync_client = Mock(ferbuy.http_client.HTTPClient)
+        sync_client.request = Mock(return_value=('{"api": {}}', 200))
+        client = aio.ExecutorClient(sync_client, max_workers=1)
+
+        body, code = run(client.request('post', '/dummy', {}, 'a=b'))
+
+        self.assertEqual((body, code), ('{"api": {}}', 200))
+        sync_client.request.assert_called_with('post', '/dummy', {}, 'a=b')
+
+
+def done(result=None):
+    future = asyncio.get_event_loop().create_future()
+    future.set_result(result)
+    return future
+
+
+@unittest.skipIf(aio is None, "asyncio support requires Python 3.5+")
+class AsyncCallbackAppTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(AsyncCallbackAppTests, self).setUp()
+        ferbuy.env = 'test'
+        ferbuy.secret = 'dummy secret'
+
+        self.handled = []
+
+        def handler(post_data):
+            self.handled.append(post_data)
+            return done()
+
+        self.app = aio.AsyncCallbackApp(handler, workers=2)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        super(AsyncCallbackAppTests, self).tearDown()
+        self.loop.run_until_complete(self.app.close())
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def call(self, post_data, method='POST'):
+        body = post_data
+        if not isinstance(body, bytes):
+            body = urlencode(sorted(post_data.items())).encode('utf-8')
+        messages = [
+            {'type': 'http.request', 'body': body[:10], 'more_body': True},
+            {'type': 'http.request', 'body': body[10:]},
+        ]
+        sent = []
+
+        def send(message):
+            sent.append(message)
+            return done()
+
+        receive = Mock(side_effect=lambda: done(messages.pop(0)))
+        scope = {'type': 'http', 'method': method}
+        self.loop.run_until_complete(self.app(scope, receive, send))
+        self.loop.run_until_complete(self.app.join())
+        return sent[0]['status'], sent[1]['body']
+
+    def test_acknowledge(self):
+        status, body = self.call(callback())
+
+        self.assertEqual((status, body), (200, b'10001.200'))
+        self.assertEqual(len(self.handled), 1)
+        self.assertEqual(self.handled[0]['reference'], 'ORDER-1')
+
+    def test_invalid_checksum(self):
+        status, body = self.call(callback(checksum='0' * 40))
+        self.assertEqual(status, 400)
+        self.assertEqual(self.handled, [])
+
+    def test_deduplicate(self):
+        self.call(callback())
+        status, body = self.call(callback())
+
+        self.assertEqual((status, body), (200, b'10001.200'))
+        self.assertEqual(len(self.handled), 1)
+
+    def test_method_not_allowed(self):
+        status, body = self.call(callback(), method='GET')
+        self.assertEqual(status, 405)
+
+    def test_undecodable_body(self):
+        status, body = self.call(b'\xff\xfe=a')
+        self.assertEqual(status, 400)
+
+    def test_body_too_large(self):
+        self.app.max_body_size = 5
+        status, body = self.call(callback())
+
+        self.assertEqual(status, 413)
+        self.assertEqual(self.handled, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ferbuy.archive import ArchiveVerifier, Mismatch, UNREADABLE
+from ferbuy.gateway import CallbackVerifier
+from .test_gateway import callback
+
+HEADER = ('site_id', 'reference', 'transaction_id', 'status', 'currency',
+          'amount', 'checksum')
+
+
+def callbacks():
+    # Rows 2 and 5 are invalid, row 4 is of a site without a secret
+    rows = []
+    for index in range(7):
+        secret = 'secret two' if index % 2 else 'secret one'
+        site_id = '2000' if index % 2 else '1000'
+        rows.append(callback(secret, site_id=site_id,
+                             reference='ORDER-{0}'.format(index),
+                             transaction_id=str(10000 + index)))
+    rows[2]['checksum'] = '0' * 40
+    rows[4]['site_id'] = '3000'
+    rows[5]['amount'] = '1001'
+    return rows
+
+
+class ArchiveVerifierTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.verifier = ArchiveVerifier(
+            secrets={1000: 'secret one', 2000: 'secret two'}, env='test',
+            chunksize=3)
+        self.expected = [
+            Mismatch(2, CallbackVerifier.INVALID_CHECKSUM, 'ORDER-2',
+                     '10002'),
+            Mismatch(4, CallbackVerifier.UNKNOWN_SITE, 'ORDER-4', '10004'),
+            Mismatch(5, CallbackVerifier.INVALID_CHECKSUM, 'ORDER-5',
+                     '10005'),
+        ]
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        content = ''.join(line + '\n' for line in lines).encode('utf-8')
+        opener = gzip.open if name.endswith('.gz') else open
+        with opener(path, 'wb') as fileobj:
+            fileobj.write(content)
+        return path
+
+    def csv_lines(self, rows):
+        return [','.join(HEADER)] + [
+            ','.join(row[field] for field in HEADER) for row in rows]
+
+    def test_csv(self):
+        path = self.write('callbacks.csv', self.csv_lines(callbacks()))
+
+        self.assertEqual(list(self.verifier.verify_file(path)),
+                         self.expected)
+        self.assertEqual(self.verifier.rows, 7)
+
+    def test_jsonl(self):
+        path = self.write('callbacks.jsonl',
+                          [json.dumps(row) for row in callbacks()])
+
+        self.assertEqual(list(self.verifier.verify_file(path)),
+                         self.expected)
+
+    def test_gzip(self):
+        path = self.write('callbacks.json.gz',
+                          [json.dumps(row) for row in callbacks()])
+
+        self.assertEqual(list(self.verifier.verify_file(path)),
+                         self.expected)
+
+    def test_unreadable_json(self):
+        lines = [json.dumps(row) for row in callbacks()[:2]]
+        lines.insert(1, '{"reference": ')
+        lines.append('[]')
+        path = self.write('callbacks.jsonl', lines)
+
+        self.assertEqual(list(self.verifier.verify_file(path)), [
+            Mismatch(1, UNREADABLE, None, None),
+            Mismatch(3, UNREADABLE, None, None)])
+
+    def test_missing_fields(self):
+        lines = self.csv_lines(callbacks()[:2])
+        lines[1] = lines[1].rsplit(',', 1)[0]
+        path = self.write('callbacks.csv', lines)
+
+        self.assertEqual(list(self.verifier.verify_file(path)), [
+            Mismatch(0, 'missing checksum', 'ORDER-0', '10000')])
+
+    def test_missing_column(self):
+        lines = ['reference,checksum', 'ORDER-1,abc']
+        path = self.write('callbacks.csv', lines)
+
+        self.assertEqual(list(self.verifier.verify_file(path)), [
+            Mismatch(0, 'missing transaction_id', 'ORDER-1', None)])
+
+    def test_empty(self):
+        path = self.write('callbacks.csv', [])
+        self.assertEqual(list(self.verifier.verify_file(path)), [])
+        self.assertEqual(self.verifier.rows, 0)
+
+    def test_format(self):
+        with self.assertRaises(ValueError):
+            self.verifier.verify_file('callbacks.xml')
+        path = self.write('callbacks.txt', self.csv_lines(callbacks()))
+        self.assertEqual(len(list(self.verifier.verify_file(path, 'csv'))),
+                         3)
+
+    def test_verify_columns(self):
+        rows = callbacks()
+        columns = dict((field, [row[field] for row in rows])
+                       for field in HEADER)
+
+        self.assertEqual(self.verifier.verify_columns(columns, offset=100),
+                         [mismatch._replace(offset=mismatch.offset + 100)
+                          for mismatch in self.expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
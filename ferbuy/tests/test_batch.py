@@ -0,0 +1,95 @@
+import threading
+import time
+import unittest
+
+from mock import Mock
+
+import ferbuy
+from ferbuy.batch import run_batch
+from .utils import FerbuyUnitTestCase, DUMMY_SHIPPMENT
+
+
+class RunBatchTests(unittest.TestCase):
+
+    def test_ordered_results(self):
+        def func(value):
+            time.sleep(0.01 * (5 - value))
+            return value * 2
+
+        results = list(run_batch(func, range(5), max_in_flight=5))
+
+        self.assertEqual([r.index for r in results], [0, 1, 2, 3, 4])
+        self.assertEqual([r.result for r in results], [0, 2, 4, 6, 8])
+        self.assertTrue(all(r.ok for r in results))
+
+    def test_unordered_results(self):
+        results = list(run_batch(lambda v: v, range(20), ordered=False))
+        self.assertEqual(sorted(r.result for r in results), list(range(20)))
+
+    def test_failure_does_not_abort(self):
+        def func(transaction_id):
+            if transaction_id == 2:
+                raise ferbuy.errors.APIError("boom")
+            return transaction_id
+
+        results = list(run_batch(
+            func, [{'transaction_id': i} for i in range(4)]))
+
+        self.assertEqual([r.ok for r in results], [True, True, False, True])
+        self.assertTrue(isinstance(results[2].error, ferbuy.errors.APIError))
+        self.assertEqual(results[3].result, 3)
+
+    def test_max_in_flight(self):
+        lock = threading.Lock()
+        state = {'current': 0, 'peak': 0}
+
+        def func(value):
+            with lock:
+                state['current'] += 1
+                state['peak'] = max(state['peak'], state['current'])
+            time.sleep(0.005)
+            with lock:
+                state['current'] -= 1
+
+        list(run_batch(func, range(30), max_in_flight=3))
+        self.assertTrue(state['peak'] <= 3)
+
+    def test_item_timeout(self):
+        def func(value):
+            if value == 0:
+                time.sleep(0.5)
+            return value
+
+        results = list(run_batch(func, range(3), max_in_flight=3,
+                                 timeout=0.05))
+
+        self.assertTrue(isinstance(results[0].error,
+                                   ferbuy.errors.APIConnectionError))
+        self.assertEqual([r.result for r in results[1:]], [1, 2])
+
+
+class BatchResourceTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(BatchResourceTests, self).setUp()
+
+        ferbuy.site_id = 1000
+        ferbuy.secret = 'dummy secret'
+
+        self.requestor = ferbuy.api_requestor.APIRequestor(
+            client=Mock(ferbuy.http_client.HTTPClient))
+        ferbuy.api_requestor.APIRequestor.register(self.requestor)
+
+    def test_shipped_many(self):
+        self.requestor.client.request = Mock(return_value=(
+            '{"api":{"response":{"message":null,"code":200}}}', 200))
+
+        results = list(ferbuy.Order.shipped_many([DUMMY_SHIPPMENT] * 3))
+
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(r.result.response.code == 200 for r in results))
+        self.assertEqual(self.requestor.client.request.call_count, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,243 @@
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from ferbuy import http_client
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.broker import _LENGTH, BrokerClient, ConnectionBroker
+from ferbuy.resources import Resource
+from .stub_gateway import StubGateway
+from .test_stub_gateway import clients
+from .utils import FerbuyTestCase
+
+
+class ConcurrencyClient(http_client.HTTPClient):
+    """Counts the requests in flight of the client it wraps."""
+
+    def __init__(self, client):
+        self.client = client
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers, data=None):
+        with self._lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        try:
+            return self.client.request(method, url, headers, data)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+
+class BrokerTests(FerbuyTestCase):
+
+    def setUp(self):
+        super(BrokerTests, self).setUp()
+        self.server = StubGateway(secret='dummy secret').start()
+        self.addCleanup(self.server.stop)
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'broker.sock')
+        self.direct = ConcurrencyClient(next(clients()))
+        self.broker = ConnectionBroker(
+            self.path, self.direct, connections=2,
+            api_bases=[self.server.api_base]).start()
+        self.addCleanup(self.broker.stop)
+        self.client = BrokerClient(self.path, timeout=5)
+        self.addCleanup(self.client.close)
+
+    def requestor(self, client=None):
+        return APIRequestor(site_id=1000, secret='dummy secret',
+                            api_base=self.server.api_base,
+                            client=client or self.client)
+
+    def shipped(self, requestor):
+        post_data = Resource._post_data(requestor, 10001, 'DHL:1234')
+        return requestor.request('post', '/MarkOrderShipped', post_data)
+
+    def test_request(self):
+        result = self.shipped(self.requestor())
+
+        self.assertEqual(result.response.code, 200)
+        self.assertEqual(result.request.transaction_id, '10001')
+        self.assertEqual(self.server.requests['/MarkOrderShipped'], 1)
+
+    def test_response(self):
+        url = self.server.api_base + '/MarkOrderShipped'
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        response = self.client.request('post', url, headers, u'checksum=0')
+        direct = self.direct.request('post', url, headers, b'checksum=0')
+
+        self.assertTrue(isinstance(response.content, bytes))
+        self.assertEqual(tuple(response), tuple(direct))
+
+    def test_headers_and_timings(self):
+        self.direct.client = Mock(http_client.HTTPClient)
+        self.direct.client.request.return_value = http_client.HTTPResponse(
+            u'{}', 503, {'Retry-After': '1'}, {'wait': 0.5})
+
+        response = self.client.request('post', self.server.api_base, {})
+
+        self.assertEqual(tuple(response), (b'{}', 503))
+        self.assertEqual(response.headers, {'Retry-After': '1'})
+        self.assertEqual(response.timings, {'wait': 0.5})
+
+    def test_connection_kept(self):
+        requestor = self.requestor()
+        self.shipped(requestor)
+        sock = self.client._local.sock
+        self.shipped(requestor)
+        self.assertTrue(self.client._local.sock is sock)
+
+    def test_bounded_connections(self):
+        self.server.latency = 0.02
+        requestor = self.requestor()
+        threads = [threading.Thread(target=self.shipped, args=(requestor,))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.server.requests['/MarkOrderShipped'], 8)
+        self.assertEqual(self.direct.most_in_flight, 2)
+
+    def test_fork(self):
+        requestor = self.requestor()
+        self.shipped(requestor)
+        sock = self.client._local.sock
+
+        with patch('os.getpid', return_value=os.getpid() + 1):
+            self.shipped(requestor)
+            self.assertTrue(self.client._local.sock is not sock)
+
+        http_client._after_fork()
+        self.assertFalse(hasattr(self.client._local, 'sock'))
+
+    def test_connection_error(self):
+        self.server.stop()
+
+        with self.assertRaises(ferbuy.errors.APIConnectionError):
+            self.client.request('post', self.server.api_base + '/Ping', {})
+
+    def test_response_too_large(self):
+        self.server.response_size = 64 * 1024
+        self.client.max_body_size = 1024
+        requestor = self.requestor()
+        with self.assertRaises(ferbuy.errors.ResponseTooLargeError):
+            self.shipped(requestor)
+
+        self.server.response_size = 0
+        self.assertEqual(self.shipped(requestor).response.code, 200)
+
+    def test_broker_down(self):
+        self.broker.stop()
+        with self.assertRaises(ferbuy.errors.APIConnectionError):
+            self.shipped(self.requestor())
+
+        fallback = Mock(http_client.HTTPClient)
+        fallback.request.return_value = (
+            '{"api":{"response":{"message":"ok","code":200}}}', 200)
+        client = BrokerClient(self.path, fallback=fallback)
+        with patch('ferbuy.utils.logger') as logger:
+            result = self.shipped(self.requestor(client))
+        self.assertEqual(result.response.code, 200)
+        self.assertTrue(fallback.request.called)
+        self.assertTrue(logger.warning.called)
+
+    def restart_broker(self):
+        self.broker.stop()
+        self.broker = ConnectionBroker(
+            self.path, self.direct,
+            api_bases=[self.server.api_base]).start()
+        self.addCleanup(self.broker.stop)
+
+    def test_broker_restarted(self):
+        requestor = self.requestor()
+        self.shipped(requestor)
+        sock = self.client._local.sock
+        self.restart_broker()
+
+        self.assertEqual(self.shipped(requestor).response.code, 200)
+        self.assertTrue(self.client._local.sock is not sock)
+
+    def test_reconnect_after_send_error(self):
+        requestor = self.requestor()
+        self.shipped(requestor)
+        self.restart_broker()
+
+        # The closed connection is only noticed when sending
+        with patch('ferbuy.broker._closed', return_value=False):
+            self.assertEqual(self.shipped(requestor).response.code, 200)
+
+    def test_broker_gone_fallback(self):
+        fallback = Mock(http_client.HTTPClient)
+        fallback.request.return_value = (
+            '{"api":{"response":{"message":"ok","code":200}}}', 200)
+        self.client.fallback = fallback
+        requestor = self.requestor()
+        self.shipped(requestor)
+        self.broker.stop()
+
+        with patch('ferbuy.utils.logger'):
+            with patch('ferbuy.broker._closed', return_value=False):
+                self.assertEqual(self.shipped(requestor).response.code, 200)
+        self.assertEqual(fallback.request.call_count, 1)
+
+    def test_refused_urls(self):
+        host = self.server.api_base.split('//')[1]
+        urls = ('file:///etc/passwd', 'https://example.com/api',
+                'https://' + host + '/x', 'http://169.254.169.254/',
+                self.server.api_base + 'x/MarkOrderShipped')
+        with patch('ferbuy.utils.logger') as logger:
+            for url in urls:
+                with self.assertRaises(ferbuy.errors.APIConnectionError):
+                    self.client.request('get', url, {})
+        self.assertEqual(logger.warning.call_count, len(urls))
+        self.assertEqual(self.direct.most_in_flight, 0)
+
+        broker = ConnectionBroker(self.path, self.direct)
+        url = ferbuy.api_base + '/RefundTransaction'
+        self.assertTrue(broker.allowed(url))
+        self.assertFalse(broker.allowed(url.replace('https:', 'http:')))
+        self.assertFalse(broker.allowed(None))
+
+    def test_oversized_frames(self):
+        for header_size, body_size in ((1 << 30, 0), (2, 1 << 30)):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.addCleanup(sock.close)
+            sock.settimeout(5)
+            sock.connect(self.path)
+            sock.sendall(_LENGTH.pack(header_size))
+            if body_size:
+                sock.sendall(b'{}' + _LENGTH.pack(body_size))
+            # The broker drops the connection without reading the frame
+            self.assertEqual(sock.recv(1), b'')
+
+    def test_socket_mode(self):
+        self.assertEqual(stat.S_IMODE(os.stat(self.path).st_mode), 0o600)
+
+    def test_new_client(self):
+        ferbuy.broker_path = self.path
+        self.addCleanup(setattr, ferbuy, 'broker_path', None)
+
+        client = http_client.new_client()
+
+        self.assertTrue(isinstance(client, BrokerClient))
+        self.assertEqual(client.path, self.path)
+        self.assertTrue(isinstance(client.fallback, http_client.HTTPClient))
+        self.assertEqual(self.shipped(self.requestor(client)).response.code,
+                         200)
+
+
+if __name__ == '__main__':
+    unittest.main()
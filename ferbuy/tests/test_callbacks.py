@@ -0,0 +1,143 @@
+import io
+import threading
+import unittest
+
+from mock import Mock
+
+import ferbuy
+from ferbuy.callbacks import CallbackApp
+from ferbuy.gateway import CallbackVerifier
+from .test_gateway import callback
+from .utils import FerbuyTestCase
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+
+def environ(post_data, method='POST'):
+    body = urlencode(sorted(post_data.items())).encode('utf-8')
+    return {
+        'REQUEST_METHOD': method,
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': io.BytesIO(body),
+    }
+
+
+class CallbackAppTests(FerbuyTestCase):
+
+    def setUp(self):
+        super(CallbackAppTests, self).setUp()
+        ferbuy.env = 'test'
+        ferbuy.secret = 'dummy secret'
+        self.handler = Mock()
+        self.app = CallbackApp(self.handler, workers=2)
+
+    def tearDown(self):
+        super(CallbackAppTests, self).tearDown()
+        self.app.close()
+
+    def call(self, environ):
+        start_response = Mock()
+        body = b''.join(self.app(environ, start_response))
+        return start_response.call_args[0][0], body
+
+    def test_acknowledge(self):
+        status, body = self.call(environ(callback()))
+        self.app.dispatcher.join()
+
+        self.assertEqual(status, '200 OK')
+        self.assertEqual(body, b'10001.200')
+        self.assertEqual(self.handler.call_count, 1)
+        self.assertEqual(self.handler.call_args[0][0]['reference'],
+                         'ORDER-1')
+
+    def test_invalid_checksum(self):
+        status, body = self.call(environ(callback(checksum='0' * 40)))
+        self.app.dispatcher.join()
+
+        self.assertEqual(status, '400 Bad Request')
+        self.assertFalse(self.handler.called)
+
+    def test_missing_field(self):
+        post_data = callback()
+        del post_data['amount']
+        status, body = self.call(environ(post_data))
+        self.assertEqual(status, '400 Bad Request')
+
+    def test_undecodable_body(self):
+        request = environ({})
+        request['wsgi.input'] = io.BytesIO(b'\xff\xfe=a')
+        request['CONTENT_LENGTH'] = '4'
+        status, body = self.call(request)
+        self.assertEqual(status, '400 Bad Request')
+
+    def test_body_too_large(self):
+        self.app.max_body_size = 100
+        request = environ(callback())
+        request['wsgi.input'] = Mock()
+        status, body = self.call(request)
+
+        self.assertEqual(status, '413 Payload Too Large')
+        self.assertFalse(request['wsgi.input'].read.called)
+
+    def test_method_not_allowed(self):
+        status, body = self.call(environ(callback(), method='GET'))
+        self.assertEqual(status, '405 Method Not Allowed')
+
+    def test_deduplicate(self):
+        for _ in range(3):
+            status, body = self.call(environ(callback()))
+            self.assertEqual(body, b'10001.200')
+        self.call(environ(callback(status='400')))
+        self.app.dispatcher.join()
+
+        self.assertEqual(self.handler.call_count, 2)
+
+    def test_queue_full(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def handler(post_data):
+            started.set()
+            release.wait()
+
+        self.app.close()
+        self.app = CallbackApp(handler, workers=1, queue_size=1)
+
+        self.call(environ(callback(transaction_id='1')))
+        started.wait()
+        self.call(environ(callback(transaction_id='2')))
+        status, body = self.call(environ(callback(transaction_id='3')))
+        self.assertEqual(status, '503 Service Unavailable')
+
+        release.set()
+        self.app.dispatcher.join()
+        status, body = self.call(environ(callback(transaction_id='3')))
+        self.assertEqual(status, '200 OK')
+
+    def test_handler_error(self):
+        self.handler.side_effect = ValueError('boom')
+        self.call(environ(callback()))
+        self.app.dispatcher.join()
+
+        self.handler.side_effect = None
+        self.call(environ(callback(transaction_id='2')))
+        self.app.dispatcher.join()
+        self.assertEqual(self.handler.call_count, 2)
+
+    def test_verifier(self):
+        self.app.close()
+        verifier = CallbackVerifier(secrets={1000: 'site secret'}, env='test')
+        self.app = CallbackApp(self.handler, verifier=verifier)
+
+        status, body = self.call(environ(callback('site secret',
+                                                  site_id='1000')))
+        self.assertEqual(status, '200 OK')
+        status, body = self.call(environ(callback(site_id='1000')))
+        self.assertEqual(status, '400 Bad Request')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from ferbuy import circuit_breaker
+from ferbuy.circuit_breaker import CircuitBreakerClient
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        self.client = Mock(ferbuy.http_client.HTTPClient)
+        self.client.request = Mock(return_value=('{}', 200))
+        self.events = []
+        self.breaker = CircuitBreakerClient(
+            self.client, failure_rate=0.5, window=4, min_calls=4,
+            reset_timeout=10, clock=self.clock)
+        self.breaker.add_listener(
+            lambda breaker, old, new: self.events.append((old, new)))
+
+    def call(self):
+        return self.breaker.request('post', '/dummy', {}, '')
+
+    def fail(self, times):
+        self.client.request = Mock(return_value=('', 503))
+        for _ in range(times):
+            self.call()
+
+    def test_closed(self):
+        self.assertEqual(self.call(), ('{}', 200))
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    def test_opens_on_failure_rate(self):
+        self.call()
+        self.call()
+        self.fail(2)
+
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.assertEqual(self.events, [('closed', 'open')])
+
+        with self.assertRaises(ferbuy.errors.CircuitOpenError):
+            self.call()
+        self.assertEqual(self.client.request.call_count, 2)
+
+    def test_needs_min_calls(self):
+        self.fail(3)
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    def test_connection_errors_count(self):
+        self.client.request = Mock(
+            side_effect=ferbuy.errors.APIConnectionError('boom'))
+        for _ in range(4):
+            with self.assertRaises(ferbuy.errors.APIConnectionError):
+                self.call()
+
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+    def test_opens_on_slow_calls(self):
+        self.breaker.slow_call_duration = 1
+        self.breaker.slow_call_rate = 0.5
+
+        def slow_request(*args):
+            self.clock.now += 2
+            return ('{}', 200)
+        self.client.request = Mock(side_effect=slow_request)
+
+        for _ in range(4):
+            self.call()
+
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+    def test_half_open_recovers(self):
+        self.fail(4)
+        self.clock.now += 10
+
+        self.assertEqual(self.breaker.state, circuit_breaker.HALF_OPEN)
+
+        self.client.request = Mock(return_value=('{}', 200))
+        self.call()
+
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+        self.assertEqual(self.events, [
+            ('closed', 'open'), ('open', 'half_open'), ('half_open', 'closed')])
+
+    def test_half_open_reopens(self):
+        self.fail(4)
+        self.clock.now += 10
+
+        self.fail(1)
+
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        with self.assertRaises(ferbuy.errors.CircuitOpenError):
+            self.call()
+
+    def test_half_open_limits_probes(self):
+        self.fail(4)
+        self.clock.now += 10
+
+        def probe(*args):
+            with self.assertRaises(ferbuy.errors.CircuitOpenError):
+                self.call()
+            return ('{}', 200)
+        self.client.request = Mock(side_effect=probe)
+
+        self.call()
+        self.assertEqual(self.client.request.call_count, 1)
+
+    def test_probe_error_reopens(self):
+        self.fail(4)
+        self.clock.now += 10
+
+        error = ferbuy.errors.ResponseTooLargeError('too large', None, 200)
+        self.client.request = Mock(side_effect=error)
+        with self.assertRaises(ferbuy.errors.ResponseTooLargeError):
+            self.call()
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+
+        # The next probe is let through after the reset timeout
+        self.clock.now += 10
+        self.client.request = Mock(return_value=('{}', 200))
+        self.call()
+        self.assertEqual(self.breaker.state, circuit_breaker.CLOSED)
+
+    def test_listener_error(self):
+        self.breaker.add_listener(Mock(side_effect=ValueError))
+
+        with patch('ferbuy.utils.logger') as logger:
+            self.fail(4)
+        self.assertEqual(self.breaker.state, circuit_breaker.OPEN)
+        self.assertTrue(logger.exception.called)
+        self.assertEqual(self.events, [('closed', 'open')])
+
+
+if __name__ == '__main__':
+    unittest.main()
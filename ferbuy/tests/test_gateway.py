@@ -0,0 +1,309 @@
+import hashlib
+import unittest
+
+from mock import patch
+
+import ferbuy
+from ferbuy.gateway import CallbackVerifier, GatewayBuilder
+from .utils import FerbuyTestCase
+
+
+def callback(secret='dummy secret', env='test', **fields):
+    post_data = {
+        'reference': 'ORDER-1',
+        'transaction_id': '10001',
+        'status': '200',
+        'currency': 'EUR',
+        'amount': '1000',
+    }
+    post_data.update(fields)
+    signature = '&'.join([
+        env, post_data['reference'], post_data['transaction_id'],
+        post_data['status'], post_data['currency'], post_data['amount'],
+        secret])
+    post_data.setdefault(
+        'checksum', hashlib.sha1(signature.encode('utf-8')).hexdigest())
+    return post_data
+
+
+class VerifyCallbackTests(FerbuyTestCase):
+
+    def setUp(self):
+        super(VerifyCallbackTests, self).setUp()
+        ferbuy.env = 'test'
+        ferbuy.secret = 'dummy secret'
+
+    def test_valid(self):
+        self.assertTrue(ferbuy.Gateway.verify_callback(callback()))
+
+    def test_invalid(self):
+        post_data = callback(checksum='0' * 40)
+        self.assertFalse(ferbuy.Gateway.verify_callback(post_data))
+
+    def test_unicode_values(self):
+        post_data = dict((key, u'' + value)
+                         for key, value in callback().items())
+        self.assertTrue(ferbuy.Gateway.verify_callback(post_data))
+
+    def test_missing_key(self):
+        post_data = callback()
+        del post_data['status']
+        with self.assertRaises(KeyError):
+            ferbuy.Gateway.verify_callback(post_data)
+
+
+class RenderTests(FerbuyTestCase):
+
+    def setUp(self):
+        super(RenderTests, self).setUp()
+        ferbuy.env = 'test'
+        ferbuy.site_id = 1000
+        ferbuy.secret = 'dummy secret'
+        self.gateway = ferbuy.Gateway({
+            'reference': 'ORDER-1',
+            'currency': 'EUR',
+            'amount': 1000,
+            'first_name': 'John "Johnny"',
+            'last_name': '<Doe> & Sons',
+        })
+
+    def test_render_fields(self):
+        fields = self.gateway.render_fields()
+
+        self.assertTrue('<input type="hidden" name="amount" value="1000">'
+                        in fields)
+        self.assertTrue('value="John &quot;Johnny&quot;"' in fields)
+        self.assertTrue('value="&lt;Doe&gt; &amp; Sons"' in fields)
+        self.assertEqual(fields.count('<input'), len(self.gateway.data))
+
+    def test_render_form(self):
+        form = self.gateway.render_form()
+
+        self.assertTrue(isinstance(form, bytes))
+        self.assertTrue(form.startswith(
+            b'<form method="post" action="https://gateway.ferbuy.com/test/" '
+            b'id="ferbuy-gateway">'))
+        self.assertTrue(self.gateway.render_fields().encode('utf-8') in form)
+        self.assertTrue(b'.submit();</script>' in form)
+
+    def test_cached(self):
+        form = self.gateway.render_form()
+        self.assertTrue(self.gateway.render_form() is form)
+        self.assertTrue(self.gateway.render_fields() is
+                        self.gateway.render_fields())
+
+    def test_data_changed(self):
+        form = self.gateway.render_form()
+        self.gateway.data['amount'] = 2000
+
+        self.assertTrue(b'value="2000"' in self.gateway.render_form())
+        self.assertFalse(self.gateway.render_form() is form)
+
+    def test_unicode(self):
+        self.gateway.data['city'] = u'M\xfcnchen'
+        self.assertTrue(u'M\xfcnchen'.encode('utf-8') in
+                        self.gateway.render_form())
+
+
+def order(index):
+    return {
+        'reference': 'ORDER-{0}'.format(index),
+        'currency': 'EUR',
+        'amount': 1000 + index,
+        'first_name': 'John',
+        'last_name': 'Doe',
+    }
+
+
+class GatewayBuilderTests(FerbuyTestCase):
+
+    def setUp(self):
+        super(GatewayBuilderTests, self).setUp()
+        ferbuy.env = 'test'
+        ferbuy.site_id = 1000
+        ferbuy.secret = 'dummy secret'
+        self.builder = GatewayBuilder()
+
+    def test_same_as_gateway(self):
+        payload = self.builder.sign(order(1))
+        gateway = ferbuy.Gateway(order(1))
+
+        self.assertEqual(payload.data, gateway.data)
+        self.assertEqual(payload.checksum, gateway.data['checksum'])
+        self.assertEqual(payload.url, gateway.url)
+
+    def test_credentials_missing(self):
+        ferbuy.secret = None
+        with self.assertRaises(ValueError):
+            GatewayBuilder()
+
+        ferbuy.site_id = None
+        with self.assertRaises(ValueError):
+            GatewayBuilder(secret='dummy secret')
+
+    def test_settings(self):
+        builder = GatewayBuilder(site_id=2000, secret='other secret',
+                                 gateway_base='http://localhost', env='live')
+        ferbuy.env = 'live'
+        gateway = ferbuy.Gateway(order(1), 2000, 'other secret',
+                                 'http://localhost')
+
+        self.assertEqual(builder.sign(order(1)), (
+            gateway.data, gateway.data['checksum'], 'http://localhost/live/'))
+
+    def test_rows_not_modified(self):
+        rows = [order(1), order(2)]
+        list(self.builder.build(rows))
+        self.assertEqual(rows, [order(1), order(2)])
+
+    def test_build_columnar(self):
+        rows = [order(index) for index in range(3)]
+        table = dict((field, [row[field] for row in rows])
+                     for field in rows[0])
+
+        self.assertEqual(list(self.builder.build(table)),
+                         list(self.builder.build(rows)))
+
+    def test_build_iterator(self):
+        payloads = self.builder.build(order(index) for index in range(3))
+        self.assertEqual([p.data['reference'] for p in payloads],
+                         ['ORDER-0', 'ORDER-1', 'ORDER-2'])
+
+    def test_build_processes(self):
+        rows = [order(index) for index in range(20)]
+        payloads = list(self.builder.build(rows, processes=2, chunksize=3,
+                                           min_batch=0))
+
+        self.assertEqual(payloads, list(self.builder.build(rows)))
+
+    def test_build_min_batch(self):
+        rows = [order(index) for index in range(3)]
+        with patch('multiprocessing.Pool') as pool:
+            payloads = list(self.builder.build(rows, processes=2))
+
+        self.assertFalse(pool.called)
+        self.assertEqual(payloads, list(self.builder.build(rows)))
+
+    def test_missing_key(self):
+        row = order(1)
+        del row['amount']
+        with self.assertRaises(KeyError):
+            self.builder.sign(row)
+
+
+class CallbackVerifierTests(FerbuyTestCase):
+
+    def setUp(self):
+        super(CallbackVerifierTests, self).setUp()
+        self.verifier = CallbackVerifier(
+            secrets={1000: 'secret one', '2000': 'secret two'},
+            secret='default secret', env='test')
+
+    def test_per_site_secret(self):
+        self.assertTrue(self.verifier.verify(
+            callback('secret one', site_id='1000')))
+        self.assertTrue(self.verifier.verify(
+            callback('secret two'), site_id=2000))
+        self.assertFalse(self.verifier.verify(
+            callback('secret one', site_id='2000')))
+
+    def test_default_secret(self):
+        self.assertTrue(self.verifier.verify(callback('default secret')))
+        self.assertTrue(self.verifier.verify(
+            callback('default secret', site_id='3000')))
+
+    def test_module_settings(self):
+        ferbuy.env = 'test'
+        ferbuy.secret = 'dummy secret'
+        self.assertTrue(CallbackVerifier().verify(callback()))
+
+    def test_env(self):
+        verifier = CallbackVerifier(secret='dummy secret', env='live')
+        self.assertFalse(verifier.verify(callback()))
+        self.assertTrue(verifier.verify(callback(env='live')))
+
+    def test_unknown_site(self):
+        verifier = CallbackVerifier(secrets={1000: 'secret one'}, env='test')
+        with self.assertRaises(KeyError):
+            verifier.verify(callback('secret one', site_id='2000'))
+
+    def test_verify_many(self):
+        missing = callback('secret one', site_id='1000')
+        del missing['amount']
+        callbacks = [
+            callback('secret one', site_id='1000'),
+            callback('secret one', site_id='2000'),
+            missing,
+            callback('default secret'),
+        ]
+
+        self.assertEqual(self.verifier.verify_many(callbacks),
+                         [True, False, False, True])
+        self.assertEqual(self.verifier.verify_many(callbacks, reasons=True), [
+            None, CallbackVerifier.INVALID_CHECKSUM, 'missing amount', None])
+
+    def test_verify_many_unknown_site(self):
+        verifier = CallbackVerifier(secrets={1000: 'secret one'}, env='test')
+        self.assertEqual(
+            verifier.verify_many([callback(site_id='2000')], reasons=True),
+            [CallbackVerifier.UNKNOWN_SITE])
+
+    def test_reason_columns(self):
+        missing = callback('secret one', site_id='1000')
+        missing['amount'] = None
+        callbacks = [
+            callback('secret one', site_id='1000'),
+            callback('secret one', site_id='2000'),
+            missing,
+            callback('default secret', site_id='3000'),
+        ]
+        columns = dict((field, [c[field] for c in callbacks])
+                       for field in callbacks[0])
+
+        reasons = self.verifier.reason_columns(columns)
+
+        self.assertEqual(reasons, [
+            None, CallbackVerifier.INVALID_CHECKSUM, 'missing amount', None])
+        self.assertEqual(
+            reasons[:2], self.verifier.verify_many(callbacks[:2],
+                                                   reasons=True))
+
+    def test_reason_columns_same_as_reason(self):
+        verifier = CallbackVerifier({1000: 'secret one'}, 'default secret',
+                                    env='test')
+        rows = [callback('secret one', site_id='1000'),
+                callback('default secret', site_id=None),
+                callback('default secret', site_id='3000'),
+                callback('secret one', site_id='1000', reference=u'caf\xe9')]
+        rows += [dict(rows[0]) for _ in range(3)]
+        # A JSON number is signed like the text of the form post
+        rows[2]['amount'] = 1000
+        rows[4]['status'] = None
+        rows[5]['checksum'] = None
+        rows[6]['amount'] = '1002'
+        fields = ('site_id', 'checksum') + ferbuy.gateway.CALLBACK_FIELDS
+        columns = dict((field, [row[field] for row in rows])
+                       for field in fields)
+
+        expected = [verifier.reason(row) for row in rows]
+        self.assertEqual(verifier.reason_columns(columns), expected)
+        self.assertEqual(expected[4:], ['missing status', 'missing checksum',
+                                        verifier.INVALID_CHECKSUM])
+        self.assertEqual(expected[:4], [None] * 4)
+
+    def test_reason_columns_site_id(self):
+        columns = dict((field, [value])
+                       for field, value in callback('secret two').items())
+        self.assertEqual(self.verifier.reason_columns(columns), [
+            CallbackVerifier.INVALID_CHECKSUM])
+        self.assertEqual(
+            self.verifier.reason_columns(columns, site_id=2000), [None])
+
+        del columns['checksum']
+        self.assertEqual(self.verifier.reason_columns(columns),
+                         ['missing checksum'])
+        self.assertEqual(self.verifier.reason_columns({}), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from ferbuy import hooks
+from ferbuy.http_client import HTTPResponse
+from ferbuy.retry import RetryPolicy
+from .utils import FerbuyUnitTestCase
+
+OK_RESPONSE = '{"api":{"response":{"message":null,"code":200}}}'
+
+
+class RecordingHook(hooks.RequestHook):
+
+    def __init__(self):
+        self.events = []
+
+    def before_request(self, context):
+        self.events.append(('before_request', context.endpoint))
+
+    def after_response(self, context):
+        self.events.append(('after_response', context.status_code))
+        self.context = context
+
+    def on_error(self, context, error):
+        self.events.append(('on_error', error.__class__.__name__))
+        self.context = context
+
+    def on_retry(self, context, delay):
+        self.events.append(('on_retry', context.attempt))
+
+
+class RequestHookTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(RequestHookTests, self).setUp()
+
+        self.hook = RecordingHook()
+        self.http_client = Mock(ferbuy.http_client.HTTPClient)
+        self.requestor = ferbuy.api_requestor.APIRequestor(
+            site_id=1000, secret='dummy secret', client=self.http_client,
+            hooks=[self.hook])
+
+    def test_successful_request(self):
+        self.http_client.request = Mock(return_value=HTTPResponse(
+            OK_RESPONSE, 200, timings={'connect': 0.1, 'wait': 0.2}))
+
+        self.requestor.request('post', '/MarkOrderShipped', {'a': 'b'})
+
+        self.assertEqual(self.hook.events, [
+            ('before_request', '/MarkOrderShipped'),
+            ('after_response', 200)])
+        context = self.hook.context
+        self.assertEqual(context.method, 'post')
+        self.assertEqual(context.bytes_sent, len('a=b'))
+        self.assertEqual(context.bytes_received, len(OK_RESPONSE))
+        self.assertEqual(context.timings['connect'], 0.1)
+        self.assertEqual(context.timings['wait'], 0.2)
+        self.assertTrue(context.timings['parse'] >= 0)
+
+    def test_error_and_retry(self):
+        self.requestor.retry_policy = RetryPolicy(backoff=0)
+        self.http_client.request = Mock(return_value=('', 503))
+
+        with self.assertRaises(ferbuy.errors.APIError):
+            self.requestor.request('post', '/RefundTransaction', {})
+
+        self.assertEqual(self.hook.events, [
+            ('before_request', '/RefundTransaction'),
+            ('on_retry', 1),
+            ('on_retry', 2),
+            ('on_error', 'APIError')])
+        self.assertEqual(self.hook.context.status_code, 503)
+
+    def test_connection_error(self):
+        self.http_client.request = Mock(
+            side_effect=ferbuy.errors.APIConnectionError('boom'))
+
+        with self.assertRaises(ferbuy.errors.APIConnectionError):
+            self.requestor.request('post', '/dummy', {})
+
+        self.assertEqual(self.hook.events[-1],
+                         ('on_error', 'APIConnectionError'))
+
+    def test_failing_hook_ignored(self):
+        broken = Mock(hooks.RequestHook)
+        broken.before_request.side_effect = ValueError('broken hook')
+        self.requestor.hooks.insert(0, broken)
+        self.http_client.request = Mock(return_value=(OK_RESPONSE, 200))
+
+        result = self.requestor.request('post', '/dummy', {})
+
+        self.assertEqual(result.response.code, 200)
+        self.assertEqual(len(self.hook.events), 2)
+
+    def test_module_hooks(self):
+        hook = RecordingHook()
+        self.http_client.request = Mock(return_value=(OK_RESPONSE, 200))
+
+        with patch('ferbuy.request_hooks', [hook]):
+            self.requestor.request('post', '/dummy', {})
+
+        self.assertEqual(len(hook.events), 2)
+
+    def test_log_message_built_only_when_enabled(self):
+        self.http_client.request = Mock(return_value=(OK_RESPONSE, 200))
+
+        with patch.object(ferbuy.utils, 'logger') as logger:
+            logger.isEnabledFor.return_value = False
+            self.requestor.request('post', '/dummy', {})
+            self.assertFalse(logger.info.called)
+
+            logger.isEnabledFor.return_value = True
+            self.requestor.request('post', '/dummy', {})
+            self.assertTrue(logger.info.called)
+
+
+class AdapterTests(unittest.TestCase):
+
+    def context(self):
+        context = hooks.RequestContext('post', '/MarkOrderShipped')
+        context.status_code = 200
+        context.bytes_sent = 10
+        context.bytes_received = 20
+        context.timings = {'connect': 0.1}
+        return context
+
+    def test_prometheus(self):
+        with patch.dict('sys.modules', {'prometheus_client': Mock()}):
+            hook = hooks.PrometheusHook()
+            context = self.context()
+            hook.after_response(context)
+
+        hook.requests.labels.assert_any_call('/MarkOrderShipped', 200)
+        hook.duration.labels.assert_any_call('/MarkOrderShipped', 'connect')
+        hook.bytes.labels.assert_any_call('/MarkOrderShipped', 'received')
+
+    def test_prometheus_shared_metrics(self):
+        client = Mock()
+        with patch.dict('sys.modules', {'prometheus_client': client}):
+            client.Counter.side_effect = lambda *args, **kwargs: Mock()
+            client.Histogram.side_effect = lambda *args, **kwargs: Mock()
+            first = hooks.PrometheusHook()
+            second = hooks.PrometheusHook()
+            other_namespace = hooks.PrometheusHook(namespace='shop')
+            other_registry = hooks.PrometheusHook(registry=Mock())
+
+        self.assertTrue(second.requests is first.requests)
+        self.assertTrue(second.duration is first.duration)
+        self.assertFalse(other_namespace.requests is first.requests)
+        self.assertFalse(other_registry.requests is first.requests)
+        self.assertEqual(client.Histogram.call_count, 3)
+
+    def test_prometheus_missing(self):
+        with patch.dict('sys.modules', {'prometheus_client': None}):
+            with self.assertRaises(ImportError):
+                hooks.PrometheusHook()
+
+    def test_opentelemetry(self):
+        tracer = Mock()
+        hook = hooks.OpenTelemetryHook(tracer)
+        context = self.context()
+
+        hook.before_request(context)
+        hook.on_retry(context, 0.5)
+        hook.after_response(context)
+
+        span = tracer.start_span.return_value
+        span.set_attribute.assert_any_call('http.status_code', 200)
+        span.set_attribute.assert_any_call('ferbuy.time.connect', 0.1)
+        self.assertTrue(span.add_event.called)
+        span.end.assert_called_once_with()
+
+    def test_opentelemetry_error(self):
+        tracer = Mock()
+        hook = hooks.OpenTelemetryHook(tracer)
+        context = self.context()
+        error = ferbuy.errors.APIError('boom')
+
+        hook.before_request(context)
+        hook.on_error(context, error)
+
+        span = tracer.start_span.return_value
+        span.record_exception.assert_called_once_with(error)
+        span.end.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,8 @@
+import datetime
+import os
 import sys
 import unittest
-from mock import Mock
+from mock import Mock, patch
 
 import ferbuy
 from .utils import FerbuyUnitTestCase
@@ -83,21 +85,130 @@ class RequestsClientTests(FerbuyUnitTestCase, ClientTestBase):
 
     request_client = ferbuy.http_client.RequestsClient
 
-    def mock_response(self, mock, body, code):
+    def mock_response(self, mock, body, code, headers=None, chunks=None):
         result = Mock()
-        result.content = body
+        result.iter_content = Mock(
+            side_effect=lambda size: iter(chunks or [body]))
         result.status_code = code
-        mock.request = Mock(return_value=result)
+        result.headers = headers or {}
+        result.elapsed = datetime.timedelta(0)
+        mock.Session.return_value.request = Mock(return_value=result)
+        return result
 
     def mock_error(self, mock):
         mock.exceptions.RequestException = Exception
-        mock.request.side_effect = mock.exceptions.RequestException()
+        mock.Session.return_value.request.side_effect = (
+            mock.exceptions.RequestException())
 
     def check_call(self, mock, method, url, post_data, headers):
-        mock.request.assert_called_with(method, url,
-                                        headers=headers,
-                                        data=post_data,
-                                        timeout=80)
+        mock.Session.return_value.request.assert_called_with(
+            method, url, headers=headers, data=post_data, timeout=(10, 80),
+            stream=True)
+
+    def test_session_reused(self):
+        self.mock_response(self.request_mock, '{"foo": "bar"}', 200)
+
+        client = self.request_client()
+        client.request('post', self.valid_url(), {}, '')
+        client.request('post', self.valid_url(), {}, '')
+
+        self.assertEqual(self.request_mock.Session.call_count, 1)
+        self.assertEqual(
+            self.request_mock.Session.return_value.request.call_count, 2)
+
+    def test_session_rebuilt_after_fork(self):
+        self.mock_response(self.request_mock, '{"foo": "bar"}', 200)
+        client = self.request_client()
+        client.request('post', self.valid_url(), {}, '')
+
+        with patch('os.getpid', return_value=os.getpid() + 1):
+            client.request('post', self.valid_url(), {}, '')
+            client.request('post', self.valid_url(), {}, '')
+
+        self.assertEqual(self.request_mock.Session.call_count, 2)
+
+    def test_after_fork_hook(self):
+        client = self.request_client()
+        client.session
+        ferbuy.http_client._after_fork()
+        self.assertTrue(client._session is None)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "requires os.fork")
+    def test_fork(self):
+        self.request_mock.Session.side_effect = lambda: Mock()
+        client = self.request_client()
+        session = client.session
+
+        pid = os.fork()
+        if pid == 0:
+            os._exit(0 if client.session is not session else 1)
+        _, status = os.waitpid(pid, 0)
+
+        self.assertEqual(status, 0)
+        self.assertTrue(client.session is session)
+
+    def test_timings(self):
+        self.mock_response(self.request_mock, '{"foo": "bar"}', 200)
+
+        response = self.make_request('post', self.valid_url(), {}, '')
+
+        self.assertEqual(sorted(response.timings),
+                         ['connect', 'transfer', 'wait'])
+
+    def mock_error_classes(self, mock):
+        mock.exceptions.HTTPError = type('HTTPError', (Exception,), {})
+        mock.exceptions.RequestException = type(
+            'RequestException', (Exception,), {})
+
+    def test_chunked_body(self):
+        self.mock_response(self.request_mock, None, 200,
+                           chunks=[b'{"foo": ', b'"bar"}'])
+
+        body, _ = self.make_request('post', self.valid_url(), {}, '')
+
+        self.assertEqual(body, b'{"foo": "bar"}')
+
+    def test_body_too_large(self):
+        result = self.mock_response(self.request_mock, None, 200,
+                                    chunks=[b'x' * 8, b'x' * 8, b'x' * 8])
+        self.mock_error_classes(self.request_mock)
+        client = self.request_client(max_body_size=10)
+
+        with self.assertRaises(ferbuy.errors.ResponseTooLargeError) as cm:
+            client.request('post', self.valid_url(), {}, '')
+
+        self.assertEqual(cm.exception.http_status, 200)
+        self.assertEqual(cm.exception.http_body, 'x' * 8)
+        result.close.assert_called_with()
+
+    def test_content_length_too_large(self):
+        result = self.mock_response(self.request_mock, '{}', 200,
+                                    headers={'Content-Length': '11'})
+        self.mock_error_classes(self.request_mock)
+        client = self.request_client(max_body_size=10)
+
+        with self.assertRaises(ferbuy.errors.ResponseTooLargeError):
+            client.request('post', self.valid_url(), {}, '')
+
+        self.assertFalse(result.iter_content.called)
+
+    def test_module_body_limit(self):
+        self.mock_response(self.request_mock, None, 200, chunks=[b'x' * 11])
+        self.mock_error_classes(self.request_mock)
+
+        with patch('ferbuy.max_body_size', 10):
+            with self.assertRaises(ferbuy.errors.ResponseTooLargeError):
+                self.make_request('post', self.valid_url(), {}, '')
+
+    def test_pool_configuration(self):
+        client = self.request_client(connect_timeout=3, read_timeout=30,
+                                     pool_maxsize=25, keep_alive=False)
+        session = client.session
+
+        self.request_mock.adapters.HTTPAdapter.assert_called_with(
+            pool_connections=10, pool_maxsize=25)
+        session.headers.__setitem__.assert_called_with('Connection', 'close')
+        self.assertEqual(client.timeout, (3, 30))
 
 
 class UrllibClientTests(FerbuyUnitTestCase, ClientTestBase):
@@ -107,15 +218,21 @@ class UrllibClientTests(FerbuyUnitTestCase, ClientTestBase):
     else:
         request_client = ferbuy.http_client.Urllib2Client
 
-    def mock_response(self, mock, body, code):
-        response = Mock
-        response.read = Mock(return_value=body)
-        response.code = code
+    def mock_response(self, mock, body, code, headers=None):
+        self.responses = []
+
+        def urlopen(request):
+            response = Mock()
+            response.read = Mock(side_effect=[body, body[:0]])
+            response.code = code
+            response.info.return_value = headers or {}
+            self.responses.append(response)
+            return response
 
         self.request_object = Mock()
         mock.Request = Mock(return_value=self.request_object)
 
-        mock.urlopen = Mock(return_value=response)
+        mock.urlopen = Mock(side_effect=urlopen)
 
     def mock_error(self, mock):
         mock.URLError = Exception
@@ -125,6 +242,55 @@ class UrllibClientTests(FerbuyUnitTestCase, ClientTestBase):
         mock.Request.assert_called_with(url, post_data, headers)
         mock.urlopen.assert_called_with(self.request_object)
 
+    def mock_error_classes(self, mock):
+        mock.HTTPError = type('HTTPError', (Exception,), {})
+        mock.URLError = type('URLError', (Exception,), {})
+
+    def test_body_too_large(self):
+        self.mock_response(self.request_mock, b'x' * 11, 200)
+        self.mock_error_classes(self.request_mock)
+        client = self.request_client(max_body_size=10)
+
+        with self.assertRaises(ferbuy.errors.ResponseTooLargeError) as cm:
+            client.request('get', self.valid_url(), {}, None)
+
+        self.assertEqual(cm.exception.http_body_size, 11)
+        self.responses[0].close.assert_called_with()
+
+    def test_content_length_too_large(self):
+        self.mock_response(self.request_mock, b'{}', 200,
+                           headers={'Content-Length': '11'})
+        self.mock_error_classes(self.request_mock)
+        client = self.request_client(max_body_size=10)
+
+        with self.assertRaises(ferbuy.errors.ResponseTooLargeError):
+            client.request('get', self.valid_url(), {}, None)
+
+        self.assertFalse(self.responses[0].read.called)
+
+
+class ResponseBodyTests(unittest.TestCase):
+
+    def read(self, chunks, limit=None, length=None):
+        chunks = iter(chunks)
+        return ferbuy.http_client.read_body(
+            lambda size: next(chunks, b''), 200, limit, length)
+
+    def test_read(self):
+        self.assertEqual(self.read([b'ab', b'cd']), b'abcd')
+        self.assertEqual(self.read([]), b'')
+        self.assertEqual(self.read([b'abcd'], limit=4), b'abcd')
+
+    def test_limit(self):
+        with self.assertRaises(ferbuy.errors.ResponseTooLargeError) as cm:
+            self.read([b'ab', b'cd', b'ef'], limit=5)
+        self.assertEqual(cm.exception.http_body, 'ab')
+
+    def test_content_length(self):
+        with self.assertRaises(ferbuy.errors.ResponseTooLargeError):
+            self.read([], limit=5, length='6')
+        self.assertEqual(self.read([b'ab'], limit=5, length='bogus'), b'ab')
+
 
 if __name__ == '__main__':
     unittest.main()
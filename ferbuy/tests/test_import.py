@@ -0,0 +1,96 @@
+import os
+import subprocess
+import sys
+import unittest
+
+import ferbuy
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(ferbuy.__file__)))
+
+# Microseconds `import ferbuy` may take, including the modules it imports.
+# Loading the HTTP stack eagerly took about 100ms.
+IMPORT_BUDGET = 30000
+
+HEAVY_MODULES = ('requests', 'urllib3', 'multiprocessing',
+                 'concurrent.futures')
+
+
+def run(code, *options):
+    command = [sys.executable] + list(options) + ['-c', code]
+    process = subprocess.Popen(command, cwd=ROOT, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    return out.decode('utf-8'), err.decode('utf-8')
+
+
+def cumulative_import_time(stderr, module):
+    """Return the cumulative microseconds of `module` in -X importtime."""
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() == module and name.startswith(' ' + module):
+            return int(cumulative)
+    return None
+
+
+@unittest.skipIf(sys.version_info < (3, 7),
+                 "lazy loading requires module __getattr__ (Python 3.7+)")
+class ImportTests(unittest.TestCase):
+
+    def loaded(self, code):
+        out, _ = run(code + '; import sys; print(" ".join(sys.modules))')
+        modules = out.split()
+        return [name for name in HEAVY_MODULES if name in modules]
+
+    def test_import_budget(self):
+        # Best of three, the first run may pay for compiling bytecode
+        timings = []
+        for _ in range(3):
+            _, err = run('import ferbuy', '-X', 'importtime')
+            timings.append(cumulative_import_time(err, 'ferbuy'))
+
+        self.assertTrue(min(timings) < IMPORT_BUDGET,
+                        "import ferbuy took {0}us, budget is {1}us".format(
+                            min(timings), IMPORT_BUDGET))
+
+    def test_import_is_lazy(self):
+        self.assertEqual(self.loaded('import ferbuy'), [])
+
+    def test_callback_verification_without_http_stack(self):
+        loaded = self.loaded(
+            'import ferbuy; ferbuy.Gateway.verify_callback; '
+            'ferbuy.CallbackVerifier')
+        self.assertEqual(loaded, [])
+
+    def test_http_stack_loaded_by_client(self):
+        out, _ = run('import ferbuy; ferbuy.http_client.new_client(); '
+                     'import sys; print(sys.modules["ferbuy"].http_client.'
+                     'requests is not None, "requests" in sys.modules)')
+        # Either requests was loaded or it is not installed
+        self.assertTrue(out.split() in (['True', 'True'], ['False', 'False']))
+
+    def test_lazy_attributes(self):
+        out, _ = run('import ferbuy; print(ferbuy.Order.__name__, '
+                     'ferbuy.errors.APIError.__name__, "Gateway" in '
+                     'dir(ferbuy))')
+        self.assertEqual(out.split(), ['Order', 'APIError', 'True'])
+
+    def test_missing_attribute(self):
+        with self.assertRaises(AttributeError):
+            ferbuy.missing_attribute
+
+
+class PoolImportTests(unittest.TestCase):
+
+    def test_pools_imported_when_used(self):
+        # Also on Python < 3.7, where the resources are imported eagerly
+        out, _ = run('import ferbuy, sys; ferbuy.Order; ferbuy.BatchSigner; '
+                     'print(" ".join(sys.modules))')
+        modules = out.split()
+        self.assertFalse('concurrent.futures' in modules)
+        self.assertFalse('multiprocessing' in modules)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from ferbuy import outbox
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.retry import RetryPolicy
+from .utils import FerbuyUnitTestCase
+
+OK_RESPONSE = '{"api":{"response":{"message":"ok","code":200}}}'
+
+
+class OutboxTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(OutboxTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'outbox.db')
+
+        self.http_client = Mock(ferbuy.http_client.HTTPClient)
+        self.http_client.request = Mock(return_value=(OK_RESPONSE, 200))
+        APIRequestor.register(APIRequestor(
+            site_id=7000, secret='outbox secret', client=self.http_client))
+
+        self.outbox = self.open()
+
+    def tearDown(self):
+        super(OutboxTests, self).tearDown()
+        self.outbox.close()
+        shutil.rmtree(self.directory)
+
+    def open(self):
+        return outbox.Outbox(self.path, secrets={7000: 'outbox secret'},
+                             max_in_flight=2, max_attempts=2,
+                             poll_interval=0.01)
+
+    def test_idempotency_key(self):
+        first = self.outbox.refund(10001, 100, 'EUR', site_id=7000)
+        self.assertEqual(self.outbox.refund(10001, 100, 'EUR', site_id=7000),
+                         first)
+        self.assertNotEqual(
+            self.outbox.refund(10001, 200, 'EUR', site_id=7000), first)
+        self.assertNotEqual(
+            self.outbox.refund(10002, 100, 'EUR', site_id=7000), first)
+        self.assertEqual(len(self.outbox.entries()), 3)
+
+    def test_drain(self):
+        shipped = self.outbox.shipped(10001, 'DHL', 1234, site_id=7000)
+        delivered = self.outbox.delivered(
+            10001, datetime.datetime(2015, 1, 1), site_id=7000)
+
+        self.assertEqual(self.outbox.drain(), 2)
+        self.assertEqual(self.outbox.drain(), 0)
+
+        entry = self.outbox.get(shipped)
+        self.assertEqual(entry['state'], outbox.DONE)
+        self.assertEqual(entry['attempts'], 1)
+        self.assertEqual(
+            ferbuy.utils.json.loads(entry['result'])['response']['code'],
+            200)
+        self.assertEqual(self.outbox.get(delivered)['state'], outbox.DONE)
+
+        urls = sorted(c[0][1] for c in self.http_client.request.call_args_list)
+        self.assertTrue(urls[0].endswith('/ConfirmDelivery'))
+        self.assertTrue(urls[1].endswith('/MarkOrderShipped'))
+
+    def test_drain_limit(self):
+        for transaction_id in range(5):
+            self.outbox.shipped(transaction_id, 'DHL', 1234, site_id=7000)
+
+        self.assertEqual(self.outbox.drain(limit=3), 3)
+        self.assertEqual(len(self.outbox.entries(outbox.PENDING)), 2)
+
+    def test_retry_idempotent(self):
+        self.http_client.request.side_effect = \
+            ferbuy.errors.APIConnectionError('boom')
+        key = self.outbox.shipped(10001, 'DHL', 1234, site_id=7000)
+
+        self.outbox.drain(limit=1)
+        entry = self.outbox.get(key)
+        self.assertEqual(entry['state'], outbox.PENDING)
+        self.assertTrue(entry['next_attempt'] > entry['updated'])
+
+        with patch('time.time', return_value=entry['next_attempt']):
+            self.outbox.drain(limit=1)
+        entry = self.outbox.get(key)
+        self.assertEqual(entry['state'], outbox.FAILED)
+        self.assertEqual(entry['attempts'], 2)
+        self.assertTrue('boom' in entry['error'])
+
+    def test_backoff(self):
+        self.http_client.request.side_effect = \
+            ferbuy.errors.APIConnectionError('boom')
+        key = self.outbox.shipped(10001, 'DHL', 1234, site_id=7000)
+        self.outbox.retry_policy = RetryPolicy(backoff=0, jitter=False)
+
+        # Due again at once, but sent only once per drain
+        self.assertEqual(self.outbox.drain(), 1)
+        self.assertEqual(self.http_client.request.call_count, 1)
+        self.assertEqual(self.outbox.get(key)['state'], outbox.PENDING)
+
+        self.outbox.retry_policy = RetryPolicy(backoff=60, jitter=False)
+        self.outbox.max_attempts = 5
+        self.assertEqual(self.outbox.drain(), 1)
+        entry = self.outbox.get(key)
+        self.assertEqual(entry['state'], outbox.PENDING)
+        self.assertEqual(entry['attempts'], 2)
+
+        # Waiting for the next attempt
+        self.assertEqual(self.outbox.drain(), 0)
+        self.assertEqual(self.http_client.request.call_count, 2)
+
+    def test_refund_not_resent(self):
+        self.http_client.request.side_effect = \
+            ferbuy.errors.APIConnectionError('boom')
+        key = self.outbox.refund(10001, 100, 'EUR', site_id=7000)
+        self.outbox.drain()
+
+        self.assertEqual(self.outbox.get(key)['state'], outbox.PARKED)
+
+        self.http_client.request.side_effect = None
+        self.assertTrue(self.outbox.requeue(key))
+        self.outbox.drain()
+        self.assertEqual(self.outbox.get(key)['state'], outbox.DONE)
+
+    def test_refund_unprocessed(self):
+        self.http_client.request.return_value = ('', 503)
+        key = self.outbox.refund(10001, 100, 'EUR', site_id=7000)
+        self.outbox.drain(limit=1)
+
+        self.assertEqual(self.outbox.get(key)['state'], outbox.PENDING)
+
+    def test_rejected(self):
+        self.http_client.request.return_value = ('', 400)
+        key = self.outbox.shipped(10001, 'DHL', 1234, site_id=7000)
+        self.outbox.drain()
+
+        self.assertEqual(self.outbox.get(key)['state'], outbox.FAILED)
+
+    def test_recover(self):
+        shipped = self.outbox.shipped(10001, 'DHL', 1234, site_id=7000)
+        refund = self.outbox.refund(10001, 100, 'EUR', site_id=7000)
+        # Crash after the entries were claimed
+        self.outbox._claim(10)
+        self.outbox.close()
+
+        # The lease has not expired, the entries may still be sent
+        self.outbox = self.open()
+        self.assertEqual(self.outbox.get(shipped)['state'], outbox.IN_FLIGHT)
+
+        with patch('time.time', return_value=time.time() + 301):
+            self.outbox.close()
+            self.outbox = self.open()
+
+        self.assertEqual(self.outbox.get(shipped)['state'], outbox.PENDING)
+        self.assertEqual(self.outbox.get(refund)['state'], outbox.PARKED)
+
+    def test_shared_database(self):
+        for transaction_id in range(10001, 10005):
+            self.outbox.shipped(transaction_id, 'DHL', 1234, site_id=7000)
+        other = self.open()
+        self.addCleanup(other.close)
+
+        claimed = self.outbox._claim(3)
+        self.assertEqual(len(other._claim(10)), 1)
+        self.assertEqual(other._claim(10), [])
+        # Claimed by a process which is still running
+        other.recover()
+        self.assertEqual(len(self.outbox.entries(outbox.IN_FLIGHT)), 4)
+
+        self.outbox._record(claimed[0], outbox.DONE)
+        self.assertEqual(self.outbox.get(claimed[0]['key'])['lease'], None)
+
+    def test_background_drainer(self):
+        self.outbox.start()
+        key = self.outbox.shipped(10001, 'DHL', 1234, site_id=7000)
+
+        deadline = time.time() + 5
+        while (self.outbox.get(key)['state'] != outbox.DONE and
+                time.time() < deadline):
+            time.sleep(0.01)
+        self.outbox.stop()
+
+        self.assertEqual(self.outbox.get(key)['state'], outbox.DONE)
+
+    def test_unknown_operation(self):
+        with self.assertRaises(ValueError):
+            self.outbox.put('cancel', 10001, '')
+
+
+if __name__ == '__main__':
+    unittest.main()
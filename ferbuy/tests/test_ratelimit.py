@@ -0,0 +1,117 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from ferbuy.ratelimit import FileBackend, RateLimiter
+from .utils import FerbuyUnitTestCase
+
+
+class Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimiterTests(unittest.TestCase):
+
+    def limiter(self, rate, burst=None, backend=None):
+        self.clock = Clock()
+        return RateLimiter(rate, burst, backend, clock=self.clock,
+                           sleep=Mock())
+
+    def test_burst(self):
+        limiter = self.limiter(10, burst=3)
+
+        self.assertEqual([limiter.acquire() for _ in range(3)], [0, 0, 0])
+        self.assertFalse(limiter.sleep.called)
+        self.assertAlmostEqual(limiter.wait_time, 0.1)
+
+    def test_paces_requests(self):
+        limiter = self.limiter(10, burst=1)
+
+        waits = [limiter.reserve() for _ in range(4)]
+
+        for wait, expected in zip(waits, [0, 0.1, 0.2, 0.3]):
+            self.assertAlmostEqual(wait, expected)
+        self.assertEqual(limiter.backlog, 3)
+
+        self.clock.now += 0.3
+        self.assertEqual(limiter.backlog, 0)
+        self.assertAlmostEqual(limiter.wait_time, 0.1)
+
+    def test_refill_capped_at_burst(self):
+        limiter = self.limiter(10, burst=2)
+        limiter.reserve()
+        self.clock.now += 60
+
+        waits = [limiter.reserve() for _ in range(3)]
+
+        self.assertEqual(waits[:2], [0, 0])
+        self.assertAlmostEqual(waits[2], 0.1)
+
+    def test_threads(self):
+        limiter = RateLimiter(1000, burst=1000)
+
+        threads = [threading.Thread(target=limiter.acquire)
+                   for _ in range(50)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertTrue(945 <= limiter.backend.tokens(
+            limiter.rate, limiter.burst, limiter.clock()) <= 1000)
+
+    def test_file_backend_shared(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'bucket')
+
+        first = self.limiter(10, burst=2, backend=FileBackend(path))
+        second = RateLimiter(10, burst=2, backend=FileBackend(path),
+                             clock=self.clock)
+
+        self.assertEqual(first.reserve(), 0)
+        self.assertEqual(second.reserve(), 0)
+        self.assertAlmostEqual(first.reserve(), 0.1)
+        self.assertEqual(second.backlog, 1)
+
+
+class RequestorRateLimitTests(FerbuyUnitTestCase):
+
+    def test_acquire_per_request(self):
+        http_client = Mock(ferbuy.http_client.HTTPClient)
+        http_client.request = Mock(return_value=('{"api": {}}', 200))
+        limiter = Mock(RateLimiter)
+        requestor = ferbuy.api_requestor.APIRequestor(
+            site_id=1000, secret='dummy secret', client=http_client,
+            rate_limiter=limiter)
+
+        requestor.request('post', '/dummy', {})
+        requestor.request('post', '/dummy', {})
+
+        self.assertEqual(limiter.acquire.call_count, 2)
+
+    def test_module_limiter(self):
+        http_client = Mock(ferbuy.http_client.HTTPClient)
+        http_client.request = Mock(return_value=('{"api": {}}', 200))
+        requestor = ferbuy.api_requestor.APIRequestor(
+            site_id=1000, secret='dummy secret', client=http_client)
+        limiter = Mock(RateLimiter)
+
+        with patch('ferbuy.rate_limiter', limiter):
+            requestor.request('post', '/dummy', {})
+
+        self.assertEqual(limiter.acquire.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
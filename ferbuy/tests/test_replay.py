@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from mock import Mock
+
+import ferbuy
+from ferbuy import replay
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.resources import Resource
+from .utils import FerbuyUnitTestCase
+
+URL = 'https://gateway.ferbuy.com/api/MarkOrderShipped'
+
+
+def ok_response(message):
+    return ('{{"api":{{"response":{{"message":"{0}","code":200}}}}}}'.format(
+        message), 200)
+
+
+class NormalizeTests(unittest.TestCase):
+
+    def test_checksum_ignored(self):
+        self.assertEqual(
+            replay.normalize(URL, 'b=2&a=1&checksum=abc'),
+            ('/api/MarkOrderShipped', 'a=1&b=2'))
+
+    def test_query_string(self):
+        self.assertEqual(
+            replay.normalize(URL + '?a=1&output_type=json', None),
+            ('/api/MarkOrderShipped', 'a=1&output_type=json'))
+
+    def test_bytes(self):
+        self.assertEqual(replay.normalize(URL, b'a=1')[1], 'a=1')
+
+
+class ReplayTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(ReplayTests, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'calls.jsonl')
+
+        self.http_client = Mock(ferbuy.http_client.HTTPClient)
+        self.http_client.request = Mock(side_effect=[
+            ok_response('first'), ok_response('second'),
+            ok_response('other')])
+        self.recorder = replay.RecordingClient(self.path, self.http_client)
+
+    def tearDown(self):
+        super(ReplayTests, self).tearDown()
+        self.recorder.close()
+        shutil.rmtree(self.directory)
+
+    def requestor(self, client, secret='dummy secret'):
+        return APIRequestor(site_id=1000, secret=secret, client=client)
+
+    def shipped(self, requestor, transaction_id=10001):
+        post_data = Resource._post_data(requestor, transaction_id, 'DHL:1234')
+        return requestor.request('post', '/MarkOrderShipped', post_data)
+
+    def record(self):
+        requestor = self.requestor(self.recorder)
+        self.shipped(requestor)
+        self.shipped(requestor)
+        self.shipped(requestor, 10002)
+        self.recorder.close()
+
+    def test_record(self):
+        self.record()
+
+        with open(self.path) as lines:
+            records = [ferbuy.utils.json.loads(line) for line in lines]
+        self.assertEqual(len(records), 3)
+        self.assertEqual(records[0]['endpoint'], '/api/MarkOrderShipped')
+        self.assertEqual(records[0]['status'], 200)
+        self.assertFalse('checksum' in records[0]['data'])
+        self.assertTrue('transaction_id=10001' in records[0]['data'])
+
+    def test_replay(self):
+        self.record()
+        client = replay.ReplayClient(self.path, speed=0)
+        # Matched without the checksum, signed with another secret
+        requestor = self.requestor(client, secret='other secret')
+
+        self.assertEqual(len(client), 3)
+        messages = [self.shipped(requestor).response.message
+                    for _ in range(3)]
+        self.assertEqual(messages, ['first', 'second', 'first'])
+        self.assertEqual(
+            self.shipped(requestor, 10002).response.message, 'other')
+
+    def test_unknown_request(self):
+        self.record()
+        requestor = self.requestor(replay.ReplayClient(self.path, speed=0))
+
+        with self.assertRaises(ferbuy.errors.APIConnectionError):
+            self.shipped(requestor, 10003)
+
+    def test_match_endpoint(self):
+        self.record()
+        requestor = self.requestor(replay.ReplayClient(
+            self.path, speed=0, match='endpoint', seed=1))
+
+        result = self.shipped(requestor, 10003)
+        self.assertTrue(result.response.message in
+                        ('first', 'second', 'other'))
+
+    def test_speed(self):
+        self.record()
+        sleep = Mock()
+        client = replay.ReplayClient(self.path, speed=10, sleep=sleep)
+        with open(self.path) as lines:
+            elapsed = ferbuy.utils.json.loads(next(lines))['elapsed']
+
+        self.shipped(self.requestor(client))
+
+        if elapsed:
+            sleep.assert_called_with(elapsed / 10)
+        else:
+            self.assertFalse(sleep.called)
+
+    def test_connection_error(self):
+        self.http_client.request.side_effect = \
+            ferbuy.errors.APIConnectionError('boom')
+        with self.assertRaises(ferbuy.errors.APIConnectionError):
+            self.shipped(self.requestor(self.recorder))
+        self.recorder.close()
+
+        requestor = self.requestor(replay.ReplayClient(self.path, speed=0))
+        with self.assertRaises(ferbuy.errors.APIConnectionError) as cm:
+            self.shipped(requestor)
+        self.assertEqual(str(cm.exception), 'boom')
+
+    def test_unknown_match(self):
+        with self.assertRaises(ValueError):
+            replay.ReplayClient(self.path, match='any')
+
+
+if __name__ == '__main__':
+    unittest.main()
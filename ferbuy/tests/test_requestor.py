@@ -1,6 +1,7 @@
+import hashlib
 import unittest
 
-from mock import Mock
+from mock import Mock, patch
 
 import ferbuy
 from .utils import FerbuyUnitTestCase
@@ -43,6 +44,83 @@ class MatchHeaders(object):
         return True
 
 
+class FerbuyObjectTests(unittest.TestCase):
+
+    def test_attribute_access(self):
+        obj = ferbuy.api_requestor.FerbuyObject(
+            {'response': {'code': 200, 'lines': [{'id': 1}, 2]}})
+
+        self.assertEqual(obj.response.code, 200)
+        self.assertEqual(obj['response']['code'], 200)
+        self.assertEqual(obj.response.lines[0].id, 1)
+        self.assertEqual(obj.response.lines[1], 2)
+        self.assertEqual(obj.get('response').code, 200)
+        self.assertEqual(obj.get('missing', 'x'), 'x')
+
+        with self.assertRaises(AttributeError):
+            obj.missing
+
+    def test_lazy_wrapping(self):
+        FerbuyObject = ferbuy.api_requestor.FerbuyObject
+        raw = {'response': {'code': 200}}
+        obj = FerbuyObject(raw)
+
+        self.assertFalse(
+            isinstance(dict.__getitem__(obj, 'response'), FerbuyObject))
+
+        response = obj.response
+
+        self.assertTrue(isinstance(response, FerbuyObject))
+        self.assertTrue(dict.__getitem__(obj, 'response') is response)
+        self.assertTrue(obj.response is response)
+        self.assertFalse(hasattr(obj, '__dict__'))
+
+    def test_accessors_wrap(self):
+        FerbuyObject = ferbuy.api_requestor.FerbuyObject
+
+        def obj():
+            return FerbuyObject({'response': {'code': 200}})
+
+        accessors = [
+            lambda o: o.copy()['response'],
+            lambda o: o.pop('response'),
+            lambda o: o.popitem()[1],
+            lambda o: o.setdefault('response'),
+            lambda o: list(o.values())[0],
+            lambda o: list(o.items())[0][1],
+        ]
+        if hasattr(dict, 'iteritems'):
+            accessors += [
+                lambda o: next(o.iteritems())[1],
+                lambda o: next(o.itervalues()),
+                lambda o: list(o.viewitems())[0][1],
+                lambda o: list(o.viewvalues())[0],
+            ]
+        for accessor in accessors:
+            self.assertEqual(accessor(obj()).code, 200)
+
+        self.assertEqual(obj().pop('missing', None), None)
+        with self.assertRaises(KeyError):
+            obj().pop('missing')
+
+    def test_lists_copied(self):
+        FerbuyObject = ferbuy.api_requestor.FerbuyObject
+        lines = [{'code': 1}, 2]
+        obj = FerbuyObject({'lines': lines})
+
+        self.assertEqual(obj.lines[0].code, 1)
+        self.assertTrue(obj.lines is obj.lines)
+        self.assertFalse(isinstance(lines[0], FerbuyObject))
+
+    def test_setattr(self):
+        obj = ferbuy.api_requestor.FerbuyObject()
+        obj.request = {'command': 'EUR100'}
+
+        self.assertEqual(obj['request']['command'], 'EUR100')
+        self.assertEqual(obj.request.command, 'EUR100')
+        self.assertEqual(obj, {'request': {'command': 'EUR100'}})
+
+
 class APIRequestorTests(FerbuyUnitTestCase):
 
     def setUp(self):
@@ -81,10 +159,56 @@ class APIRequestorTests(FerbuyUnitTestCase):
         self.requestor.client.request.assert_called_with(
             method, abs_url, headers, post_data)
 
-    def test_singleton(self):
-        a = ferbuy.api_requestor.APIRequestor()
-        b = ferbuy.api_requestor.APIRequestor()
-        self.assertEqual(a, b)
+    def test_for_site(self):
+        APIRequestor = ferbuy.api_requestor.APIRequestor
+
+        a = APIRequestor.for_site(5000, 'dummy secret')
+        b = APIRequestor.for_site(5000, 'dummy secret')
+        c = APIRequestor.for_site(6000, 'other secret')
+
+        self.assertTrue(a is b)
+        self.assertFalse(a is c)
+        self.assertEqual(c.site_id, 6000)
+        self.assertEqual(c.secret, 'other secret')
+        self.assertTrue(a.client is c.client)
+
+    def test_for_site_defaults(self):
+        ferbuy.site_id = 3000
+        ferbuy.secret = 'module secret'
+
+        requestor = ferbuy.api_requestor.APIRequestor.for_site()
+
+        self.assertEqual(requestor.site_id, 3000)
+        self.assertEqual(requestor.secret, 'module secret')
+        self.assertEqual(requestor.api_base, ferbuy.api_base)
+
+    def test_for_site_secret_changed(self):
+        APIRequestor = ferbuy.api_requestor.APIRequestor
+
+        a = APIRequestor.for_site(4000, 'old secret')
+        b = APIRequestor.for_site(4000, 'new secret')
+
+        self.assertEqual(b.secret, 'new secret')
+        self.assertTrue(b is APIRequestor.for_site(4000, 'new secret'))
+        self.assertTrue(a.client is b.client)
+
+    def test_register(self):
+        APIRequestor = ferbuy.api_requestor.APIRequestor
+        APIRequestor.register(self.requestor)
+
+        self.assertTrue(
+            APIRequestor.for_site(1000, 'dummy secret') is self.requestor)
+
+    def test_register_secret_omitted(self):
+        APIRequestor = ferbuy.api_requestor.APIRequestor
+        ferbuy.secret = 'module secret'
+        requestor = APIRequestor(site_id=2000, secret='tenant secret')
+        APIRequestor.register(requestor)
+
+        self.assertTrue(APIRequestor.for_site(2000) is requestor)
+        self.assertEqual(requestor.secret, 'tenant secret')
+        self.assertFalse(
+            APIRequestor.for_site(2000, 'other secret') is requestor)
 
     def test_site_id_missing(self):
         self.mock_response(
@@ -95,6 +219,17 @@ class APIRequestorTests(FerbuyUnitTestCase):
         with self.assertRaises(ferbuy.errors.APIError):
             self.requestor.request('post', self.valid_path, {})
 
+    def test_sign(self):
+        expected = hashlib.sha1(
+            b'1000&10001&EUR100&json&dummy secret').hexdigest()
+        self.assertEqual(self.requestor.sign(10001, 'EUR100', 'json'),
+                         expected)
+
+        self.requestor.secret = 'other secret'
+        self.assertEqual(
+            self.requestor.sign(10001, u'EUR100', 'json'),
+            hashlib.sha1(b'1000&10001&EUR100&json&other secret').hexdigest())
+
     def test_empty_response(self):
         for method in VALID_API_METHODS:
             self.mock_response('{}', 500)
@@ -108,6 +243,24 @@ class APIRequestorTests(FerbuyUnitTestCase):
         self.requestor.request('get', self.valid_path, {}, {'foo': 'bar'})
         self.check_call('get', headers=MatchHeaders(extra={'foo': 'bar'}))
 
+    def test_static_headers_computed_once(self):
+        self.mock_response('{"api": {}}', 200)
+
+        with patch.dict(ferbuy.api_requestor._headers, clear=True):
+            with patch('ferbuy.api_requestor.platform') as platform:
+                platform.platform.return_value = 'Linux'
+                platform.python_version.return_value = '2.7'
+
+                self.requestor.request('post', self.valid_path, {})
+                self.requestor.request('post', self.valid_path, {},
+                                       {'foo': 'bar'})
+
+                self.assertEqual(platform.platform.call_count, 1)
+
+        self.check_call('post', headers=MatchHeaders(
+            extra={'foo': 'bar'}, request_method='post'), post_data='')
+        self.assertFalse('foo' in ferbuy.api_requestor._static_headers('post'))
+
     def test_invalid_method(self):
         self.mock_response('{"api": {}}', 200)
 
@@ -123,9 +276,35 @@ class APIRequestorTests(FerbuyUnitTestCase):
     def test_invalid_request_error(self):
         self.mock_response('{"api": {}}', 400)
 
-        with self.assertRaises(ferbuy.errors.InvalidRequestError):
+        with self.assertRaises(ferbuy.errors.InvalidRequestError) as cm:
             self.requestor.request('post', self.valid_path, {})
 
+        self.assertEqual(cm.exception.http_status, 400)
+        self.assertEqual(cm.exception.http_body, '{"api": {}}')
+
+    def test_error_body_truncated(self):
+        body = u'<html>\u20ac' + u'x' * 5000
+        self.mock_response(body.encode('utf-8'), 502)
+
+        with patch('ferbuy.max_logged_body_size', 8):
+            with self.assertRaises(ferbuy.errors.APIError) as cm:
+                self.requestor.request('post', self.valid_path, {})
+
+        # The euro sign cut in half is dropped
+        self.assertEqual(cm.exception.http_body, u'<html>')
+        self.assertEqual(cm.exception.http_body_size, 5009)
+
+    def test_logged_body_truncated(self):
+        self.mock_response('{"api": {}}' + ' ' * 5000, 200)
+
+        with patch('ferbuy.utils.logger') as logger:
+            logger.isEnabledFor.return_value = True
+            with patch('ferbuy.max_logged_body_size', 11):
+                self.requestor.request('post', self.valid_path, {})
+
+        message = logger.info.call_args[0][0]
+        self.assertTrue(message.endswith('200, {"api": {}}... (5011 bytes))'))
+
     def test_valid_response(self):
         self.mock_response(
             '{"api":{"response":{"code":200,'
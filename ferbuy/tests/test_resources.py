@@ -17,10 +17,12 @@ class ResourceTests(FerbuyUnitTestCase):
         self.http_client = Mock(ferbuy.http_client.HTTPClient)
         self.http_client.name = 'mockclient'
 
+        ferbuy.site_id = 1000
+        ferbuy.secret = 'dummy secret'
+
         self.requestor = ferbuy.api_requestor.APIRequestor(
-            site_id=1000,
-            secret='dummy secret',
             client=self.http_client)
+        ferbuy.api_requestor.APIRequestor.register(self.requestor)
 
     @property
     def valid_path(self):
@@ -124,6 +126,22 @@ class OrderResourceTests(ResourceTests):
         self.assertEqual(req.response.message,
                          "Transaction ID 10001 is already marked as shipped")
 
+    def test_per_call_credentials(self):
+        other = ferbuy.api_requestor.APIRequestor(
+            site_id=2000, secret='other secret', client=self.http_client)
+        ferbuy.api_requestor.APIRequestor.register(other)
+        self.mock_response('{"api":{"response":{"code":200}}}', 200)
+
+        ferbuy.Order.shipped(transaction_id=10001, courier='DHL',
+                             tracking_number=123456, site_id=2000,
+                             secret='other secret')
+
+        post_data = self.http_client.request.call_args[0][3]
+        self.assertTrue('site_id=2000' in post_data)
+        self.assertTrue(
+            'checksum={0}'.format(other.sign(10001, 'DHL:123456', 'json'))
+            in post_data)
+
     def test_delivered_exception(self):
         with self.assertRaises(ValueError):
             ferbuy.Order.delivered(transaction_id=10001, date='invalid date')
@@ -0,0 +1,163 @@
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from ferbuy.http_client import HTTPResponse
+from ferbuy.retry import RetryPolicy, RetryState
+from .utils import FerbuyUnitTestCase
+
+OK_RESPONSE = '{"api":{"response":{"message":null,"code":200}}}'
+
+
+class RetryPolicyTests(unittest.TestCase):
+
+    def call(self, policy, responses, idempotent=True):
+        send = Mock(side_effect=responses)
+        sleep = Mock()
+        state = RetryState()
+        try:
+            response = policy.call(send, state, idempotent, sleep=sleep)
+        except ferbuy.errors.APIConnectionError:
+            response = None
+        return response, state, sleep
+
+    def test_success_first_attempt(self):
+        response, state, sleep = self.call(RetryPolicy(), [('{}', 200)])
+
+        self.assertEqual(response, ('{}', 200))
+        self.assertEqual(state.attempts, 1)
+        self.assertEqual(state.retries, 0)
+        self.assertFalse(sleep.called)
+
+    def test_retry_status(self):
+        response, state, sleep = self.call(
+            RetryPolicy(jitter=False, backoff=1),
+            [('', 503), ('', 502), ('{}', 200)])
+
+        self.assertEqual(response, ('{}', 200))
+        self.assertEqual(state.attempts, 3)
+        self.assertEqual([d for _, _, d in state.history], [1, 2])
+        self.assertEqual([o for _, o, _ in state.history], [503, 502])
+        self.assertEqual(state.delay, 3)
+        sleep.assert_any_call(1)
+        sleep.assert_any_call(2)
+
+    def test_max_attempts(self):
+        response, state, sleep = self.call(
+            RetryPolicy(max_attempts=2), [('', 503), ('', 503), ('{}', 200)])
+
+        self.assertEqual(response, ('', 503))
+        self.assertEqual(state.attempts, 2)
+
+    def test_not_retried_status(self):
+        response, state, sleep = self.call(RetryPolicy(), [('', 400)])
+        self.assertEqual(response, ('', 400))
+        self.assertEqual(state.attempts, 1)
+
+    def test_connection_error(self):
+        error = ferbuy.errors.APIConnectionError('boom')
+        response, state, sleep = self.call(
+            RetryPolicy(), [error, ('{}', 200)])
+
+        self.assertEqual(response, ('{}', 200))
+        self.assertEqual(state.history[0][1], error)
+
+    def test_not_idempotent(self):
+        error = ferbuy.errors.APIConnectionError('boom')
+
+        response, state, _ = self.call(RetryPolicy(), [error], False)
+        self.assertEqual(state.attempts, 1)
+
+        response, state, _ = self.call(
+            RetryPolicy(), [('', 504), ('{}', 200)], False)
+        self.assertEqual(response, ('', 504))
+
+        response, state, _ = self.call(
+            RetryPolicy(), [('', 503), ('{}', 200)], False)
+        self.assertEqual(response, ('{}', 200))
+
+    def test_retry_after(self):
+        throttled = HTTPResponse('', 429, {'Retry-After': '7'})
+        response, state, sleep = self.call(
+            RetryPolicy(backoff=0.1), [throttled, ('{}', 200)])
+
+        sleep.assert_called_once_with(7.0)
+
+    def test_retry_after_date(self):
+        policy = RetryPolicy()
+        response = HTTPResponse('', 503, {
+            'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+        self.assertEqual(policy.retry_after(response), 0)
+
+    def test_deadline(self):
+        response, state, sleep = self.call(
+            RetryPolicy(jitter=False, backoff=10, deadline=5),
+            [('', 503), ('{}', 200)])
+
+        self.assertEqual(response, ('', 503))
+        self.assertEqual(state.attempts, 1)
+
+    def test_jitter(self):
+        policy = RetryPolicy(backoff=1, max_backoff=4)
+        for attempt in range(1, 6):
+            delay = policy.backoff_delay(attempt)
+            self.assertTrue(0 <= delay <= min(2 ** (attempt - 1), 4))
+
+
+class RequestorRetryTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(RequestorRetryTests, self).setUp()
+
+        self.http_client = Mock(ferbuy.http_client.HTTPClient)
+        self.requestor = ferbuy.api_requestor.APIRequestor(
+            site_id=1000,
+            secret='dummy secret',
+            client=self.http_client,
+            retry_policy=RetryPolicy(jitter=False, backoff=0))
+
+    def test_retry_state_on_result(self):
+        self.http_client.request = Mock(
+            side_effect=[('', 503), (OK_RESPONSE, 200)])
+
+        result = self.requestor.request('post', '/dummy', {})
+
+        self.assertEqual(result.response.code, 200)
+        self.assertEqual(result.retry_state.attempts, 2)
+        self.assertTrue(result.retry_state.elapsed >= 0)
+
+    def test_retry_state_on_error(self):
+        self.http_client.request = Mock(return_value=('', 503))
+
+        with self.assertRaises(ferbuy.errors.APIError) as cm:
+            self.requestor.request('post', '/dummy', {})
+
+        self.assertEqual(cm.exception.retry_state.attempts, 3)
+
+    def test_module_policy(self):
+        requestor = ferbuy.api_requestor.APIRequestor(
+            site_id=1000, secret='dummy secret', client=self.http_client)
+        self.http_client.request = Mock(
+            side_effect=[('', 503), (OK_RESPONSE, 200)])
+
+        with patch('ferbuy.retry_policy', RetryPolicy(backoff=0)):
+            result = requestor.request('post', '/dummy', {})
+
+        self.assertEqual(result.retry_state.attempts, 2)
+
+    def test_refund_not_retried(self):
+        ferbuy.site_id = 1000
+        ferbuy.secret = 'dummy secret'
+        ferbuy.api_requestor.APIRequestor.register(self.requestor)
+        self.http_client.request = Mock(
+            side_effect=[('', 504), (OK_RESPONSE, 200)])
+
+        with self.assertRaises(ferbuy.errors.APIError):
+            ferbuy.Transaction.refund(10001, 100, 'EUR')
+
+        self.assertEqual(self.http_client.request.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,122 @@
+import unittest
+
+from mock import patch
+
+import ferbuy
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.gateway import CallbackVerifier, GatewayBuilder
+from ferbuy.signing import BatchSigner
+from .test_gateway import callback, order
+from .utils import FerbuyTestCase
+
+
+def request(index):
+    return {'transaction_id': 10000 + index,
+            'command': 'DHL:{0}'.format(index), 'output_type': 'json',
+            'site_id': 1000}
+
+
+class BatchSignerTests(FerbuyTestCase):
+
+    def setUp(self):
+        super(BatchSignerTests, self).setUp()
+        ferbuy.env = 'test'
+        ferbuy.site_id = 1000
+        ferbuy.secret = 'dummy secret'
+        self.signer = BatchSigner(
+            secrets={2000: 'other secret'}, processes=2, chunksize=3,
+            min_batch=0)
+        self.addCleanup(self.signer.close)
+
+    def test_sign(self):
+        rows = [order(index) for index in range(20)]
+
+        payloads = list(self.signer.sign(rows))
+
+        self.assertEqual(payloads, list(GatewayBuilder().build(rows)))
+        self.assertTrue(self.signer._pool is not None)
+
+    def test_sign_columnar(self):
+        rows = [order(index) for index in range(5)]
+        table = dict((field, [row[field] for row in rows])
+                     for field in rows[0])
+
+        self.assertEqual(list(self.signer.sign(table)),
+                         list(GatewayBuilder().build(rows)))
+
+    def test_sign_requests(self):
+        records = [request(index) for index in range(10)]
+        requestor = APIRequestor(site_id=1000, secret='dummy secret')
+
+        checksums = list(self.signer.sign_requests(records))
+
+        self.assertEqual(checksums,
+                         [requestor.sign(**record) for record in records])
+
+    def test_verify_callbacks(self):
+        callbacks = [callback(), callback(checksum='0' * 40),
+                     callback(secret='other secret', site_id='2000'),
+                     callback(site_id='3000')] * 3
+        expected = CallbackVerifier(
+            secrets={2000: 'other secret'},
+            secret='dummy secret').verify_many(callbacks)
+
+        self.assertEqual(list(self.signer.verify_callbacks(callbacks)),
+                         expected)
+        self.assertEqual(
+            list(self.signer.verify_callbacks(callbacks, reasons=True))[:2],
+            [None, CallbackVerifier.INVALID_CHECKSUM])
+
+    def test_site_id(self):
+        callbacks = [callback(secret='other secret')] * 4
+        self.assertEqual(
+            list(self.signer.verify_callbacks(callbacks, site_id=2000)),
+            [True] * 4)
+
+    def test_settings_resolved_once(self):
+        signer = BatchSigner(processes=1)
+        ferbuy.secret = 'changed secret'
+        self.assertEqual(signer.settings['secret'], 'dummy secret')
+
+    def test_credentials_missing(self):
+        ferbuy.secret = None
+        signer = BatchSigner(secrets={2000: 'other secret'}, processes=1)
+
+        with self.assertRaises(ValueError):
+            signer.sign([order(1)])
+        with self.assertRaises(ValueError):
+            signer.sign_requests([request(1)])
+        callbacks = [callback(secret='other secret', site_id='2000')]
+        self.assertEqual(list(signer.verify_callbacks(callbacks)), [True])
+
+    def test_worker_error(self):
+        rows = [order(index) for index in range(10)]
+        del rows[7]['amount']
+        with self.assertRaises(KeyError):
+            list(self.signer.sign(rows))
+
+    def test_small_batch_in_process(self):
+        signer = BatchSigner(processes=4, min_batch=100)
+        with patch('multiprocessing.Pool') as pool:
+            payloads = list(signer.sign(order(index) for index in range(99)))
+        self.assertFalse(pool.called)
+        self.assertEqual(len(payloads), 99)
+
+    def test_single_process(self):
+        signer = BatchSigner(processes=1, min_batch=0)
+        with patch('multiprocessing.Pool') as pool:
+            list(signer.sign([order(1)]))
+        self.assertFalse(pool.called)
+
+    def test_pool_kept(self):
+        list(self.signer.sign([order(1)] * 5))
+        pool = self.signer._pool
+        list(self.signer.sign([order(2)] * 5))
+        self.assertTrue(self.signer._pool is pool)
+
+        self.signer.close()
+        self.assertTrue(self.signer._pool is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import threading
+import time
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.singleflight import SingleFlight
+from .utils import FerbuyUnitTestCase
+
+OK_RESPONSE = '{"api":{"response":{"message":"ok","code":200}}}'
+
+
+def concurrently(count, func):
+    results = [None] * count
+
+    def run(index):
+        try:
+            results[index] = func()
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+class SingleFlightTests(unittest.TestCase):
+
+    def slow(self, result=None, error=None):
+        calls = []
+
+        def func():
+            calls.append(1)
+            time.sleep(0.05)
+            if error is not None:
+                raise error
+            return result
+        return func, calls
+
+    def test_shared_result(self):
+        flight = SingleFlight()
+        func, calls = self.slow(result=object())
+
+        results = concurrently(5, lambda: flight.do('key', func))
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+
+    def test_shared_error(self):
+        flight = SingleFlight()
+        error = ferbuy.errors.APIError('boom')
+        func, calls = self.slow(error=error)
+
+        results = concurrently(5, lambda: flight.do('key', func))
+
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(r is error for r in results))
+
+    def test_different_keys(self):
+        flight = SingleFlight()
+        func, calls = self.slow()
+
+        concurrently(2, lambda: flight.do(threading.current_thread(), func))
+
+        self.assertEqual(len(calls), 2)
+
+    def test_sequential_calls_not_cached(self):
+        flight = SingleFlight()
+        func = Mock(return_value=1)
+
+        flight.do('key', func)
+        flight.do('key', func)
+
+        self.assertEqual(func.call_count, 2)
+
+    def test_cache(self):
+        flight = SingleFlight(cache_ttl=60)
+        func = Mock(return_value=1)
+
+        self.assertEqual(flight.do('key', func), 1)
+        self.assertEqual(flight.do('key', func), 1)
+        self.assertEqual(func.call_count, 1)
+
+        flight.forget('key')
+        flight.do('key', func)
+        self.assertEqual(func.call_count, 2)
+
+    def test_errors_not_cached(self):
+        flight = SingleFlight(cache_ttl=60)
+        func = Mock(side_effect=[ferbuy.errors.APIError('boom'), 1])
+
+        with self.assertRaises(ferbuy.errors.APIError):
+            flight.do('key', func)
+        self.assertEqual(flight.do('key', func), 1)
+
+
+class RequestorSingleFlightTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(RequestorSingleFlightTests, self).setUp()
+
+        def request(*args):
+            time.sleep(0.05)
+            return (OK_RESPONSE, 200)
+
+        self.http_client = Mock(ferbuy.http_client.HTTPClient)
+        self.http_client.request = Mock(side_effect=request)
+        self.requestor = APIRequestor(
+            site_id=1000, secret='dummy secret', client=self.http_client,
+            single_flight=SingleFlight())
+
+    def test_identical_requests(self):
+        data = {'transaction_id': 10001, 'command': 'EUR100'}
+
+        results = concurrently(4, lambda: self.requestor.request(
+            'post', '/RefundTransaction', dict(data), idempotent=False))
+
+        self.assertEqual(self.http_client.request.call_count, 1)
+        self.assertTrue(all(r.response.code == 200 for r in results))
+
+    def test_different_requests(self):
+        counter = iter(range(4))
+
+        concurrently(4, lambda: self.requestor.request(
+            'post', '/RefundTransaction', {'transaction_id': next(counter)}))
+
+        self.assertEqual(self.http_client.request.call_count, 4)
+
+    def test_module_setting(self):
+        self.requestor.single_flight = None
+
+        with patch('ferbuy.single_flight', SingleFlight(cache_ttl=60)):
+            self.requestor.request('post', '/dummy', {'a': 1})
+            self.requestor.request('post', '/dummy', {'a': 1})
+
+        self.assertEqual(self.http_client.request.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,161 @@
+import random
+import time
+import unittest
+
+from mock import Mock, patch
+
+import ferbuy
+from ferbuy import stats
+from ferbuy.api_requestor import APIRequestor
+from ferbuy.hooks import RequestContext
+from .utils import FerbuyUnitTestCase
+
+OK_RESPONSE = '{"api":{"response":{"message":"ok","code":200}}}'
+
+
+def context(endpoint, elapsed, status_code=200, timings=None):
+    result = RequestContext('post', endpoint)
+    result.started = time.time() - elapsed
+    result.status_code = status_code
+    result.attempt = 1
+    result.timings = timings or {}
+    return result
+
+
+class HistogramTests(unittest.TestCase):
+
+    def test_buckets(self):
+        for micros in (0, 1, 31, 32, 63, 64, 65, 1000, 123456, 10 ** 7):
+            index = stats._bucket(micros)
+            self.assertTrue(stats._bucket_value(index) >= micros)
+            self.assertTrue(stats._bucket_value(index) <= micros * 1.04 + 1)
+        self.assertEqual(stats._bucket(10 ** 12), stats.BUCKETS - 1)
+
+    def test_percentiles(self):
+        histogram = stats.Histogram()
+        values = [random.uniform(0.001, 2) for _ in range(10000)]
+        for value in values:
+            histogram.record(value)
+        values.sort()
+
+        p50, p90, p99, p999 = histogram.percentiles()
+        for estimate, exact in ((p50, values[4999]), (p90, values[8999]),
+                                (p99, values[9899]), (p999, values[9989])):
+            self.assertTrue(abs(estimate - exact) <= exact * 0.04,
+                            (estimate, exact))
+        self.assertEqual(len(histogram.counts), stats.BUCKETS)
+
+    def test_summary(self):
+        histogram = stats.Histogram()
+        self.assertEqual(histogram.summary(), {'count': 0})
+
+        histogram.record(0.010)
+        histogram.record(0.030)
+        summary = histogram.summary()
+
+        self.assertEqual(summary['count'], 2)
+        self.assertAlmostEqual(summary['mean_ms'], 20)
+        self.assertAlmostEqual(summary['max_ms'], 30)
+        self.assertTrue(9.6 <= summary['p50_ms'] <= 10.4)
+        self.assertAlmostEqual(summary['p99_ms'], 30)
+
+
+class StatsCollectorTests(unittest.TestCase):
+
+    def test_per_endpoint_and_status(self):
+        collector = stats.StatsCollector()
+        collector.after_response(context('/MarkOrderShipped', 0.01))
+        collector.after_response(context('/MarkOrderShipped', 0.02))
+        collector.after_response(context('/RefundTransaction', 0.5, 503))
+        collector.on_error(context('/RefundTransaction', 1, None), None)
+
+        endpoints = collector.stats()['endpoints']
+
+        self.assertEqual(endpoints['/MarkOrderShipped']['2xx']['count'], 2)
+        self.assertEqual(
+            sorted(endpoints['/RefundTransaction']), ['5xx', 'error'])
+
+    def test_slowest(self):
+        collector = stats.StatsCollector(slowest=3)
+        for elapsed in (0.1, 0.5, 0.2, 0.9, 0.3, 0.05):
+            collector.after_response(context(
+                '/ConfirmDelivery', elapsed, timings={'wait': elapsed / 2}))
+
+        slowest = collector.stats()['slowest']
+
+        self.assertEqual([round(call['elapsed_ms'], -1) for call in slowest],
+                         [900, 500, 300])
+        self.assertEqual(round(slowest[0]['timings_ms']['wait'], -1), 450)
+        self.assertEqual(slowest[0]['endpoint'], '/ConfirmDelivery')
+
+    def test_slowest_window(self):
+        collector = stats.StatsCollector(slowest=1, window=60)
+        now = time.time()
+
+        def call(endpoint, elapsed, offset):
+            with patch('time.time', return_value=now + offset):
+                collector.after_response(context(endpoint, elapsed))
+            return [c['endpoint'] for c in collector.stats()['slowest']]
+
+        self.assertEqual(call('/old', 0.9, 0), ['/old'])
+        # The previous window is still reported
+        self.assertEqual(call('/new', 0.1, 61), ['/old'])
+        self.assertEqual(call('/newer', 0.05, 122), ['/new'])
+
+    def test_dump(self):
+        collector = stats.StatsCollector(dump_interval=60)
+        with patch('ferbuy.utils.logger') as logger:
+            collector.after_response(context('/MarkOrderShipped', 0.01))
+            self.assertFalse(logger.info.called)
+
+            later = context('/MarkOrderShipped', 0.01)
+            with patch('time.time', return_value=time.time() + 61):
+                collector.after_response(later)
+
+        messages = [c[0][0] for c in logger.info.call_args_list]
+        self.assertTrue(messages[0].startswith(
+            'FerBuy /MarkOrderShipped 2xx: 2 calls'))
+
+    def test_reset(self):
+        collector = stats.StatsCollector()
+        collector.after_response(context('/MarkOrderShipped', 0.01))
+        collector.reset()
+        self.assertEqual(collector.stats(), {'endpoints': {}, 'slowest': []})
+
+
+class RequestorStatsTests(FerbuyUnitTestCase):
+
+    def setUp(self):
+        super(RequestorStatsTests, self).setUp()
+        self.http_client = Mock(ferbuy.http_client.HTTPClient)
+        self.http_client.request = Mock(return_value=(OK_RESPONSE, 200))
+        self.requestor = APIRequestor(site_id=1000, secret='dummy secret',
+                                      client=self.http_client)
+
+    def test_stats(self):
+        self.requestor.request('post', '/MarkOrderShipped', {'a': 1})
+        self.http_client.request.return_value = ('', 500)
+        with self.assertRaises(ferbuy.errors.APIError):
+            self.requestor.request('post', '/MarkOrderShipped', {'a': 1})
+
+        result = self.requestor.stats()
+
+        self.assertEqual(
+            result['endpoints']['/MarkOrderShipped']['2xx']['count'], 1)
+        self.assertEqual(
+            result['endpoints']['/MarkOrderShipped']['5xx']['count'], 1)
+        self.assertEqual(len(result['slowest']), 2)
+        self.assertTrue('parse' in result['slowest'][0]['timings_ms'])
+
+    def test_kept_when_secret_changes(self):
+        APIRequestor.register(self.requestor)
+        self.requestor.request('post', '/MarkOrderShipped', {'a': 1})
+
+        other = APIRequestor.for_site(1000, 'new secret')
+
+        self.assertTrue(other is not self.requestor)
+        self.assertTrue(other.stats()['endpoints'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+import sys
+import unittest
+
+import ferbuy
+from ferbuy import http_client
+from ferbuy.api_requestor import APIRequestor
+from .stub_gateway import StubGateway
+from .utils import FerbuyTestCase
+
+
+def clients():
+    if sys.version_info >= (3, 0):
+        yield http_client.Urllib3Client()
+    else:
+        yield http_client.Urllib2Client()
+    if http_client._load_requests() is not None:
+        yield http_client.RequestsClient()
+
+
+class StubGatewayTests(FerbuyTestCase):
+
+    def setUp(self):
+        super(StubGatewayTests, self).setUp()
+        self.server = StubGateway(secret='dummy secret').start()
+
+    def tearDown(self):
+        super(StubGatewayTests, self).tearDown()
+        self.server.stop()
+
+    def requestor(self, client):
+        return APIRequestor(site_id=1000, secret='dummy secret',
+                            api_base=self.server.api_base, client=client)
+
+    def post_data(self, requestor, command='DHL:1234'):
+        return ferbuy.resources.Resource._post_data(
+            requestor, 10001, command)
+
+    def test_shipped(self):
+        for client in clients():
+            requestor = self.requestor(client)
+            result = requestor.request(
+                'post', '/MarkOrderShipped', self.post_data(requestor))
+
+            self.assertEqual(result.response.code, 200)
+            self.assertEqual(result.request.transaction_id, '10001')
+
+        self.assertTrue(self.server.requests['/MarkOrderShipped'] >= 1)
+
+    def test_response_size(self):
+        self.server.response_size = 2048
+        requestor = self.requestor(next(clients()))
+        result = requestor.request(
+            'post', '/RefundTransaction', self.post_data(requestor, '100'))
+
+        self.assertEqual(len(result.response.message), 2048)
+
+    def test_response_too_large(self):
+        self.server.response_size = 64 * 1024
+        for client in clients():
+            client.max_body_size = 1024
+            requestor = self.requestor(client)
+            with self.assertRaises(ferbuy.errors.ResponseTooLargeError):
+                requestor.request(
+                    'post', '/MarkOrderShipped', self.post_data(requestor))
+
+            # The client recovers from the dropped connection
+            self.server.response_size = 0
+            result = requestor.request(
+                'post', '/MarkOrderShipped', self.post_data(requestor))
+            self.assertEqual(result.response.code, 200)
+            self.server.response_size = 64 * 1024
+
+    def test_error_rate(self):
+        self.server.error_rate = 1
+        for client in clients():
+            requestor = self.requestor(client)
+            with self.assertRaises(ferbuy.errors.APIError) as cm:
+                requestor.request(
+                    'post', '/ConfirmDelivery', self.post_data(requestor))
+            self.assertEqual(cm.exception.http_status, 500)
+
+    def test_checksum(self):
+        requestor = self.requestor(next(clients()))
+        post_data = self.post_data(requestor)
+        post_data['checksum'] = 'invalid'
+
+        with self.assertRaises(ferbuy.errors.InvalidRequestError):
+            requestor.request('post', '/MarkOrderShipped', post_data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from mock import Mock
+
+from ferbuy.utils import TTLCache, compare_digest
+
+
+class TTLCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Mock(return_value=100.0)
+        self.cache = TTLCache(maxsize=2, ttl=10, clock=self.clock)
+
+    def test_get_set(self):
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertEqual(self.cache.get('b', 2), 2)
+        self.assertTrue('a' in self.cache)
+
+    def test_expire(self):
+        self.cache.set('a', 1)
+        self.clock.return_value = 110.0
+        self.assertFalse('a' in self.cache)
+
+    def test_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+
+        self.assertEqual(len(self.cache), 2)
+        self.assertTrue('a' in self.cache)
+        self.assertFalse('b' in self.cache)
+
+    def test_add(self):
+        self.assertTrue(self.cache.add('a'))
+        self.assertFalse(self.cache.add('a'))
+        self.clock.return_value = 111.0
+        self.assertTrue(self.cache.add('a'))
+
+    def test_pop(self):
+        self.cache.set('a', 1)
+        self.assertEqual(self.cache.pop('a'), 1)
+        self.assertEqual(self.cache.pop('a'), None)
+
+
+class CompareDigestTests(unittest.TestCase):
+
+    def test_compare(self):
+        self.assertTrue(compare_digest(b'abc', b'abc'))
+        self.assertFalse(compare_digest(b'abc', b'abd'))
+        self.assertFalse(compare_digest(b'abc', b'ab'))
+
+
+if __name__ == '__main__':
+    unittest.main()
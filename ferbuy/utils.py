@@ -1,4 +1,21 @@
 import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+try:
+    from hmac import compare_digest
+except ImportError:
+    # Python < 2.7.7
+    def compare_digest(a, b):
+        """Compare two strings in time independent of where they differ."""
+        if len(a) != len(b):
+            return False
+        result = 0
+        for x, y in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
 
 logger = logging.getLogger('ferbuy')
 
@@ -21,14 +38,83 @@ if not (json and hasattr(json, 'loads')):
 class _Singleton(type):
 
     _instances = {}
+    _lock = threading.Lock()
 
     def __call__(cls, *args, **kwargs):
         if cls not in cls._instances:
-            cls._instances[cls] = super(
-                _Singleton, cls).__call__(*args, **kwargs)
+            with cls._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(
+                        _Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
 
 class Singleton(_Singleton('SingletonMeta', (object,), {})):
     """Singleton pattern working with Python 2 & 3 versions"""
     pass
+
+
+class TTLCache(object):
+    """Thread-safe mapping keeping at most `maxsize` recently used items.
+
+    Items expire `ttl` seconds after they were set.
+    """
+
+    _missing = object()
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return self.get(key, self._missing) is not self._missing
+
+    def _get(self, key, now):
+        item = self._items.pop(key, None)
+        if item is None:
+            return self._missing
+        value, expires = item
+        if expires is not None and expires <= now:
+            return self._missing
+        self._items[key] = item
+        return value
+
+    def _set(self, key, value, now):
+        expires = now + self.ttl if self.ttl is not None else None
+        self._items.pop(key, None)
+        self._items[key] = (value, expires)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value = self._get(key, self.clock())
+        return default if value is self._missing else value
+
+    def set(self, key, value):
+        with self._lock:
+            self._set(key, value, self.clock())
+
+    def add(self, key, value=True):
+        """Set `key` unless it is present, return whether it was set."""
+        with self._lock:
+            now = self.clock()
+            if self._get(key, now) is not self._missing:
+                return False
+            self._set(key, value, now)
+            return True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
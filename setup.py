@@ -28,6 +28,10 @@ if sys.version_info < (2, 6):
 else:
     install_requires.append('requests >= 0.8.8')
 
+# concurrent.futures is only part of the standard library since Python 3.2
+if sys.version_info < (3, 2):
+    install_requires.append('futures')
+
 # Don't import ferbuy module here, since deps may not be installed
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'ferbuy'))
 from version import VERSION